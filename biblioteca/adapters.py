@@ -0,0 +1,79 @@
+"""Conversión de los tipos de PostgreSQL propios del esquema en el driver.
+
+Las columnas `price` de copias y `amount` de pagos se declaran como `money`,
+que con el `search_path` por defecto es el tipo nativo `pg_catalog.money` (el
+compuesto `public.money` de la migración 0001 queda oculto). psycopg2 lo
+entrega como texto con formato de moneda (`-$1,234.50` con `lc_monetary=C`);
+aquí se registra un typecaster que lo convierte una sola vez, al leer la fila,
+en `Money(Decimal, moneda)`, de modo que `MoneyField` no necesita conversión
+por fila en Python.
+
+Los ENUM `book_condition` y `rating_scale` ya llegan como `str` sin
+conversión; sus campos no definen `from_db_value`.
+"""
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.conf import settings
+
+MONEY_OID = 790
+MONEY_ARRAY_OID = 791
+
+_nueva_tupla = tuple.__new__
+
+_registrado = False
+
+
+class Money(NamedTuple):
+    amount: Decimal
+    currency: str
+
+    def __str__(self):
+        return f"{self.amount} {self.currency}"
+
+
+def moneda_por_defecto():
+    return getattr(settings, "MONEDA", "USD")
+
+
+def _cantidad(texto):
+    # Símbolo y separador de miles de la salida de `money` con lc_monetary=C.
+    # (`str.replace` encadenado es varias veces más rápido que `translate` o
+    # una expresión regular sobre cadenas tan cortas.)
+    return Decimal(texto.replace("$", "").replace(",", ""))
+
+
+def money_desde_texto(texto, moneda=None):
+    """`'-$1,234.50'` (salida de `money`) o `'1234.50 USD'` → `Money`."""
+    cantidad, _, codigo = texto.strip().partition(" ")
+    return Money(_cantidad(cantidad), codigo or moneda or moneda_por_defecto())
+
+
+def money_registrado():
+    return _registrado
+
+
+def registrar():
+    """Registra los typecasters en psycopg2 (una vez por proceso)."""
+    global _registrado
+    if _registrado:
+        return
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    if is_psycopg3:
+        # psycopg 3 no usa typecasters; MoneyField convierte el texto
+        return
+
+    from psycopg2.extensions import new_array_type, new_type, register_type
+
+    moneda = moneda_por_defecto()
+
+    def leer_money(valor, cursor):
+        if valor is None:
+            return None
+        # tuple.__new__ evita el __new__ en Python de NamedTuple (por fila)
+        return _nueva_tupla(Money, (_cantidad(valor), moneda))
+
+    money = new_type((MONEY_OID,), "MONEY", leer_money)
+    register_type(money)
+    register_type(new_array_type((MONEY_ARRAY_OID,), "MONEY[]", money))
+    _registrado = True
@@ -1,19 +1,37 @@
+from django import forms
 from django.contrib import admin
+from django.forms.models import BaseInlineFormSet
 from .models import (
     CatalogoLibros, PrestamosUsuarios, ActividadSucursales,
-    Book, LibraryUser, Loan, Branch, BookAuthor, BookGenre, Copy, Review
+    Book, LibraryUser, Loan, Branch, BookAuthor, BookGenre, Copy, Review, Shelf
 )
+from .autocomplete import AutocompletarAdminMixin, AutocompletarSelect
+from .search import filtro_indexado
+
+
+class IndexedCatalogSearchMixin:
+    """Búsqueda del admin: la de subcadena de Django sobre `search_fields`
+    (cubierta por los índices de trigramas sobre `UPPER(col)`) más, en la misma
+    consulta, lo que encuentran los índices de search.py (texto completo,
+    similitud de trigramas, prefijo de ISBN)."""
+    search_fields = ('title',)
+
+    def get_search_results(self, request, queryset, search_term):
+        resultado, duplicados = super().get_search_results(request, queryset, search_term)
+        if not search_term.strip():
+            return resultado, duplicados
+        return resultado | queryset.filter(filtro_indexado(search_term)), duplicados
 
 # ————————————————————————————————
 #  Listados basados en las vistas (solo lectura)
 # ————————————————————————————————
 
 @admin.register(CatalogoLibros)
-class CatalogoAdmin(admin.ModelAdmin):
+class CatalogoAdmin(IndexedCatalogSearchMixin, admin.ModelAdmin):
     list_display = (
         'isbn','title','autor_principal','rating_promedio','estado_disponibilidad',
     )
-    search_fields = ('title','isbn','autor_principal')
+    search_fields = ('title','autor_principal')
     list_filter = ('condition',)
     # deshabilitar adición/edición/borrado
     def has_add_permission(self,   request): return False
@@ -46,31 +64,93 @@ class ActividadSucursalesAdmin(admin.ModelAdmin):
 #  CRUD completo sobre las tablas reales
 # ————————————————————————————————
 
-class BookAuthorInline(admin.TabularInline):
+class OpcionesCompartidasMixin:
+    """Las opciones de los `<select>` de FK se leen una vez por petición y no
+    una vez por fila: cada formulario del inline copia el campo y, con un
+    queryset, volvería a consultarlo al pintarse (y el admin construye el
+    formset varias veces por petición)."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        campo = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if (campo is None or request is None or db_field.related_model is self.parent_model
+                or isinstance(campo.widget, AutocompletarSelect)):
+            return campo
+        opciones = request.__dict__.setdefault("_opciones_fk", {})
+        clave = (db_field.model, db_field.name)
+        if clave not in opciones:
+            # Por comprensión: list() pediría antes len() (un COUNT)
+            opciones[clave] = [opcion for opcion in campo.choices]
+        campo.choices = opciones[clave]
+        return campo
+
+class BookAuthorInline(AutocompletarAdminMixin, OpcionesCompartidasMixin, admin.TabularInline):
     model = BookAuthor
     extra = 1
 
-class BookGenreInline(admin.TabularInline):
+class BookGenreInline(OpcionesCompartidasMixin, admin.TabularInline):
     model = BookGenre
     extra = 1
 
-class CopyInline(admin.TabularInline):
+class CopyInline(OpcionesCompartidasMixin, admin.TabularInline):
     model = Copy
     extra = 1
 
-class ReviewInline(admin.TabularInline):
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "shelf":
+            # Shelf.__str__ usa la sucursal
+            kwargs["queryset"] = Shelf.objects.select_related("branch")
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+class UltimasReseniasFormSet(BaseInlineFormSet):
+    """Solo las `limite` reseñas más recientes, con su usuario.
+
+    Se filtran por `pk IN (subselect con LIMIT)` y no con un slice, para que el
+    formset pueda seguir guardando y borrando. En las existentes el usuario no
+    se edita (es el autor) y se pinta con la fila ya leída, sin una consulta
+    por fila; las nuevas lo eligen con autocompletado."""
+    limite = 20
+
+    def get_queryset(self):
+        if not hasattr(self, "_ultimas"):
+            qs = super().get_queryset()
+            ultimas = qs.order_by("-created_at", "-id").values("pk")[:self.limite]
+            self._ultimas = (qs.filter(pk__in=ultimas)
+                               .select_related("user").order_by("-created_at", "-id"))
+        return self._ultimas
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        if form.instance.pk is not None:
+            usuario = form.instance.user
+            form.fields["user"].disabled = True
+            form.fields["user"].widget = forms.Select(choices=[(usuario.pk, str(usuario))])
+
+class ReviewInline(AutocompletarAdminMixin, admin.TabularInline):
+    """Un libro puede tener miles de reseñas: se editan las últimas
+    (UltimasReseniasFormSet) y el resto en el admin de reseñas."""
     model = Review
-    extra = 0  # si no quieres huecos en blanco
+    formset = UltimasReseniasFormSet
+    fields = ("user", "rating", "comment", "created_at")
+    readonly_fields = ("created_at",)
+    extra = 0
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(AutocompletarAdminMixin, IndexedCatalogSearchMixin, admin.ModelAdmin):
     list_display = ('isbn','title','main_author','condition','created_at')
-    search_fields = ('isbn','title')
     list_filter = ('condition','published_year')
     inlines = [BookAuthorInline, BookGenreInline, CopyInline, ReviewInline]
 
+@admin.register(Review)
+class ReviewAdmin(AutocompletarAdminMixin, admin.ModelAdmin):
+    list_display = ('id','book','user','rating','helpfulness','created_at')
+    list_select_related = ('book','user')
+    search_fields = ('book__title','=user__username')
+    list_filter = ('rating',)
+    raw_id_fields = ('book',)
+    readonly_fields = ('upvotes','downvotes','helpfulness','created_at')
+
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(AutocompletarAdminMixin, admin.ModelAdmin):
     list_display = ('id','user','copy','loaned_at','due_date','returned_at')
     search_fields = ('user__username','copy__inventory_code')
     list_filter = ('returned_at',)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BibliotecaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'biblioteca'
+
+    def ready(self):
+        from . import adapters
+        adapters.registrar()
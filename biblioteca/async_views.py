@@ -0,0 +1,164 @@
+"""Versiones asíncronas de los listados y reportes, para servir con ASGI.
+
+Mismas consultas, filtros y plantillas que las vistas de `views.py` (heredan
+de ellas); cambia cómo esperan a la base:
+
+- el ORM asíncrono (`async for`, `aiterator()`) deja libre el bucle de
+  eventos mientras la consulta corre en el hilo de la petición;
+- con `REPORTES_PARALELO`, los reportes lanzan a la vez la página y las
+  series de los gráficos, cada una con su propia conexión (`en_paralelo`),
+  en vez de la consulta única de `SinglePassReportMixin`. La vista se
+  recorre dos veces: solo compensa con CPU libre en la base y una página
+  barata (con índice, como el catálogo materializado); mídelo con
+  `manage.py bench_asgi --paralelo`. El total sale del conjunto vacío de
+  las series, sin `COUNT` aparte;
+- el CSV sale de `aiterator()` por un `StreamingHttpResponse` asíncrono. Con
+  ASGI, el iterador síncrono de `StreamingCSVMixin` se lee entero en memoria
+  antes de enviar el primer byte.
+
+Con WSGI también responden, pero sin ventaja: Django las ejecuta en un bucle
+propio por petición y acumula el CSV antes de enviarlo.
+"""
+import asyncio
+import csv
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+from . import views
+from .report_cache import AsyncReportCacheMixin
+
+
+def _cerrando_conexiones(funcion, *args):
+    """Ejecuta `funcion` y cierra las conexiones del hilo: los del ejecutor
+    de `sync_to_async` no atienden peticiones y las dejarían abiertas."""
+    try:
+        return funcion(*args)
+    finally:
+        connections.close_all()
+
+
+def _en_transaccion():
+    return any(conexion.in_atomic_block for conexion in connections.all(initialized_only=True))
+
+
+async def en_paralelo(*llamadas):
+    """Resultados de `(funcion, *args)` para cada llamada, ejecutadas a la vez
+    en hilos distintos, cada uno con su conexión (son por hilo).
+
+    Con una transacción abierta en el hilo de la petición se ejecutan en serie
+    en él: otra conexión no vería sus cambios.
+    """
+    if await sync_to_async(_en_transaccion)():
+        return [await sync_to_async(funcion)(*args) for funcion, *args in llamadas]
+    return await asyncio.gather(*(
+        sync_to_async(_cerrando_conexiones, thread_sensitive=False)(funcion, *args)
+        for funcion, *args in llamadas
+    ))
+
+
+async def _base_de_lectura(queryset):
+    """Fija la base que elige el router (que puede consultar el retraso de la
+    réplica) fuera del bucle de eventos."""
+    return queryset.using(await sync_to_async(lambda: queryset.db)())
+
+
+class AsyncKeysetListMixin:
+    """`get` asíncrono para un `ListView` con `KeysetPaginationMixin`."""
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = await _base_de_lectura(self.get_queryset())
+        self.pagina = await self.apaginate_queryset(
+            self.object_list, self.get_paginate_by(self.object_list))
+        context = await sync_to_async(self.get_context_data)()
+        return self.render_to_response(context)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        values, reverse = self.get_keyset_cursor()
+        qs = self.keyset_queryset(queryset, page_size, values, reverse)
+        rows = [row async for row in qs]
+        page = self.build_page(rows, queryset, page_size, values, reverse)
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def paginate_queryset(self, queryset, page_size):
+        # Ya paginado en `get`; `get_context_data` lo recoge de aquí
+        return self.pagina
+
+
+class AsyncReportMixin(AsyncKeysetListMixin):
+    """Página y series de un `SinglePassReportMixin`: en una consulta o, con
+    `REPORTES_PARALELO`, en dos a la vez."""
+
+    async def apaginate_queryset(self, queryset, page_size):
+        if not getattr(settings, "REPORTES_PARALELO", False):
+            # El de SinglePassReportMixin (el de AsyncKeysetListMixin devuelve
+            # la página ya calculada)
+            una_consulta = super(AsyncKeysetListMixin, self).paginate_queryset
+            return await sync_to_async(una_consulta)(queryset, page_size)
+
+        values, reverse = self.get_keyset_cursor()
+        rows, raw_series = await en_paralelo(
+            (list, self.keyset_queryset(queryset, page_size, values, reverse)),
+            (self.read_series, queryset),
+        )
+        self.chart_data, total = self.parse_series(raw_series)
+        page = self.build_page(rows, queryset, page_size, values, reverse, count=total)
+        return (None, page, page.object_list, page.has_other_pages())
+
+
+class AsyncStreamingCSVMixin:
+    """`?export=csv` de `StreamingCSVMixin` con un iterador asíncrono."""
+
+    async def get(self, request, *args, **kwargs):
+        if request.GET.get("export") == "csv":
+            return await self.arender_csv()
+        return await super().get(request, *args, **kwargs)
+
+    async def arender_csv(self):
+        headers = [h for h, _ in self.csv_columns]
+        fields = [f for _, f in self.csv_columns]
+        queryset = await _base_de_lectura(self.get_csv_queryset())
+        # named=True: el iterable de `values_list` simple ejecuta la consulta en
+        # el bucle de eventos al crear el `aiterator()` (SynchronousOnlyOperation)
+        rows = queryset.values_list(*fields, named=True).aiterator(chunk_size=self.csv_chunk_size)
+        writer = csv.writer(views.Echo())
+
+        async def lineas():
+            yield writer.writerow(headers)
+            async for row in rows:
+                yield writer.writerow(row)
+
+        resp = StreamingHttpResponse(lineas(), content_type='text/csv')
+        resp['Content-Disposition'] = f'attachment; filename="{self.csv_filename}"'
+        return resp
+
+
+# Listados
+class CatalogoListAsyncView(AsyncKeysetListMixin, views.CatalogoListView):
+    pass
+
+
+class PrestamosUsuariosListAsyncView(AsyncKeysetListMixin, views.PrestamosUsuariosListView):
+    pass
+
+
+class SucursalesListAsyncView(AsyncKeysetListMixin, views.SucursalesListView):
+    pass
+
+
+# Reportes
+class CatalogoReportAsyncView(AsyncReportCacheMixin, AsyncStreamingCSVMixin, AsyncReportMixin,
+                              views.CatalogoReportView):
+    pass
+
+
+class PrestamosUsuariosReportAsyncView(AsyncReportCacheMixin, AsyncStreamingCSVMixin, AsyncReportMixin,
+                                       views.PrestamosUsuariosReportView):
+    pass
+
+
+class ActividadSucursalesReportAsyncView(AsyncReportCacheMixin, AsyncStreamingCSVMixin, AsyncReportMixin,
+                                         views.ActividadSucursalesReportView):
+    pass
@@ -0,0 +1,173 @@
+"""Selectores con autocompletado para las claves foráneas grandes.
+
+Un `<select>` normal lleva todas las filas del modelo (cada copia, cada
+usuario, cada autor) en la página. Aquí el `<select>` solo trae la opción
+elegida y el resto se pide al escribir, a los endpoints JSON de abajo, en el
+formato de select2 (`{"results": [{"id", "text"}], "pagination": {"more"}}`):
+
+- copias: prefijo de `inventory_code`;
+- usuarios: prefijo de `username` y, después, de `email`;
+- autores: prefijo del apellido y, después, del nombre, sin distinguir
+  mayúsculas; «Apellido, Nombre» busca los dos a la vez.
+
+Cada búsqueda es un prefijo por un índice `varchar_pattern_ops` (los de las
+columnas únicas y los de `Author` de la migración 0014) ordenado y con
+`LIMIT`: sin `COUNT` de la tabla ni recorridos secuenciales. `inventory_code`,
+`username` y `email` distinguen mayúsculas, como sus restricciones únicas.
+
+`AutocompletarSelect` es el `AutocompleteSelect` del admin (select2 y su JS)
+apuntando a estos endpoints; `AutocompletarFormMixin` lo pone en las vistas
+de edición y `AutocompletarAdminMixin` en el admin.
+"""
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models.functions import Upper
+from django.forms.models import modelform_factory
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views import View
+
+from .models import Author, Copy, LibraryUser
+
+
+class AutocompletarView(View):
+    """GET `term` y `page` (desde 1). Las subclases dan las consultas: se
+    recorren en orden y cada una añade las filas que no estaban en las
+    anteriores."""
+    model = None
+    campos_texto = ()  # los que usa `__str__`
+    por_pagina = 20
+
+    def consultas(self, termino):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        termino = request.GET.get("term", "").strip()
+        try:
+            pagina = max(int(request.GET.get("page") or 1), 1)
+        except ValueError:
+            pagina = 1
+        objetos, hay_mas = self.buscar(termino, (pagina - 1) * self.por_pagina, self.por_pagina)
+        return JsonResponse({
+            "results": [{"id": str(obj.pk), "text": str(obj)} for obj in objetos],
+            "pagination": {"more": hay_mas},
+        })
+
+    def buscar(self, termino, desde, cuantos):
+        """`(objetos, hay_más)` de las posiciones `desde`..`desde + cuantos`
+        de las consultas encadenadas. Una consulta solo se lanza si las
+        anteriores no llenan la página."""
+        objetos = []
+        faltan = cuantos + 1
+        saltar = desde
+        for qs in self.consultas(termino):
+            qs = qs.only("pk", *self.campos_texto)
+            filas = list(qs[saltar:saltar + faltan])
+            objetos += filas
+            faltan -= len(filas)
+            if not faltan:
+                break
+            if filas:
+                saltar = 0
+            elif saltar:
+                # Todas sus coincidencias quedan antes de la página
+                saltar -= qs[:saltar].count()
+        return objetos[:cuantos], len(objetos) > cuantos
+
+
+class CopiasAutocompletarView(AutocompletarView):
+    model = Copy
+    campos_texto = ("inventory_code",)
+
+    def consultas(self, termino):
+        qs = Copy.objects.order_by("inventory_code")
+        return [qs.filter(inventory_code__startswith=termino) if termino else qs]
+
+
+class UsuariosAutocompletarView(AutocompletarView):
+    model = LibraryUser
+    campos_texto = ("username",)
+
+    def consultas(self, termino):
+        if not termino:
+            return [LibraryUser.objects.order_by("username")]
+        return [
+            LibraryUser.objects.filter(username__startswith=termino).order_by("username"),
+            LibraryUser.objects
+                .filter(email__startswith=termino)
+                .exclude(username__startswith=termino)
+                .order_by("email"),
+        ]
+
+
+class AutoresAutocompletarView(AutocompletarView):
+    model = Author
+    campos_texto = ("first_name", "last_name")
+
+    def consultas(self, termino):
+        # Mismo orden que `author_orden_idx`; sin término no se ordena la tabla
+        qs = Author.objects.order_by(Upper("last_name"), Upper("first_name"), "id")
+        if not termino:
+            return [qs]
+        if "," in termino:
+            apellido, nombre = (parte.strip() for parte in termino.split(",", 1))
+            return [qs.filter(last_name__istartswith=apellido, first_name__istartswith=nombre)]
+        return [
+            qs.filter(last_name__istartswith=termino),
+            qs.filter(first_name__istartswith=termino)
+              .exclude(last_name__istartswith=termino)
+              .order_by(Upper("first_name"), Upper("last_name"), "id"),
+        ]
+
+
+class AutocompletarSelect(AutocompleteSelect):
+    """`AutocompleteSelect` contra uno de los endpoints de este módulo.
+
+    `field` es la `ForeignKey` del modelo; al pintarse solo consulta la opción
+    elegida.
+    """
+
+    def __init__(self, url_name, field, attrs=None, using=None):
+        super().__init__(field, None, attrs=attrs, using=using)
+        self.url_name = url_name
+
+    def get_url(self):
+        return reverse(self.url_name)
+
+
+# Campo -> endpoint, para las `ForeignKey` que se autocompletan
+ENDPOINTS = {
+    (Copy, "copy"): "autocompletar-copias",
+    (LibraryUser, "user"): "autocompletar-usuarios",
+    (Author, "main_author"): "autocompletar-autores",
+    (Author, "author"): "autocompletar-autores",
+}
+
+
+def endpoint_de(db_field):
+    return ENDPOINTS.get((db_field.related_model, db_field.name))
+
+
+class AutocompletarFormMixin:
+    """Para `CreateView`/`UpdateView` con `fields`: las claves foráneas de
+    `ENDPOINTS` se piden con `AutocompletarSelect`."""
+
+    def get_form_class(self):
+        if self.form_class is not None:
+            return super().get_form_class()
+        widgets = {}
+        for nombre in self.fields:
+            db_field = self.model._meta.get_field(nombre)
+            if db_field.many_to_one and endpoint_de(db_field):
+                widgets[nombre] = AutocompletarSelect(endpoint_de(db_field), db_field)
+        return modelform_factory(self.model, fields=self.fields, widgets=widgets)
+
+
+class AutocompletarAdminMixin:
+    """Para `ModelAdmin` e inlines: como `autocomplete_fields`, pero con los
+    endpoints de este módulo y sin registrar los modelos relacionados."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        url_name = endpoint_de(db_field)
+        if url_name and "widget" not in kwargs:
+            kwargs["widget"] = AutocompletarSelect(url_name, db_field, using=kwargs.get("using"))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
@@ -0,0 +1,95 @@
+"""Circulación: préstamo de "cualquier copia disponible" de un título sin
+bloqueos y devolución masiva.
+
+Cada mostrador reclama una copia con
+
+    SELECT ... FROM biblioteca_copy WHERE book_id = %s AND is_available
+    ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+
+de modo que dos préstamos simultáneos del mismo libro nunca esperan uno al
+otro ni se llevan la misma copia: el segundo salta la fila que el primero
+tiene bloqueada y toma la siguiente. `trg_update_copy_available` marca la
+copia como prestada dentro de la misma transacción.
+
+`return_loans` cierra N préstamos con un único UPDATE; los triggers por
+sentencia de la migración 0010 liberan las copias y generan las multas en
+bloque.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Copy, LibraryUser, Loan
+
+DIAS_PRESTAMO = getattr(settings, "PRESTAMO_DIAS", 14)
+
+
+class CheckoutError(Exception):
+    """El préstamo no puede hacerse; `status` es el código HTTP sugerido."""
+    status = 409
+
+
+class SinCopiaDisponible(CheckoutError):
+    pass
+
+
+class UsuarioNoValido(CheckoutError):
+    status = 400
+
+
+def claim_copy(isbn, branch_id=None):
+    """Bloquea y devuelve una copia disponible (o None). Requiere transacción."""
+    qs = Copy.objects.select_for_update(skip_locked=True, of=("self",)).filter(
+        book_id=isbn, is_available=True,
+    )
+    if branch_id is not None:
+        qs = qs.filter(shelf__branch_id=branch_id)
+    return qs.order_by("id").first()
+
+
+def checkout(isbn, user_id, branch_id=None, due_date=None):
+    """Presta una copia de `isbn` a `user_id` y devuelve el `Loan` creado."""
+    hoy = timezone.localdate()
+    due_date = due_date or hoy + timedelta(days=DIAS_PRESTAMO)
+    if due_date <= hoy:
+        raise UsuarioNoValido("La fecha de devolución debe ser posterior a hoy.")
+
+    estado = LibraryUser.objects.filter(pk=user_id).values_list("status", flat=True).first()
+    if estado is None:
+        raise UsuarioNoValido(f"El usuario {user_id} no existe.")
+    if estado != "active":
+        raise UsuarioNoValido(f"El usuario {user_id} está suspendido.")
+
+    with transaction.atomic():
+        copia = claim_copy(isbn, branch_id)
+        if copia is None:
+            donde = f" en la sucursal {branch_id}" if branch_id is not None else ""
+            raise SinCopiaDisponible(f"No hay copias disponibles de {isbn}{donde}.")
+        return Loan.objects.create(copy=copia, user_id=user_id, due_date=due_date)
+
+
+def return_loans(loan_ids=(), inventory_codes=(), returned_at=None):
+    """Devuelve de una vez los préstamos abiertos indicados por id o por código
+    de inventario de la copia. Devuelve `(devueltos, multas)`: lista de
+    `(loan_id, copy_id, inventory_code)` y cuántos de ellos quedan con multa
+    pendiente (la devengada cada noche pasa aquí a su importe final)."""
+    returned_at = returned_at or timezone.now()
+    with transaction.atomic(), connection.cursor() as c:
+        c.execute("""
+            UPDATE biblioteca_loan l SET returned_at = %s
+            FROM biblioteca_copy c
+            WHERE c.id = l.copy_id
+              AND l.returned_at IS NULL
+              AND (l.id = ANY(%s) OR c.inventory_code = ANY(%s))
+            RETURNING l.id, l.copy_id, c.inventory_code
+        """, [returned_at, list(loan_ids), list(inventory_codes)])
+        devueltos = c.fetchall()
+        multas = 0
+        if devueltos:
+            c.execute("""SELECT COUNT(*) FROM biblioteca_fine
+                         WHERE loan_id = ANY(%s) AND NOT paid""",
+                      [[loan_id for loan_id, _, _ in devueltos]])
+            multas = c.fetchone()[0]
+    return devueltos, multas
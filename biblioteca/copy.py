@@ -0,0 +1,53 @@
+"""Carga masiva con `COPY ... FROM STDIN` desde un iterador de líneas.
+
+La usan `generar_datos` y `calcular_recomendaciones`; funciona con psycopg2
+(`copy_expert` sobre un objeto tipo fichero) y con psycopg 3 (`cursor.copy`).
+"""
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+
+def copiar(cursor, tabla, columnas, lineas, bloque=5000):
+    """`COPY` en streaming: envía las líneas en bloques según se generan."""
+    sql = f"COPY {tabla} ({columnas}) FROM STDIN"
+    filas = 0
+
+    def bloques():
+        nonlocal filas
+        pendientes = []
+        for linea in lineas:
+            pendientes.append(linea)
+            if len(pendientes) >= bloque:
+                filas += len(pendientes)
+                yield "".join(pendientes)
+                pendientes = []
+        if pendientes:
+            filas += len(pendientes)
+            yield "".join(pendientes)
+
+    if is_psycopg3:
+        with cursor.copy(sql) as copy:
+            for datos in bloques():
+                copy.write(datos)
+    else:
+        cursor.copy_expert(sql, _Flujo(bloques()), 1 << 16)
+    return filas
+
+
+class _Flujo:
+    """Objeto tipo fichero sobre un iterador de cadenas (para copy_expert)."""
+
+    def __init__(self, trozos):
+        self.trozos = trozos
+        self.resto = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.resto) < size:
+            try:
+                self.resto += next(self.trozos)
+            except StopIteration:
+                break
+        if size < 0:
+            datos, self.resto = self.resto, ""
+        else:
+            datos, self.resto = self.resto[:size], self.resto[size:]
+        return datos
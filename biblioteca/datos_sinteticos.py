@@ -0,0 +1,478 @@
+"""Generadores de datos sintéticos para `manage.py generar_datos`.
+
+Cada generador recibe un rango de índices `[desde, hasta)` de su tabla y
+produce líneas en formato de texto de `COPY`. Las claves foráneas se derivan
+de funciones deterministas del índice (`mezcla`), no de estado compartido,
+para que cada proceso pueda generar su trozo por separado y el conjunto sea
+coherente:
+
+- el libro `i` tiene ISBN `979` + `i` y `copias_de(i)` copias con ids
+  `i * 10 + j + 1`;
+- si `prestada(i)`, su primera copia tiene un préstamo abierto (y no está
+  disponible), así que los contadores del libro se escriben ya correctos;
+- los pares únicos (reseña libro/usuario, voto, asistencia, reserva) se
+  construyen por rondas: en la ronda `r` el elemento `k` va con el usuario
+  `mezcla(k) + r`, distinto en cada ronda.
+
+Los tamaños base (escala 1) son los de un sistema grande: un millón de
+libros, unos cinco millones de copias y veinte millones de préstamos.
+"""
+import json
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+TAMANIOS_BASE = {
+    "usuarios": 500_000,
+    "autores": 200_000,
+    "libros": 1_000_000,
+    "prestamos": 20_000_000,
+    "sucursales": 200,
+    "resenias": 5_000_000,
+    "votos": 10_000_000,
+    "eventos": 50_000,
+    "asistencias": 1_000_000,
+    "reservas": 200_000,
+}
+MINIMOS = {"usuarios": 10, "autores": 5, "libros": 10, "sucursales": 1, "eventos": 1,
+           "resenias": 1}
+
+ESTANTES_POR_SUCURSAL = 50
+COPIAS_MAX = 9            # copias_de(i) en [1, 9]; ids de copia i * 10 + j + 1
+PCT_PRESTADOS = 10        # libros con su primera copia prestada ahora mismo
+PCT_DEVUELTOS_TARDE = 15
+PCT_MULTAS_PAGADAS = 80
+DIAS_PRESTAMO = 14
+MULTA_DIARIA = 0.50
+
+NOMBRES = [
+    "Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Pedro", "Elena",
+    "Diego", "Sofía", "Pablo", "Laura", "Andrés", "Marta", "Javier", "Paula",
+    "Miguel", "Isabel", "Carlos", "Sara", "Raúl", "Irene", "Tomás", "Julia",
+    "Mario", "Clara", "Hugo", "Alicia", "Óscar", "Rosa", "Iván", "Nuria",
+    "Víctor", "Eva", "Rubén", "Inés", "Sergio", "Olga", "Adrián",
+]
+APELLIDOS = [
+    "García", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Díaz", "Ruiz",
+    "Hernández", "Jiménez", "Moreno", "Álvarez", "Romero", "Navarro", "Torres",
+    "Domínguez", "Vázquez", "Ramos", "Gil", "Serrano", "Blanco", "Molina",
+    "Castro", "Ortiz", "Rubio", "Marín", "Sanz", "Iglesias", "Núñez", "Medina",
+    "Garrido", "Cortés", "Castillo", "Santos", "Lozano", "Guerrero", "Cano",
+    "Prieto", "Méndez", "Cruz",
+]
+PALABRAS = [
+    "sombra", "jardín", "río", "ciudad", "noche", "mar", "memoria", "viento",
+    "silencio", "tiempo", "camino", "fuego", "invierno", "luz", "casa", "libro",
+    "isla", "puerta", "secreto", "bosque", "piedra", "reino", "espejo", "sueño",
+    "frontera", "verano", "lluvia", "tierra", "voz", "último", "perdido",
+    "oculto", "primer", "largo", "azul", "rojo", "antiguo", "nuevo", "breve",
+    "eterno",
+]
+GENEROS = [
+    "Ficción", "No ficción", "Ciencia ficción", "Romance", "Misterio",
+    "Fantasía", "Biografía", "Historia", "Poesía", "Ensayo", "Terror",
+    "Aventura", "Infantil", "Juvenil", "Filosofía", "Ciencia", "Arte",
+    "Viajes", "Cocina", "Autoayuda", "Política", "Economía", "Teatro",
+    "Cómic", "Policiaca",
+]
+IDIOMAS = ["Spanish", "English", "French", "German", "Portuguese", "Italian", "Japanese"]
+CONDICIONES = ["new", "good", "fair", "poor"]
+CALIFICACIONES = ["poor", "average", "good", "excellent"]
+PESOS_CALIFICACION = [1, 3, 4, 2]
+ROLES = [
+    ("Administrador", "Gestión completa"),
+    ("Bibliotecario", "Préstamos, devoluciones y catálogo"),
+    ("Asistente", "Préstamos y devoluciones"),
+    ("Lector", "Consulta del catálogo"),
+]
+PERMISOS = [
+    "catalogo.ver", "catalogo.editar", "prestamos.crear", "prestamos.devolver",
+    "prestamos.editar", "multas.cobrar", "multas.condonar", "usuarios.ver",
+    "usuarios.editar", "eventos.gestionar", "reportes.ver", "auditoria.ver",
+]
+# Permisos de cada rol (índices en PERMISOS)
+PERMISOS_ROL = [
+    range(len(PERMISOS)),
+    [0, 1, 2, 3, 4, 5, 7, 9, 10],
+    [0, 2, 3, 5, 7],
+    [0],
+]
+METODOS_PAGO = [
+    ("Efectivo", {}),
+    ("Tarjeta", {"campos": ["ultimos4", "autorizacion"]}),
+    ("Transferencia", {"campos": ["referencia"]}),
+    ("Monedero", {"campos": ["telefono"]}),
+]
+
+_MASCARA = (1 << 64) - 1
+_UTC = timezone.utc
+_NULO = "\\N"
+_CONTRASENIA = "!sintetico"   # contraseña inutilizable (como set_unusable_password)
+
+
+def mezcla(x):
+    """Hash entero determinista (mismo resultado en todos los procesos)."""
+    x = ((x + 1) * 0x9E3779B97F4A7C15) & _MASCARA
+    return x ^ (x >> 29)
+
+
+def isbn(i):
+    return f"979{i:010d}"
+
+
+def copias_de(i):
+    return 1 + mezcla(i) % COPIAS_MAX
+
+
+def prestada(i):
+    return mezcla(i ^ 0x5BD1E995) % 100 < PCT_PRESTADOS
+
+
+def autor_principal(i, n_autores):
+    return 1 + mezcla(i ^ 0x27D4EB2F) % n_autores
+
+
+@lru_cache(maxsize=None)
+def _dia(dia):
+    return datetime.fromtimestamp(dia * 86400, _UTC).date()
+
+
+def _ts(segundos):
+    # Por día en caché: construir un datetime por fila es lo más caro de generar
+    dia, resto = divmod(int(segundos), 86400)
+    return f"{_dia(dia)} {resto // 3600:02d}:{resto // 60 % 60:02d}:{resto % 60:02d}+00"
+
+
+def _fecha(segundos):
+    return _dia(int(segundos) // 86400)
+
+
+def _linea(*valores):
+    return "\t".join(valores) + "\n"
+
+
+def tamanios(escala):
+    n = {
+        nombre: max(MINIMOS.get(nombre, 0), round(base * escala))
+        for nombre, base in TAMANIOS_BASE.items()
+    }
+    # Los pares únicos por rondas necesitan menos rondas que usuarios
+    for tabla, base in (("resenias", "libros"), ("votos", "resenias"),
+                        ("asistencias", "eventos"), ("reservas", "libros")):
+        n[tabla] = min(n[tabla], n[base] * n["usuarios"])
+    return n
+
+
+class Plan:
+    """Tamaños y parámetros comunes a todos los generadores de una carga."""
+
+    def __init__(self, escala, semilla, anios_historia, ahora):
+        self.n = tamanios(escala)
+        self.semilla = semilla
+        self.anios_historia = anios_historia
+        self.ahora = ahora.timestamp()
+        self.hoy = ahora.date()
+        # Préstamos abiertos: uno por libro prestado. Se guarda cuántos hay
+        # antes de cada trozo de libros para numerarlos sin coordinación.
+        self.abiertos = sum(1 for i in range(self.n["libros"]) if prestada(i))
+        self.historicos = max(0, self.n["prestamos"] - self.abiertos)
+        self.estantes = self.n["sucursales"] * ESTANTES_POR_SUCURSAL
+
+    def abiertos_antes_de(self, libro):
+        return sum(1 for i in range(libro) if prestada(i))
+
+    def anios_prestamos(self):
+        desde = _fecha(self.ahora - (30 + self.anios_historia * 365) * 86400).year
+        return range(desde, self.hoy.year + 1)
+
+
+# ---------------------------------------------------------------------------
+# Generadores: (plan, rng, desde, hasta, extra) -> [(tabla, columnas, líneas)]
+# ---------------------------------------------------------------------------
+
+def usuarios(plan, rng, desde, hasta, extra):
+    nacimiento_min = date(1940, 1, 1).toordinal()
+    nacimiento_max = date(2007, 12, 31).toordinal()
+    alta = plan.anios_historia * 365 * 86400
+
+    def lineas():
+        for i in range(desde, hasta):
+            yield _linea(
+                str(i + 1), f"usuario{i + 1}", f"usuario{i + 1}@example.com",
+                rng.choice(NOMBRES), rng.choice(APELLIDOS), _CONTRASENIA,
+                f"+502 {rng.randrange(10_000_000, 100_000_000)}",
+                date.fromordinal(rng.randint(nacimiento_min, nacimiento_max)).isoformat(),
+                "suspended" if rng.random() < 0.03 else "active",
+                _ts(plan.ahora - rng.random() * alta),
+            )
+    yield ("library_users",
+           "id, username, email, first_name, last_name, password, phone_number, "
+           "birth_date, status, date_joined", lineas())
+
+
+def catalogos(plan, rng, desde, hasta, extra):
+    """Tablas pequeñas y fijas: roles, permisos, métodos de pago y géneros."""
+    yield ("biblioteca_role", "id, name, description",
+           [_linea(str(i + 1), n, d) for i, (n, d) in enumerate(ROLES)])
+    yield ("biblioteca_permission", "id, codename, description",
+           [_linea(str(i + 1), c, c.replace(".", ": ")) for i, c in enumerate(PERMISOS)])
+    pares = [(r + 1, p + 1) for r, permisos in enumerate(PERMISOS_ROL) for p in permisos]
+    yield ("biblioteca_rolepermission", "id, role_id, permission_id",
+           [_linea(str(k + 1), str(r), str(p)) for k, (r, p) in enumerate(pares)])
+    yield ("biblioteca_paymentmethod", "id, name, details_schema",
+           [_linea(str(i + 1), n, json.dumps(d)) for i, (n, d) in enumerate(METODOS_PAGO)])
+    yield ("biblioteca_genre", "id, name, description",
+           [_linea(str(i + 1), g, f"Género {g}") for i, g in enumerate(GENEROS)])
+
+
+def sucursales(plan, rng, desde, hasta, extra):
+    def lineas():
+        for i in range(desde, hasta):
+            yield _linea(
+                str(i + 1), f"Sucursal {i + 1}",
+                f"{rng.randint(1, 40)}a calle {rng.randint(1, 99)}-{rng.randint(1, 99)}, "
+                f"zona {rng.randint(1, 25)}",
+                f"+502 {rng.randrange(20_000_000, 30_000_000)}",
+                _ts(plan.ahora - rng.random() * 20 * 365 * 86400),
+            )
+    yield ("biblioteca_branch", "id, name, address, phone, created_at", lineas())
+
+
+def estantes(plan, rng, desde, hasta, extra):
+    def lineas():
+        for s in range(desde, hasta):
+            sucursal = s // ESTANTES_POR_SUCURSAL + 1
+            codigo = f"E{s % ESTANTES_POR_SUCURSAL:03d}"
+            yield _linea(str(s + 1), str(sucursal), codigo,
+                         f"Estante {codigo} de la sucursal {sucursal}")
+    yield ("biblioteca_shelf", "id, branch_id, code, description", lineas())
+
+
+def autores(plan, rng, desde, hasta, extra):
+    n1, n2 = len(NOMBRES), len(APELLIDOS)
+
+    def lineas():
+        # (nombre, apellido, año) único: el índice se reparte entre los tres
+        for i in range(desde, hasta):
+            apellido = APELLIDOS[(i // n1) % n2]
+            vuelta = i // (n1 * n2)
+            anio = 1800 + vuelta % 200
+            if vuelta >= 200:
+                apellido = f"{apellido} {vuelta // 200}"
+            yield _linea(str(i + 1), NOMBRES[i % n1], apellido, str(anio))
+    yield ("biblioteca_author", "id, first_name, last_name, birth_year", lineas())
+
+
+def libros(plan, rng, desde, hasta, extra):
+    """Libros con sus autores, géneros y copias (mismo rango de libros)."""
+    n_autores, n_generos = plan.n["autores"], len(GENEROS)
+    anio_max = plan.hoy.year - 1
+    alta = plan.anios_historia * 365 * 86400
+
+    def lineas_libros():
+        for i in range(desde, hasta):
+            total = copias_de(i)
+            idiomas = rng.sample(IDIOMAS, 1 if rng.random() < 0.8 else 2)
+            yield _linea(
+                isbn(i),
+                " ".join(rng.sample(PALABRAS, rng.randint(2, 5))).capitalize(),
+                str(rng.randint(1900, anio_max)), "{" + ",".join(idiomas) + "}",
+                rng.choice(CONDICIONES), str(rng.randint(60, 1200)),
+                _ts(plan.ahora - rng.random() * alta),
+                str(autor_principal(i, n_autores)),
+                str(total), str(total - prestada(i)),
+            )
+    yield ("biblioteca_book",
+           "isbn, title, published_year, languages, condition, page_count, created_at, "
+           "main_author_id, total_copies, available_copies", lineas_libros())
+
+    def lineas_autores():
+        for i in range(desde, hasta):
+            if n_autores < 3 or rng.random() >= 0.3:
+                continue
+            principal = autor_principal(i, n_autores)
+            otros, cuantos = set(), rng.randint(1, 2)
+            while len(otros) < cuantos:
+                a = rng.randint(1, n_autores)
+                if a != principal:
+                    otros.add(a)
+            for t, a in enumerate(sorted(otros)):
+                yield _linea(str(i * 2 + t + 1), isbn(i), str(a))
+    yield ("biblioteca_bookauthor", "id, book_id, author_id", lineas_autores())
+
+    def lineas_generos():
+        for i in range(desde, hasta):
+            for t, g in enumerate(rng.sample(range(n_generos), 1 + mezcla(i ^ 11) % 3)):
+                yield _linea(str(i * 3 + t + 1), isbn(i), str(g + 1))
+    yield ("biblioteca_bookgenre", "id, book_id, genre_id", lineas_generos())
+
+    hoy = plan.hoy.toordinal()
+
+    def lineas_copias():
+        for i in range(desde, hasta):
+            fuera = prestada(i)
+            for j in range(copias_de(i)):
+                copia = i * 10 + j + 1
+                yield _linea(
+                    str(copia), isbn(i), str(1 + mezcla(copia) % plan.estantes),
+                    f"INV{copia:010d}", "f" if (j == 0 and fuera) else "t",
+                    date.fromordinal(hoy - rng.randint(0, 3650)).isoformat(),
+                    f"{rng.uniform(5, 80):.2f}",
+                )
+    yield ("biblioteca_copy",
+           "id, book_id, shelf_id, inventory_code, is_available, acquired_at, price",
+           lineas_copias())
+
+
+def prestamos(plan, rng, desde, hasta, extra):
+    """Préstamos devueltos, con sus multas (devolución tardía) y pagos."""
+    n_libros, n_usuarios = plan.n["libros"], plan.n["usuarios"]
+    ventana = plan.anios_historia * 365 * 86400
+    limite = plan.ahora - 3600
+    multas, pagos = [], []
+
+    def lineas():
+        for k in range(desde, hasta):
+            prestamo = k + 1
+            libro = int(n_libros * rng.random() ** 2)     # unos títulos mucho más pedidos
+            copia = libro * 10 + int(rng.random() * copias_de(libro)) + 1
+            prestado = plan.ahora - 30 * 86400 - rng.random() * ventana
+            dia_vence = int(prestado) // 86400 + DIAS_PRESTAMO
+            vence_ts = dia_vence * 86400
+            if rng.random() * 100 < PCT_DEVUELTOS_TARDE:
+                devuelto = vence_ts + rng.uniform(1, 60) * 86400
+            else:
+                devuelto = prestado + rng.uniform(0.1, DIAS_PRESTAMO - 1) * 86400
+            devuelto = min(devuelto, limite)
+            usuario = int(rng.random() * n_usuarios) + 1
+            yield _linea(str(prestamo), str(copia), str(usuario),
+                         _ts(prestado), str(_dia(dia_vence)), _ts(devuelto))
+
+            dias = int(devuelto) // 86400 - dia_vence
+            if dias > 0:
+                importe = f"{dias * MULTA_DIARIA:.2f}"
+                pagada = rng.random() * 100 < PCT_MULTAS_PAGADAS
+                multas.append(_linea(str(prestamo), str(prestamo), importe, _ts(devuelto),
+                                     "t" if pagada else "f"))
+                if pagada:
+                    pagado = min(devuelto + rng.random() * 30 * 86400, limite)
+                    pagos.append(_linea(str(prestamo), str(prestamo),
+                                        str(rng.randint(1, len(METODOS_PAGO))),
+                                        importe, _ts(pagado)))
+
+    yield ("biblioteca_loan", "id, copy_id, user_id, loaned_at, due_date, returned_at", lineas())
+    yield ("biblioteca_fine", "id, loan_id, amount, created_at, paid", multas)
+    yield ("biblioteca_payment", "id, fine_id, method_id, amount, paid_at", pagos)
+
+
+def prestamos_abiertos(plan, rng, desde, hasta, extra):
+    """Un préstamo abierto por libro prestado, sobre su primera copia; `extra`
+    es cuántos hay antes de `desde`. Cerca de un tercio ya vencidos."""
+    n_usuarios = plan.n["usuarios"]
+
+    def lineas():
+        prestamo = plan.historicos + extra
+        for i in range(desde, hasta):
+            if not prestada(i):
+                continue
+            prestamo += 1
+            prestado = plan.ahora - rng.random() * 20 * 86400
+            vence = _fecha(prestado) + timedelta(days=DIAS_PRESTAMO)
+            yield _linea(str(prestamo), str(i * 10 + 1), str(rng.randint(1, n_usuarios)),
+                         _ts(prestado), vence.isoformat(), _NULO)
+    yield ("biblioteca_loan", "id, copy_id, user_id, loaned_at, due_date, returned_at", lineas())
+
+
+def resenias(plan, rng, desde, hasta, extra):
+    n_libros, n_usuarios = plan.n["libros"], plan.n["usuarios"]
+    ventana = plan.anios_historia * 365 * 86400
+
+    def lineas():
+        for k in range(desde, hasta):
+            libro, ronda = k % n_libros, k // n_libros
+            usuario = (mezcla(libro) + ronda) % n_usuarios + 1
+            comentario = (" ".join(rng.sample(PALABRAS, rng.randint(3, 8))).capitalize() + "."
+                          if rng.random() < 0.6 else "")
+            yield _linea(str(k + 1), isbn(libro), str(usuario),
+                         rng.choices(CALIFICACIONES, PESOS_CALIFICACION)[0], comentario,
+                         _ts(plan.ahora - rng.random() * ventana))
+    yield ("biblioteca_review", "id, book_id, user_id, rating, comment, created_at", lineas())
+
+
+def votos(plan, rng, desde, hasta, extra):
+    n_resenias, n_usuarios = plan.n["resenias"], plan.n["usuarios"]
+
+    def lineas():
+        for k in range(desde, hasta):
+            resenia, ronda = k % n_resenias, k // n_resenias
+            usuario = (mezcla(resenia) + ronda) % n_usuarios + 1
+            yield _linea(str(k + 1), str(resenia + 1), str(usuario),
+                         "t" if rng.random() < 0.75 else "f")
+    yield ("biblioteca_reviewvote", "id, review_id, user_id, is_upvote", lineas())
+
+
+def eventos(plan, rng, desde, hasta, extra):
+    def lineas():
+        for k in range(desde, hasta):
+            inicio = plan.ahora + rng.uniform(-730, 90) * 86400
+            titulo = " ".join(rng.sample(PALABRAS, 3)).capitalize()
+            yield _linea(str(k + 1), str(rng.randint(1, plan.n["sucursales"])),
+                         f"Club de lectura: {titulo}", f"Sesión sobre {titulo.lower()}.",
+                         _ts(inicio), _ts(inicio + rng.choice((1, 2, 3)) * 3600),
+                         str(rng.choice((20, 30, 50, 100))))
+    yield ("biblioteca_event",
+           "id, branch_id, title, description, starts_at, ends_at, capacity", lineas())
+
+
+def asistencias(plan, rng, desde, hasta, extra):
+    n_eventos, n_usuarios = plan.n["eventos"], plan.n["usuarios"]
+
+    def lineas():
+        for k in range(desde, hasta):
+            evento, ronda = k % n_eventos, k // n_eventos
+            usuario = (mezcla(evento) + ronda) % n_usuarios + 1
+            yield _linea(str(k + 1), str(evento + 1), str(usuario),
+                         _ts(plan.ahora - rng.random() * 730 * 86400))
+    yield ("biblioteca_eventattendance", "id, event_id, user_id, attended_at", lineas())
+
+
+def reservas(plan, rng, desde, hasta, extra):
+    n_libros, n_usuarios = plan.n["libros"], plan.n["usuarios"]
+
+    def lineas():
+        for k in range(desde, hasta):
+            libro, ronda = k % n_libros, k // n_libros
+            usuario = (mezcla(libro ^ 0x1B873593) + ronda) % n_usuarios + 1
+            reservada = plan.ahora - rng.random() * 30 * 86400
+            yield _linea(str(k + 1), str(libro * 10 + 1), str(usuario),
+                         _ts(reservada), _ts(reservada + 7 * 86400))
+    yield ("biblioteca_reservation", "id, copy_id, user_id, reserved_at, expires_at", lineas())
+
+
+# nombre -> (generador, filas totales a repartir en trozos)
+GENERADORES = {
+    "catalogos": (catalogos, lambda p: 1),
+    "usuarios": (usuarios, lambda p: p.n["usuarios"]),
+    "sucursales": (sucursales, lambda p: p.n["sucursales"]),
+    "estantes": (estantes, lambda p: p.estantes),
+    "autores": (autores, lambda p: p.n["autores"]),
+    "libros": (libros, lambda p: p.n["libros"]),
+    "prestamos": (prestamos, lambda p: p.historicos),
+    "prestamos_abiertos": (prestamos_abiertos, lambda p: p.n["libros"]),
+    "resenias": (resenias, lambda p: p.n["resenias"]),
+    "votos": (votos, lambda p: p.n["votos"]),
+    "eventos": (eventos, lambda p: p.n["eventos"]),
+    "asistencias": (asistencias, lambda p: p.n["asistencias"]),
+    "reservas": (reservas, lambda p: p.n["reservas"]),
+}
+
+# Tablas que llena la carga (más las derivadas que se reconstruyen después)
+TABLAS = [
+    "library_users", "biblioteca_role", "biblioteca_permission",
+    "biblioteca_rolepermission", "biblioteca_paymentmethod", "biblioteca_genre",
+    "biblioteca_branch", "biblioteca_shelf", "biblioteca_author", "biblioteca_book",
+    "biblioteca_bookauthor", "biblioteca_bookgenre", "biblioteca_copy",
+    "biblioteca_loan", "biblioteca_fine", "biblioteca_payment", "biblioteca_review",
+    "biblioteca_reviewvote", "biblioteca_event", "biblioteca_eventattendance",
+    "biblioteca_reservation",
+]
+DERIVADAS = ["biblioteca_booksearch", "mv_catalogo_libros", "circulation_daily"]
@@ -0,0 +1,110 @@
+"""Mantenimiento de las particiones anuales de `biblioteca_loan`.
+
+    python manage.py archivar_prestamos                   # crea las próximas
+    python manage.py archivar_prestamos --anios-activos 2 [--dry-run]
+
+Pensado para cron: crea por adelantado la partición del año siguiente, saca
+de `biblioteca_loan_default` los años que hayan caído ahí y mueve al archivo
+(`biblioteca_loan_archivo`) los años anteriores a los `--anios-activos` más
+recientes. Cada año se copia ordenado por `loaned_at` y su partición se
+elimina con `DROP TABLE` (sin `DELETE` ni VACUUM posterior). Un año con
+préstamos todavía abiertos no se archiva: se informa y se deja para más
+adelante.
+"""
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+NOMBRE_RE = re.compile(r"^biblioteca_loan_p(\d{4})$")
+
+
+class Command(BaseCommand):
+    help = "Crea las particiones próximas de préstamos y archiva los años cerrados."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--anios-adelante", type=int, default=1)
+        parser.add_argument(
+            "--anios-activos", type=int,
+            default=getattr(settings, "PRESTAMOS_ANIOS_ACTIVOS", None),
+            help="Años (contando el actual) que se quedan en biblioteca_loan "
+                 "(sin valor: no archiva).",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        with connection.cursor() as c:
+            if not opts["dry_run"]:
+                with transaction.atomic():
+                    c.execute("SELECT prestamos_asegurar_particiones(%s)", [opts["anios_adelante"]])
+                    listas = [nombre for (nombre,) in c.fetchall()]
+                    c.execute("""
+                        SELECT prestamos_crear_particion(a) FROM (
+                            SELECT DISTINCT extract(year FROM loaned_at AT TIME ZONE 'UTC')::int AS a
+                            FROM biblioteca_loan_default
+                        ) t""")
+                    listas += [nombre for (nombre,) in c.fetchall()]
+                for nombre in sorted(set(listas)):
+                    self.stdout.write(f"Partición lista: {nombre}")
+
+            if opts["anios_activos"] is None:
+                return
+            c.execute("SELECT extract(year FROM NOW() AT TIME ZONE 'UTC')::int")
+            corte = c.fetchone()[0] - max(opts["anios_activos"], 1) + 1
+            c.execute("""
+                SELECT child.relname
+                FROM pg_inherits i
+                JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE i.inhparent = 'biblioteca_loan'::regclass
+                ORDER BY child.relname
+            """)
+            viejas = [
+                nombre for (nombre,) in c.fetchall()
+                if (m := NOMBRE_RE.match(nombre)) and int(m[1]) < corte
+            ]
+
+        for nombre in viejas:
+            self.archivar(nombre, opts["dry_run"])
+        if not viejas:
+            self.stdout.write(f"Nada anterior a {corte}.")
+
+    def archivar(self, nombre, dry_run):
+        """Mueve una partición al archivo en su propia transacción."""
+        with transaction.atomic(), connection.cursor() as c:
+            # Sin escrituras en la partición mientras se copia
+            c.execute(f'LOCK TABLE "{nombre}" IN SHARE MODE')
+            c.execute(f'SELECT COUNT(*), COUNT(*) FILTER (WHERE returned_at IS NULL) FROM "{nombre}"')
+            total, abiertos = c.fetchone()
+            if abiertos:
+                self.stdout.write(self.style.WARNING(
+                    f"{nombre}: {abiertos} préstamos abiertos, no se archiva."))
+                return
+            if dry_run:
+                self.stdout.write(f"Se archivaría {nombre} ({total} préstamos)")
+                return
+            c.execute(f"""
+                INSERT INTO biblioteca_loan_archivo
+                    (id, loaned_at, due_date, returned_at, copy_id, user_id)
+                SELECT id, loaned_at, due_date, returned_at, copy_id, user_id
+                FROM "{nombre}" ORDER BY loaned_at
+            """)
+            # DROP TABLE no dispara triggers: los préstamos archivados se
+            # descuentan a mano de su sucursal (sin el guard de los contadores,
+            # como reparar_contadores) y se avisa a la caché de reportes
+            c.execute("SELECT set_config('biblioteca.reparar_contadores', 'on', true)")
+            c.execute(f"""
+                UPDATE biblioteca_branch br
+                SET total_loans = br.total_loans - d.total
+                FROM (
+                    SELECT sh.branch_id, COUNT(*) AS total
+                    FROM "{nombre}" lo
+                    JOIN biblioteca_copy co ON co.id = lo.copy_id
+                    JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                    GROUP BY sh.branch_id
+                ) d
+                WHERE br.id = d.branch_id
+            """)
+            c.execute(f'DROP TABLE "{nombre}"')
+            c.execute("SELECT notify_reportes('prestamos,sucursales')")
+            self.stdout.write(f"Archivada {nombre} ({total} préstamos)")
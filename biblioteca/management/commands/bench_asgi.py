@@ -0,0 +1,155 @@
+"""Prueba de carga local de los listados y reportes servidos por ASGI.
+
+    python manage.py bench_asgi
+    python manage.py bench_asgi --concurrencia 1 8 32 --peticiones 200 --casos reporte
+
+Envía GET a la aplicación ASGI del proyecto (`proyecto4.asgi`) desde este
+mismo proceso, sin servidor ni red: `--peticiones` por caso con hasta
+`--concurrencia` en curso a la vez. Cada caso se mide con la vista síncrona
+(`views.py`) y con su versión asíncrona (`async_views.py`) y da peticiones
+por segundo, latencia p50/p95 (ms), p50 del primer byte del cuerpo (lo que
+tarda en empezar a llegar un CSV) y el máximo de hilos vivos durante la
+prueba. La caché de reportes se sustituye por una nula y la instrumentación
+SQL se desactiva; `--paralelo` activa `REPORTES_PARALELO`.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .bench_endpoints import percentil
+
+# (nombre, vista síncrona, vista asíncrona, querystring)
+CASOS = [
+    ("reporte catalogo", "catalogo-report", "catalogo-report-async", ""),
+    ("reporte prestamos", "prestamos-report", "prestamos-report-async", ""),
+    ("reporte sucursales", "sucursales-report", "sucursales-report-async", ""),
+    ("reporte catalogo csv", "catalogo-report", "catalogo-report-async", "export=csv"),
+    ("lista catalogo", "catalogo-list", "catalogo-list-async", ""),
+    ("lista prestamos", "prestamos-list", "prestamos-list-async", ""),
+]
+
+
+async def pedir(app, ruta, querystring):
+    """Un GET completo contra `app`; devuelve (estado, segundos hasta el
+    primer byte del cuerpo, bytes del cuerpo)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": ruta, "root_path": "",
+        "query_string": querystring.encode(), "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0), "server": ("localhost", 80),
+    }
+    cuerpo_enviado = asyncio.Event()
+    respuesta = {"estado": None, "primer_byte": None, "bytes": 0}
+    t0 = time.perf_counter()
+
+    async def receive():
+        if not cuerpo_enviado.is_set():
+            cuerpo_enviado.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Django espera aquí la desconexión mientras responde
+        await asyncio.Event().wait()
+
+    async def send(mensaje):
+        if mensaje["type"] == "http.response.start":
+            respuesta["estado"] = mensaje["status"]
+        elif mensaje["type"] == "http.response.body" and mensaje.get("body"):
+            if respuesta["primer_byte"] is None:
+                respuesta["primer_byte"] = time.perf_counter() - t0
+            respuesta["bytes"] += len(mensaje["body"])
+
+    await app(scope, receive, send)
+    return respuesta["estado"], respuesta["primer_byte"] or 0.0, respuesta["bytes"]
+
+
+class Command(BaseCommand):
+    help = "Compara bajo carga concurrente las vistas síncronas y asíncronas servidas por ASGI."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrencia", nargs="+", type=int, default=[1, 8, 32])
+        parser.add_argument("--peticiones", type=int, default=100)
+        parser.add_argument("--casos", nargs="+", default=[],
+                            help="Solo los casos cuyo nombre contenga alguno de estos textos.")
+        parser.add_argument("--paralelo", action="store_true",
+                            help="Reportes asíncronos con página y series en paralelo.")
+
+    def handle(self, *args, **opts):
+        ajustes = {
+            "ALLOWED_HOSTS": ["localhost"],
+            "SQL_MUESTREO": 0,
+            "CACHES": {**settings.CACHES,
+                       "bench": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+            "REPORTES_CACHE": "bench",
+            "REPORTES_GENERACIONES_CACHE": "bench",
+            "REPORTES_PARALELO": opts["paralelo"],
+        }
+        with override_settings(**ajustes):
+            from django.core.asgi import get_asgi_application
+            app = get_asgi_application()
+            casos = [c for c in CASOS
+                     if not opts["casos"] or any(t in c[0] for t in opts["casos"])]
+            self.stdout.write(f"{'caso':24} {'conc.':>5}  {'modo':6} {'pet/s':>8} "
+                              f"{'p50':>8} {'p95':>8} {'1er byte':>8} {'hilos':>6}")
+            for nombre, sincrona, asincrona, querystring in casos:
+                for concurrencia in opts["concurrencia"]:
+                    medidas = {}
+                    for modo, vista in (("sync", sincrona), ("async", asincrona)):
+                        medidas[modo] = asyncio.run(self.carga(
+                            app, reverse(vista), querystring, concurrencia, opts["peticiones"]))
+                        self.escribir(nombre, concurrencia, modo, medidas[modo])
+                    ganancia = medidas["async"]["por_segundo"] / medidas["sync"]["por_segundo"]
+                    self.stdout.write(f"{'':24} {'':>5}  x{ganancia:.2f} pet/s")
+
+    async def carga(self, app, ruta, querystring, concurrencia, peticiones):
+        # Calentamiento: la primera petición carga plantillas y cachés de proceso
+        await pedir(app, ruta, querystring)
+
+        semaforo = asyncio.Semaphore(concurrencia)
+        latencias = []
+        primeros = []
+        estados = set()
+        hilos = threading.active_count()
+        terminado = asyncio.Event()
+
+        async def vigilar_hilos():
+            nonlocal hilos
+            while not terminado.is_set():
+                hilos = max(hilos, threading.active_count())
+                await asyncio.sleep(0.005)
+
+        async def una():
+            async with semaforo:
+                t0 = time.perf_counter()
+                estado, primer_byte, _ = await pedir(app, ruta, querystring)
+                latencias.append((time.perf_counter() - t0) * 1000)
+                primeros.append(primer_byte * 1000)
+                estados.add(estado)
+
+        vigilante = asyncio.create_task(vigilar_hilos())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(una() for _ in range(peticiones)))
+        total = time.perf_counter() - t0
+        terminado.set()
+        await vigilante
+
+        latencias.sort()
+        primeros.sort()
+        return {
+            "por_segundo": peticiones / total,
+            "p50": percentil(latencias, 50),
+            "p95": percentil(latencias, 95),
+            "primer_byte": percentil(primeros, 50),
+            "hilos": hilos,
+            "estados": sorted(estados),
+        }
+
+    def escribir(self, nombre, concurrencia, modo, m):
+        linea = (f"{nombre:24} {concurrencia:>5}  {modo:6} {m['por_segundo']:>8.1f} "
+                 f"{m['p50']:>8.1f} {m['p95']:>8.1f} {m['primer_byte']:>8.1f} {m['hilos']:>6}")
+        if m["estados"] != [200]:
+            linea += self.style.ERROR(f"  estados {m['estados']}")
+        self.stdout.write(linea)
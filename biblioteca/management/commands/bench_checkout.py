@@ -0,0 +1,167 @@
+"""Benchmark de concurrencia del préstamo por ISBN (biblioteca/checkout.py).
+
+Crea un título con `--copias` ejemplares y lanza `--hilos` hilos (cada uno con
+su propia conexión) que piden préstamos de ese título hasta agotarlo. Compara:
+
+- skip_locked: `checkout()` (FOR UPDATE SKIP LOCKED)
+- for_update:  FOR UPDATE sin SKIP LOCKED (los mostradores hacen cola)
+- sin_bloqueo: leer una copia disponible y prestarla (lo que hacía el formulario)
+
+e informa tiempo total, préstamos por segundo, latencias y copias prestadas
+dos veces. Los datos se crean con COMMIT (los hilos deben verlos) y se borran
+al terminar.
+
+    python manage.py bench_checkout --hilos 32 --copias 500
+"""
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from biblioteca.checkout import SinCopiaDisponible, checkout
+from biblioteca.models import Copy, Loan
+
+ISBN = "9980000000001"
+PREFIJO = "BENCHCO"
+MODOS = ("skip_locked", "for_update", "sin_bloqueo")
+
+DATOS_SQL = [
+    """INSERT INTO biblioteca_author (first_name, last_name, birth_year)
+       VALUES ('Bench', 'Checkout', 1950)""",
+    """INSERT INTO biblioteca_book (isbn, title, published_year, languages, condition,
+                                    page_count, created_at, main_author_id)
+       SELECT %(isbn)s, 'Bestseller bench', 2024, ARRAY['es'], 'new', 300, NOW(), id
+       FROM biblioteca_author WHERE first_name = 'Bench' AND last_name = 'Checkout'""",
+    """INSERT INTO biblioteca_copy (book_id, inventory_code, is_available, acquired_at, price)
+       SELECT %(isbn)s, %(prefijo)s || '-' || i, true, CURRENT_DATE, '20.00'
+       FROM generate_series(1, %(copias)s) i""",
+    """INSERT INTO library_users (username, email, first_name, last_name, password,
+                                  status, date_joined)
+       SELECT lower(%(prefijo)s) || i, lower(%(prefijo)s) || i || '@example.com',
+              'Bench', 'Mostrador ' || i, 'x', 'active', NOW()
+       FROM generate_series(1, %(hilos)s) i""",
+]
+
+LIMPIEZA_SQL = [
+    """DELETE FROM biblioteca_loan WHERE copy_id IN (
+           SELECT id FROM biblioteca_copy WHERE book_id = %(isbn)s)""",
+    "DELETE FROM biblioteca_copy WHERE book_id = %(isbn)s",
+    "DELETE FROM biblioteca_book WHERE isbn = %(isbn)s",
+    "DELETE FROM biblioteca_auditlog WHERE table_name = 'books' AND record_id = %(isbn)s",
+    "DELETE FROM library_users WHERE username LIKE lower(%(prefijo)s) || '%%'",
+    "DELETE FROM biblioteca_author WHERE first_name = 'Bench' AND last_name = 'Checkout'",
+]
+
+
+def prestar(modo, isbn, user_id):
+    """Un intento de préstamo; devuelve el id de la copia o lanza SinCopiaDisponible."""
+    if modo == "skip_locked":
+        return checkout(isbn, user_id).copy_id
+
+    due = timezone.localdate() + timedelta(days=14)
+    with transaction.atomic():
+        qs = Copy.objects.filter(book_id=isbn, is_available=True).order_by("id")
+        if modo == "for_update":
+            qs = qs.select_for_update()
+        copia = qs.first()
+        if copia is None:
+            raise SinCopiaDisponible(isbn)
+        Loan.objects.create(copy=copia, user_id=user_id, due_date=due)
+        return copia.id
+
+
+class Command(BaseCommand):
+    help = "Mide préstamos concurrentes de un mismo título con y sin SKIP LOCKED."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hilos", type=int, default=32)
+        parser.add_argument("--copias", type=int, default=500)
+        parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS))
+
+    def handle(self, *args, **opts):
+        params = {"isbn": ISBN, "prefijo": PREFIJO, **opts}
+        with connection.cursor() as c:
+            for sql in LIMPIEZA_SQL:
+                c.execute(sql, params)
+            with transaction.atomic():
+                for sql in DATOS_SQL:
+                    c.execute(sql, params)
+            c.execute("SELECT id FROM library_users WHERE username LIKE lower(%s) || '%%' ORDER BY id",
+                      [PREFIJO])
+            usuarios = [row[0] for row in c.fetchall()]
+
+        try:
+            ok = True
+            for modo in opts["modos"]:
+                self.reiniciar()
+                ok &= self.correr(modo, usuarios, opts["copias"])
+        finally:
+            with connection.cursor() as c:
+                for sql in LIMPIEZA_SQL:
+                    c.execute(sql, params)
+
+        if ok:
+            self.stdout.write(self.style.SUCCESS("skip_locked: sin préstamos duplicados."))
+        else:
+            self.stdout.write(self.style.ERROR("skip_locked prestó alguna copia dos veces."))
+
+    def reiniciar(self):
+        with transaction.atomic(), connection.cursor() as c:
+            c.execute("""DELETE FROM biblioteca_loan WHERE copy_id IN (
+                             SELECT id FROM biblioteca_copy WHERE book_id = %s)""", [ISBN])
+            c.execute("UPDATE biblioteca_copy SET is_available = true WHERE book_id = %s", [ISBN])
+
+    def correr(self, modo, usuarios, copias):
+        barrera = threading.Barrier(len(usuarios))
+
+        def mostrador(user_id):
+            latencias, errores = [], 0
+            try:
+                barrera.wait()
+                while True:
+                    t0 = time.perf_counter()
+                    try:
+                        prestar(modo, ISBN, user_id)
+                    except SinCopiaDisponible:
+                        break
+                    except Exception:
+                        errores += 1
+                        if errores > copias:
+                            break
+                        continue
+                    latencias.append(time.perf_counter() - t0)
+            finally:
+                connection.close()
+            return latencias, errores
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(usuarios)) as pool:
+            resultados = list(pool.map(mostrador, usuarios))
+        total = time.perf_counter() - t0
+
+        latencias = sorted(l for lat, _ in resultados for l in lat)
+        errores = sum(e for _, e in resultados)
+        with connection.cursor() as c:
+            c.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT l.copy_id FROM biblioteca_loan l
+                    JOIN biblioteca_copy c ON c.id = l.copy_id
+                    WHERE c.book_id = %s AND l.returned_at IS NULL
+                    GROUP BY l.copy_id HAVING COUNT(*) > 1
+                ) t""", [ISBN])
+            duplicadas = c.fetchone()[0]
+
+        p95 = latencias[int(len(latencias) * 0.95) - 1] if latencias else 0
+        self.stdout.write(
+            f"{modo:12} {len(latencias):5} préstamos en {total:6.2f} s "
+            f"({len(latencias) / max(total, 1e-9):7.1f}/s) | "
+            f"mediana {statistics.median(latencias or [0]) * 1000:6.1f} ms | "
+            f"p95 {p95 * 1000:6.1f} ms | errores {errores} | "
+            f"copias prestadas dos veces {duplicadas}"
+        )
+        return modo != "skip_locked" or (duplicadas == 0 and len(latencias) == copias)
@@ -0,0 +1,331 @@
+"""Benchmark de las páginas, reportes y formularios de `proyecto4/urls.py`.
+
+Hace cada petición con el cliente de pruebas de Django contra la base
+configurada y mide, por caso:
+
+- latencia p50/p95/p99 (ms) de `--repeticiones` peticiones, tras
+  `--calentamiento` peticiones descartadas; las respuestas en streaming
+  (CSV) se consumen completas;
+- consultas SQL de una petición;
+- pico de memoria de Python de una petición (`tracemalloc`, KB).
+
+Los envíos de formularios y las APIs de préstamo se ejecutan dentro de una
+transacción que se revierte (tras `SET CONSTRAINTS ALL IMMEDIATE`, para que
+las comprobaciones diferidas también cuenten), así que la base no cambia. Los
+reportes se miden sin su caché (`reportes`), salvo con `--con-cache`. El
+admin de Django no se incluye.
+
+Con `--escalas` carga antes cada tamaño con `generar_datos --vaciar`
+(¡vacía la base!); sin él mide los datos actuales con la etiqueta `actual`.
+
+    python manage.py bench_endpoints --guardar               # nueva línea base
+    python manage.py bench_endpoints                         # compara con ella
+    python manage.py bench_endpoints --escalas 0.001 0.01 --guardar
+
+Sin `--guardar` compara con la línea base (`--base`, por defecto
+`bench_endpoints.json`) y termina con error si algún caso empeora: latencia
+p50 o memoria por encima de `--tolerancia` (y de 1 ms / 64 KB, para no
+señalar ruido) o cualquier consulta de más.
+"""
+import json
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from biblioteca.models import Book, Branch, Copy, Fine, LibraryUser, Loan, Reservation
+
+UMBRAL_MS = 1.0
+UMBRAL_KB = 64
+
+# Tablas cuyo tamaño se guarda junto a los resultados de cada escala
+TABLAS = ("biblioteca_book", "biblioteca_copy", "biblioteca_loan", "library_users",
+          "biblioteca_review", "biblioteca_branch")
+
+
+class Caso:
+    def __init__(self, nombre, url, metodo="get", datos=None, escritura=False):
+        self.nombre = nombre
+        self.url = url
+        self.metodo = metodo
+        self.datos = datos
+        self.escritura = escritura
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano sobre valores ordenados."""
+    i = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[i]
+
+
+def muestras():
+    """Ids reales sobre los que se construyen las URLs de detalle y edición."""
+    abierto = (Loan.objects.filter(returned_at__isnull=True)
+               .exclude(id__in=Fine.objects.values("loan_id"))
+               .order_by("id").first())
+    libro = Book.objects.filter(available_copies__gt=0).order_by("isbn").first()
+    # Para el borrado: un libro sin préstamos ni reservas (si no, PROTECT)
+    borrable = (Book.objects
+                .exclude(Exists(Loan.objects.filter(copy__book=OuterRef("pk"))))
+                .exclude(Exists(Reservation.objects.filter(copy__book=OuterRef("pk"))))
+                .order_by("isbn").first())
+    sucursal = Branch.objects.order_by("id").first()
+    copia = Copy.objects.filter(is_available=True).order_by("id").first()
+    usuario = LibraryUser.objects.order_by("id").first()
+    if not (abierto and libro and sucursal and copia and usuario):
+        raise CommandError("Faltan datos: carga data.sql o usa --escalas.")
+    return abierto, libro, borrable, sucursal, copia, usuario
+
+
+def casos():
+    abierto, libro, borrable, sucursal, copia, usuario = muestras()
+    vence = (date.today() + timedelta(days=14)).isoformat()
+    datos_libro = {
+        "title": libro.title, "published_year": libro.published_year,
+        "languages": ",".join(libro.languages), "condition": libro.condition,
+        "page_count": libro.page_count, "main_author": libro.main_author_id,
+    }
+    # Teléfono fijo: el de data.sql no siempre pasa el validador del modelo
+    datos_sucursal = {"name": f"{sucursal.name} (bench)", "address": sucursal.address,
+                      "phone": "+502 2222-0000"}
+    lista = [
+        # Listas y detalles
+        Caso("catalogo-list", reverse("catalogo-list")),
+        Caso("catalogo-detail", reverse("catalogo-detail", args=[libro.isbn])),
+        Caso("catalogo-buscar", reverse("catalogo-buscar") + "?q=libro"),
+        Caso("prestamos-list", reverse("prestamos-list")),
+        Caso("prestamos-detail", reverse("prestamos-detail", args=[abierto.user_id])),
+        Caso("prestamos-detail historial",
+             reverse("prestamos-detail", args=[abierto.user_id]) + "?historial=1"),
+        Caso("sucursales-list", reverse("sucursales-list")),
+        Caso("sucursal-detail", reverse("sucursal-detail", args=[sucursal.id])),
+
+        # Reportes
+        Caso("catalogo-report", reverse("catalogo-report")),
+        Caso("catalogo-report filtros",
+             reverse("catalogo-report") + "?year_min=1990&condition=good&estado=Disponible"),
+        Caso("catalogo-report genero", reverse("catalogo-report") + "?genero=ficc"),
+        Caso("catalogo-report csv", reverse("catalogo-report") + "?export=csv"),
+        Caso("prestamos-report", reverse("prestamos-report")),
+        Caso("prestamos-report filtros",
+             reverse("prestamos-report") + "?estado_prestamos=Con+retrasos&min_vencidos=1"),
+        Caso("prestamos-report historial", reverse("prestamos-report") + "?historial=1"),
+        Caso("prestamos-report csv", reverse("prestamos-report") + "?export=csv"),
+        Caso("sucursales-report", reverse("sucursales-report")),
+        Caso("sucursales-report filtros",
+             reverse("sucursales-report") + "?eventos_futuros=1&min_prestadas=1"),
+        Caso("sucursales-report historial", reverse("sucursales-report") + "?historial=1"),
+        Caso("sucursales-report csv", reverse("sucursales-report") + "?export=csv"),
+
+        # Formularios (GET) y envíos (POST, revertidos)
+        Caso("book-add form", reverse("book-add")),
+        Caso("book-add", reverse("book-add"), "post",
+             {**datos_libro, "isbn": "9999999999999"}, escritura=True),
+        Caso("book-edit form", reverse("book-edit", args=[libro.isbn])),
+        Caso("book-edit", reverse("book-edit", args=[libro.isbn]), "post",
+             datos_libro, escritura=True),
+        Caso("loan-add form", reverse("loan-add")),
+        Caso("loan-add", reverse("loan-add"), "post",
+             {"due_date": vence, "copy": copia.id, "user": usuario.id}, escritura=True),
+        Caso("loan-edit form", reverse("loan-edit", args=[abierto.id])),
+        Caso("loan-edit", reverse("loan-edit", args=[abierto.id]), "post",
+             {"due_date": abierto.due_date.isoformat(),
+              "returned_at": timezone.localtime().strftime("%Y-%m-%d %H:%M:%S"),
+              "copy": abierto.copy_id, "user": abierto.user_id}, escritura=True),
+        Caso("loan-delete", reverse("loan-delete", args=[abierto.id]), "post",
+             escritura=True),
+        Caso("loan-checkout", reverse("loan-checkout"), "post",
+             {"isbn": libro.isbn, "user": usuario.id}, escritura=True),
+        Caso("loan-bulk-return", reverse("loan-bulk-return"), "post",
+             {"loans": [abierto.id]}, escritura=True),
+        Caso("branch-add form", reverse("branch-add")),
+        Caso("branch-add", reverse("branch-add"), "post",
+             {**datos_sucursal, "name": "Sucursal bench"}, escritura=True),
+        Caso("branch-edit", reverse("branch-edit", args=[sucursal.id]), "post",
+             datos_sucursal, escritura=True),
+    ]
+    if borrable:
+        lista.append(Caso("book-delete", reverse("book-delete", args=[borrable.isbn]), "post",
+                          escritura=True))
+    return lista
+
+
+class _Revertir(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide latencia, consultas y memoria de cada endpoint y compara con una línea base."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeticiones", type=int, default=20)
+        parser.add_argument("--calentamiento", type=int, default=2)
+        parser.add_argument("--escalas", nargs="+", type=float,
+                            help="Carga cada escala con generar_datos --vaciar antes de medir.")
+        parser.add_argument("--base", default=str(Path(settings.BASE_DIR) / "bench_endpoints.json"))
+        parser.add_argument("--guardar", action="store_true",
+                            help="Escribe los resultados como nueva línea base.")
+        parser.add_argument("--tolerancia", type=float, default=0.25,
+                            help="Empeoramiento relativo admitido (por defecto 0.25 = 25%%).")
+        parser.add_argument("--casos", nargs="+", default=[],
+                            help="Solo los casos cuyo nombre contenga alguno de estos textos.")
+        parser.add_argument("--con-cache", action="store_true",
+                            help="Deja activa la caché de reportes.")
+
+    def handle(self, *args, **opts):
+        self.opts = opts
+        resultados = {"generado": timezone.now().isoformat(timespec="seconds"),
+                      "repeticiones": opts["repeticiones"], "escalas": {}}
+        # Sin la instrumentación SQL por petición: su coste no debe entrar en la medida
+        ajustes = {"ALLOWED_HOSTS": ["testserver"], "SQL_MUESTREO": 0}
+        if not opts["con_cache"]:
+            ajustes["CACHES"] = {
+                **settings.CACHES,
+                "bench": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            }
+            ajustes["REPORTES_CACHE"] = ajustes["REPORTES_GENERACIONES_CACHE"] = "bench"
+
+        for escala in opts["escalas"] or [None]:
+            etiqueta = "actual" if escala is None else str(escala)
+            if escala is not None:
+                self.stdout.write(f"Cargando escala {escala}...")
+                call_command("generar_datos", escala=escala, vaciar=True, verbosity=0)
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Escala {etiqueta}"))
+            with override_settings(**ajustes):
+                resultados["escalas"][etiqueta] = {
+                    "filas": self.filas(),
+                    "casos": self.medir(casos()),
+                }
+
+        ruta = Path(opts["base"])
+        if opts["guardar"]:
+            ruta.write_text(json.dumps(resultados, indent=2, ensure_ascii=False) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Línea base guardada en {ruta}"))
+        elif ruta.exists():
+            self.comparar(json.loads(ruta.read_text()), resultados)
+        else:
+            self.stdout.write(f"No hay línea base en {ruta}; usa --guardar para crearla.")
+
+    def filas(self):
+        with connection.cursor() as c:
+            return {t: self.contar(c, t) for t in TABLAS}
+
+    @staticmethod
+    def contar(cursor, tabla):
+        cursor.execute(f"SELECT count(*) FROM {tabla}")
+        return cursor.fetchone()[0]
+
+    def medir(self, lista):
+        client = Client()
+        filtro = self.opts["casos"]
+        resultados = {}
+        self.stdout.write(f"  {'caso':32} {'estado':>6} {'p50':>8} {'p95':>8} {'p99':>8} "
+                          f"{'consultas':>9} {'memoria':>10}")
+        for caso in lista:
+            if filtro and not any(f in caso.nombre for f in filtro):
+                continue
+            for _ in range(self.opts["calentamiento"]):
+                self.peticion(client, caso)
+            tiempos = []
+            for _ in range(self.opts["repeticiones"]):
+                t0 = time.perf_counter()
+                self.peticion(client, caso)
+                tiempos.append((time.perf_counter() - t0) * 1000)
+            tiempos.sort()
+
+            # Consultas y memoria en una petición aparte: tracemalloc ralentiza
+            tracemalloc.start()
+            try:
+                with CaptureQueriesContext(connection) as consultas:
+                    estado = self.peticion(client, caso)
+                memoria = tracemalloc.get_traced_memory()[1] / 1024
+            finally:
+                tracemalloc.stop()
+
+            r = resultados[caso.nombre] = {
+                "estado": estado,
+                "p50_ms": round(percentil(tiempos, 50), 2),
+                "p95_ms": round(percentil(tiempos, 95), 2),
+                "p99_ms": round(percentil(tiempos, 99), 2),
+                "consultas": len(consultas),
+                "memoria_kb": round(memoria, 1),
+            }
+            self.stdout.write(
+                f"  {caso.nombre:32} {estado:>6} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+                f"{r['p99_ms']:8.1f} {r['consultas']:>9} {r['memoria_kb']:>8.0f}KB"
+            )
+        return resultados
+
+    def peticion(self, client, caso):
+        if not caso.escritura:
+            return self.consumir(getattr(client, caso.metodo)(caso.url, caso.datos))
+        estado = None
+        try:
+            with transaction.atomic():
+                estado = self.consumir(getattr(client, caso.metodo)(caso.url, caso.datos))
+                # Comprobaciones diferidas ahora, como en el COMMIT
+                with connection.cursor() as c:
+                    c.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                raise _Revertir
+        except _Revertir:
+            pass
+        return estado
+
+    @staticmethod
+    def consumir(respuesta):
+        if respuesta.streaming:
+            for _ in respuesta.streaming_content:
+                pass
+        else:
+            respuesta.content
+        # El cliente ya emula el cierre del servidor WSGI (request_finished)
+        return respuesta.status_code
+
+    def comparar(self, base, actual):
+        tol = self.opts["tolerancia"]
+        regresiones = []
+        for etiqueta, datos in actual["escalas"].items():
+            anterior = base.get("escalas", {}).get(etiqueta)
+            if anterior is None:
+                self.stdout.write(f"La línea base no tiene la escala {etiqueta}.")
+                continue
+            if anterior["filas"] != datos["filas"]:
+                self.stdout.write(self.style.WARNING(
+                    f"Escala {etiqueta}: los datos no son los de la línea base; "
+                    "la comparación es orientativa."))
+            for nombre, r in datos["casos"].items():
+                b = anterior["casos"].get(nombre)
+                if b is None:
+                    continue
+                motivos = []
+                if r["estado"] != b["estado"]:
+                    motivos.append(f"estado {b['estado']} → {r['estado']}")
+                if r["p50_ms"] > b["p50_ms"] * (1 + tol) and r["p50_ms"] - b["p50_ms"] > UMBRAL_MS:
+                    motivos.append(f"p50 {b['p50_ms']:.1f} → {r['p50_ms']:.1f} ms")
+                if r["consultas"] > b["consultas"]:
+                    motivos.append(f"consultas {b['consultas']} → {r['consultas']}")
+                if (r["memoria_kb"] > b["memoria_kb"] * (1 + tol)
+                        and r["memoria_kb"] - b["memoria_kb"] > UMBRAL_KB):
+                    motivos.append(f"memoria {b['memoria_kb']:.0f} → {r['memoria_kb']:.0f} KB")
+                if motivos:
+                    regresiones.append(f"[{etiqueta}] {nombre}: {', '.join(motivos)}")
+                elif r["p50_ms"] < b["p50_ms"] * (1 - tol) and b["p50_ms"] - r["p50_ms"] > UMBRAL_MS:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"[{etiqueta}] {nombre}: p50 {b['p50_ms']:.1f} → {r['p50_ms']:.1f} ms"))
+
+        if regresiones:
+            for linea in regresiones:
+                self.stderr.write(self.style.ERROR(linea))
+            raise CommandError(f"{len(regresiones)} regresiones respecto a {self.opts['base']}.")
+        self.stdout.write(self.style.SUCCESS(f"Sin regresiones respecto a la línea base "
+                                             f"({base.get('generado', '?')})."))
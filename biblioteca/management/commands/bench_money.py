@@ -0,0 +1,84 @@
+"""Micro-benchmark de la lectura de columnas `money`.
+
+Lee `--filas` valores `money` generados en el servidor y compara:
+
+- regex:       texto del driver + la conversión anterior de `MoneyField`
+               (expresión regular por fila)
+- typecaster:  `money` convertido por el driver (biblioteca/adapters.py)
+- solo texto:  el texto sin convertir (cota inferior)
+
+y muestra filas por segundo de cada modo, comprobando que regex y
+typecaster dan el mismo importe.
+
+    python manage.py bench_money --filas 1000000
+"""
+import re
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from biblioteca import adapters
+
+CONSULTA = """
+    SELECT ((i::bigint * 7919) %% 10000000 * 0.01 - 50000)::numeric::money{cast}
+    FROM generate_series(1, %s) i
+"""
+
+
+def regex_anterior(value):
+    """Conversión de `MoneyField.from_db_value` antes del typecaster."""
+    if isinstance(value, str) and not ("," in value and "(" in value):
+        amount_text = re.sub(r"[^\d\.\-]", "", value)
+        amount = Decimal(amount_text)
+        return {"amount": amount, "currency": "USD"}
+    text = str(value).strip("(){} ")
+    amount, currency = text.split(",")
+    return {"amount": amount, "currency": currency}
+
+
+class Command(BaseCommand):
+    help = "Compara la conversión de `money` por regex contra el typecaster del driver."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--filas", type=int, default=1_000_000)
+        parser.add_argument("--repeticiones", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        if not adapters.money_registrado():
+            raise CommandError("El typecaster de money no está registrado (¿psycopg 3?).")
+        filas = opts["filas"]
+
+        def texto():
+            return self.leer(CONSULTA.format(cast="::text"), filas)
+
+        def regex():
+            return [regex_anterior(v) for v in self.leer(CONSULTA.format(cast="::text"), filas)]
+
+        def typecaster():
+            return self.leer(CONSULTA.format(cast=""), filas)
+
+        resultados = {}
+        for nombre, fn in (("regex", regex), ("typecaster", typecaster), ("solo texto", texto)):
+            mejor = None
+            for _ in range(opts["repeticiones"]):
+                t0 = time.perf_counter()
+                valores = fn()
+                t = time.perf_counter() - t0
+                mejor = t if mejor is None else min(mejor, t)
+            resultados[nombre] = valores
+            self.stdout.write(f"{nombre:12} {filas / mejor:12,.0f} filas/s ({mejor:.2f} s)")
+
+        if any(a["amount"] != b.amount
+               for a, b in zip(resultados["regex"], resultados["typecaster"])):
+            raise CommandError("regex y typecaster no coinciden.")
+        self.stdout.write(self.style.SUCCESS("Importes idénticos en ambos modos."))
+
+    def leer(self, sql, filas):
+        # Cursor de servidor: el coste medido es la conversión de filas,
+        # no la memoria del resultado completo
+        with connection.chunked_cursor() as c:
+            c.itersize = 10_000
+            c.execute(sql, [filas])
+            return [fila[0] for fila in c]
@@ -0,0 +1,280 @@
+"""Compara las vistas de reporte actuales contra su versión original.
+
+Genera un conjunto de datos sintético dentro de una transacción (que se
+revierte al final), ejecuta la consulta original con JOINs en abanico y la
+vista pre-agregada, verifica que devuelven lo mismo y muestra los tiempos.
+
+    python manage.py bench_vistas_reporte --usuarios 5000 --pesados 100
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# Definiciones originales (migración 0003) con JOINs lado a lado.
+PRESTAMOS_ORIGINAL = """
+    SELECT
+        u.id as usuario_id,
+        u.username,
+        CONCAT(u.first_name, ' ', u.last_name) as nombre_completo,
+        u.email,
+        u.status as estado_usuario,
+        COUNT(DISTINCT l.id) as total_prestamos,
+        COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) as prestamos_activos,
+        COUNT(DISTINCT CASE WHEN l.returned_at IS NOT NULL THEN l.id END) as prestamos_devueltos,
+        COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) as prestamos_vencidos,
+        COUNT(DISTINCT f.id) as total_multas,
+        COUNT(DISTINCT CASE WHEN f.paid = false THEN f.id END) as multas_pendientes,
+        COALESCE(SUM(CASE WHEN f.paid = false THEN f.amount ELSE 0 END), 0) as monto_multas_pendientes,
+        COUNT(DISTINCT r.id) as total_reservas,
+        COUNT(DISTINCT CASE WHEN r.expires_at > CURRENT_TIMESTAMP THEN r.id END) as reservas_activas,
+        COUNT(DISTINCT rev.id) as total_reviews,
+        u.date_joined,
+        CASE
+            WHEN COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) > 0
+            THEN 'Con retrasos'
+            WHEN COUNT(DISTINCT CASE WHEN f.paid = false THEN f.id END) > 0
+            THEN 'Con multas'
+            WHEN COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) > 0
+            THEN 'Con préstamos'
+            ELSE 'Sin actividad'
+        END as estado_prestamos
+    FROM library_users u
+    LEFT JOIN biblioteca_loan l ON u.id = l.user_id
+    LEFT JOIN biblioteca_fine f ON l.id = f.loan_id
+    LEFT JOIN biblioteca_reservation r ON u.id = r.user_id
+    LEFT JOIN biblioteca_review rev ON u.id = rev.user_id
+    WHERE u.status = 'active'
+    GROUP BY
+        u.id, u.username, u.first_name, u.last_name,
+        u.email, u.status, u.date_joined
+"""
+
+SUCURSALES_ORIGINAL = """
+    SELECT
+        br.id as sucursal_id,
+        br.name as nombre_sucursal,
+        br.address,
+        br.phone,
+        COUNT(DISTINCT s.id) as total_estantes,
+        COUNT(DISTINCT c.id) as total_copias,
+        COUNT(DISTINCT CASE WHEN c.is_available = true THEN c.id END) as copias_disponibles,
+        COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) as copias_prestadas,
+        COUNT(DISTINCT l.id) as total_prestamos_historicos,
+        COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) as prestamos_activos,
+        COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) as prestamos_vencidos,
+        COUNT(DISTINCT e.id) as total_eventos,
+        COUNT(DISTINCT CASE WHEN e.ends_at > CURRENT_TIMESTAMP THEN e.id END) as eventos_futuros,
+        COUNT(DISTINCT ea.id) as total_asistencias_eventos,
+        ROUND(
+            CASE
+                WHEN COUNT(DISTINCT c.id) > 0
+                THEN (COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / COUNT(DISTINCT c.id))
+                ELSE 0
+            END, 2
+        ) as porcentaje_ocupacion,
+        ROUND(
+            CASE
+                WHEN COUNT(DISTINCT e.id) > 0
+                THEN (COUNT(DISTINCT ea.id) * 1.0 / COUNT(DISTINCT e.id))
+                ELSE 0
+            END, 2
+        ) as promedio_asistencia_eventos,
+        br.created_at,
+        CASE
+            WHEN COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / NULLIF(COUNT(DISTINCT c.id), 0) >= 80
+            THEN 'Alta ocupación'
+            WHEN COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / NULLIF(COUNT(DISTINCT c.id), 0) >= 50
+            THEN 'Ocupación media'
+            WHEN COUNT(DISTINCT c.id) > 0
+            THEN 'Baja ocupación'
+            ELSE 'Sin actividad'
+        END as nivel_actividad
+    FROM biblioteca_branch br
+    LEFT JOIN biblioteca_shelf s ON br.id = s.branch_id
+    LEFT JOIN biblioteca_copy c ON s.id = c.shelf_id
+    LEFT JOIN biblioteca_loan l ON c.id = l.copy_id
+    LEFT JOIN biblioteca_event e ON br.id = e.branch_id
+    LEFT JOIN biblioteca_eventattendance ea ON e.id = ea.event_id
+    GROUP BY
+        br.id, br.name, br.address, br.phone, br.created_at
+"""
+
+# Monto pendiente calculado directamente, sin JOINs que lo multipliquen.
+MONTO_PENDIENTE_DIRECTO = """
+    SELECT l.user_id, SUM(f.amount)
+    FROM biblioteca_fine f JOIN biblioteca_loan l ON l.id = f.loan_id
+    WHERE f.paid = false
+    GROUP BY l.user_id
+"""
+
+DATOS_SQL = [
+    # Sucursales, estantes, autor y libros
+    """INSERT INTO biblioteca_branch (name, address, phone, created_at)
+       SELECT 'bench-' || i, 'Dirección ' || i, '555-' || i, NOW()
+       FROM generate_series(1, %(sucursales)s) i""",
+    """INSERT INTO biblioteca_shelf (branch_id, code, description)
+       SELECT b.id, 'BS' || s, 'bench'
+       FROM biblioteca_branch b, generate_series(1, 4) s
+       WHERE b.name LIKE 'bench-%%'""",
+    """INSERT INTO biblioteca_author (first_name, last_name, birth_year)
+       VALUES ('Bench', 'Autor', 1950)""",
+    """INSERT INTO biblioteca_book (isbn, title, published_year, languages, condition,
+                                    page_count, created_at, main_author_id)
+       SELECT (9990000000000 + i)::text, 'Libro bench ' || i, 2000, ARRAY['es'], 'good',
+              100, NOW(), (SELECT id FROM biblioteca_author WHERE last_name = 'Autor'
+                                                              AND first_name = 'Bench')
+       FROM generate_series(1, %(libros)s) i""",
+    """INSERT INTO biblioteca_copy (book_id, shelf_id, inventory_code, is_available, acquired_at, price)
+       SELECT (9990000000000 + 1 + i %% %(libros)s)::text,
+              (SELECT id FROM biblioteca_shelf WHERE description = 'bench'
+               ORDER BY id OFFSET i %% (4 * %(sucursales)s) LIMIT 1),
+              'BENCH-' || i, true, CURRENT_DATE, '10.00'
+       FROM generate_series(1, %(copias)s) i""",
+    # Usuarios: los primeros `pesados` concentran la actividad
+    """INSERT INTO library_users (username, email, first_name, last_name, password,
+                                  status, date_joined)
+       SELECT 'bench' || i, 'bench' || i || '@example.com', 'Bench', 'Usuario ' || i,
+              'x', 'active', NOW()
+       FROM generate_series(1, %(usuarios)s) i""",
+    """CREATE TEMP TABLE bench_usuarios ON COMMIT DROP AS
+       SELECT id, row_number() OVER (ORDER BY id) AS n
+       FROM library_users WHERE username LIKE 'bench%%'""",
+    """CREATE TEMP TABLE bench_copias ON COMMIT DROP AS
+       SELECT id, row_number() OVER (ORDER BY id) AS n
+       FROM biblioteca_copy WHERE inventory_code LIKE 'BENCH-%%'""",
+    """INSERT INTO biblioteca_loan (copy_id, user_id, loaned_at, due_date, returned_at)
+       SELECT c.id, u.id,
+              NOW() - (k || ' days')::interval,
+              (NOW() - (k || ' days')::interval)::date + 14,
+              CASE WHEN k %% 4 = 0 THEN NULL
+                   ELSE NOW() - (k || ' days')::interval + ((k %% 20) || ' days')::interval END
+       FROM bench_usuarios u
+       CROSS JOIN LATERAL generate_series(
+           1, CASE WHEN u.n <= %(pesados)s THEN %(prestamos_pesados)s ELSE 5 END) k
+       JOIN bench_copias c ON c.n = 1 + (u.n * 31 + k) %% %(copias)s""",
+    """INSERT INTO biblioteca_fine (loan_id, amount, created_at, paid)
+       SELECT l.id, 1.50, NOW(), l.id %% 3 = 0
+       FROM biblioteca_loan l JOIN bench_usuarios u ON u.id = l.user_id
+       WHERE l.id %% 5 = 0""",
+    """INSERT INTO biblioteca_reservation (copy_id, user_id, reserved_at, expires_at)
+       SELECT c.id, u.id, NOW(), NOW() + ((k - 5) || ' days')::interval
+       FROM bench_usuarios u
+       CROSS JOIN LATERAL generate_series(
+           1, CASE WHEN u.n <= %(pesados)s THEN %(reservas_pesados)s ELSE 1 END) k
+       JOIN bench_copias c ON c.n = 1 + (u.n + k * 7) %% %(copias)s
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO biblioteca_review (book_id, user_id, rating, comment, created_at)
+       SELECT (9990000000000 + 1 + (u.n + k) %% %(libros)s)::text, u.id, 'good', '', NOW()
+       FROM bench_usuarios u
+       CROSS JOIN LATERAL generate_series(
+           1, CASE WHEN u.n <= %(pesados)s THEN %(reviews_pesados)s ELSE 1 END) k
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO biblioteca_event (branch_id, title, description, starts_at, ends_at, capacity)
+       SELECT b.id, 'Evento ' || k, '', NOW() + ((k - 10) || ' days')::interval,
+              NOW() + ((k - 9) || ' days')::interval, 100
+       FROM biblioteca_branch b, generate_series(1, %(eventos)s) k
+       WHERE b.name LIKE 'bench-%%'""",
+    """INSERT INTO biblioteca_eventattendance (event_id, user_id, attended_at)
+       SELECT e.id, u.id, NOW()
+       FROM biblioteca_event e
+       JOIN biblioteca_branch b ON b.id = e.branch_id AND b.name LIKE 'bench-%%'
+       JOIN bench_usuarios u ON u.n %% 40 = e.id %% 40
+       ON CONFLICT DO NOTHING""",
+    "ANALYZE",
+]
+
+
+class Command(BaseCommand):
+    help = "Benchmark de equivalencia y rendimiento de las vistas de usuarios y sucursales."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--usuarios", type=int, default=2000)
+        parser.add_argument("--pesados", type=int, default=50,
+                            help="Usuarios con cientos de préstamos y decenas de reservas.")
+        parser.add_argument("--prestamos-pesados", type=int, default=300)
+        parser.add_argument("--reservas-pesados", type=int, default=30)
+        parser.add_argument("--reviews-pesados", type=int, default=20)
+        parser.add_argument("--libros", type=int, default=2000)
+        parser.add_argument("--copias", type=int, default=8000)
+        parser.add_argument("--sucursales", type=int, default=10)
+        parser.add_argument("--eventos", type=int, default=10)
+        parser.add_argument("--repeticiones", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        with transaction.atomic():
+            with connection.cursor() as c:
+                self.stdout.write("Generando datos…")
+                for sql in DATOS_SQL:
+                    c.execute(sql, opts)
+
+                ok_u = self.comparar(
+                    c, "vista_prestamos_usuarios", PRESTAMOS_ORIGINAL,
+                    "usuario_id", opts["repeticiones"], excluir={"monto_multas_pendientes"},
+                )
+                ok_u &= self.verificar_monto(c)
+                ok_s = self.comparar(
+                    c, "vista_actividad_sucursales", SUCURSALES_ORIGINAL,
+                    "sucursal_id", opts["repeticiones"],
+                )
+            transaction.set_rollback(True)
+
+        if ok_u and ok_s:
+            self.stdout.write(self.style.SUCCESS("Resultados idénticos."))
+        else:
+            self.stdout.write(self.style.ERROR("Las vistas NO son equivalentes."))
+
+    def medir(self, c, sql, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            c.execute(sql)
+            filas = c.fetchall()
+            tiempos.append(time.perf_counter() - t0)
+        return filas, statistics.median(tiempos)
+
+    def comparar(self, c, vista, original, pk, repeticiones, excluir=()):
+        filas_orig, t_orig = self.medir(
+            c, f"SELECT * FROM ({original}) o ORDER BY {pk}", repeticiones)
+        filas_new, t_new = self.medir(
+            c, f"SELECT * FROM {vista} ORDER BY {pk}", repeticiones)
+        columnas = [col.name for col in c.description]
+        indices = [i for i, col in enumerate(columnas) if col not in excluir]
+
+        distintas = [
+            (a[0], columnas[i])
+            for a, b in zip(filas_orig, filas_new)
+            for i in indices if a[i] != b[i]
+        ]
+        ok = len(filas_orig) == len(filas_new) and not distintas
+
+        self.stdout.write(
+            f"{vista}: {len(filas_new)} filas | original {t_orig * 1000:.1f} ms | "
+            f"pre-agregada {t_new * 1000:.1f} ms | x{t_orig / max(t_new, 1e-9):.1f}"
+        )
+        for pk_val, col in distintas[:10]:
+            self.stdout.write(self.style.WARNING(f"  difiere {pk}={pk_val} en {col}"))
+        return ok
+
+    def verificar_monto(self, c):
+        """El JOIN en abanico multiplicaba `monto_multas_pendientes` por el
+        número de reservas y reseñas; se compara contra la suma directa."""
+        c.execute(MONTO_PENDIENTE_DIRECTO)
+        directo = dict(c.fetchall())
+        c.execute("SELECT usuario_id, monto_multas_pendientes FROM vista_prestamos_usuarios")
+        malos = [
+            uid for uid, monto in c.fetchall()
+            if monto != directo.get(uid, 0)
+        ]
+        c.execute(f"""
+            SELECT COUNT(*) FROM ({PRESTAMOS_ORIGINAL}) o
+            LEFT JOIN ({MONTO_PENDIENTE_DIRECTO}) d(user_id, monto) ON d.user_id = o.usuario_id
+            WHERE o.monto_multas_pendientes <> COALESCE(d.monto, 0)
+        """)
+        inflados = c.fetchone()[0]
+        self.stdout.write(
+            f"  monto_multas_pendientes: {inflados} usuarios inflados por el abanico "
+            f"en la versión original; {len(malos)} discrepancias en la vista nueva"
+        )
+        return not malos
@@ -0,0 +1,177 @@
+"""Recomendaciones «los lectores también pidieron» a partir de los préstamos.
+
+    python manage.py calcular_recomendaciones [--vecinos 20] [--min-lectores 2]
+    python manage.py calcular_recomendaciones --incremental
+
+Trabajo fuera de línea; requiere numpy y scipy. Lee una sola vez todos los
+préstamos, actuales y archivados, como pares (usuario, libro) por `COPY`
+binario, y arma la matriz dispersa usuarios × libros B (1 si el usuario pidió
+el libro alguna vez). La coocurrencia libro × libro es BᵀB: cuántos lectores
+tienen en común cada par de libros. Se calcula por bloques de `--bloque`
+libros, sin tener nunca la matriz entera en memoria. De cada fila se guardan en
+`BookRecommendation` los `--vecinos` libros con mayor similitud coseno
+(lectores comunes / √(lectores de uno · lectores del otro)) que tengan al
+menos `--min-lectores` lectores en común. Todo el cálculo va vectorizado y
+Python solo recorre los libros para escribirlos.
+
+Con `--incremental` solo se recalculan los libros de los usuarios con
+préstamos nuevos desde la última ejecución: sus filas de BᵀB son las únicas
+que cambian. El resto se queda como estaba, así que las puntuaciones que tienen
+de vecino a uno de esos libros no se renormalizan. Además, un préstamo con id
+menor que la marca que se confirme más tarde no entra hasta el siguiente
+cálculo completo. Conviene uno completo de vez en cuando (p. ej. semanal) y el
+incremental a diario.
+"""
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+from django.utils import timezone
+
+from biblioteca.copy import copiar
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # dependencias opcionales: solo las usa este comando
+    np = sparse = None
+
+# (usuario, índice del libro en orden de ISBN) de cada préstamo
+PARES = """
+    COPY (
+        SELECT l.user_id, b.n
+        FROM biblioteca_loan_historial l
+        JOIN biblioteca_copy c ON c.id = l.copy_id
+        JOIN (SELECT isbn, (row_number() OVER (ORDER BY isbn) - 1)::int AS n
+              FROM biblioteca_book) b ON b.isbn = c.book_id
+    ) TO STDOUT (FORMAT binary)
+"""
+
+
+def leer_pares(cursor):
+    """`(usuarios, libros)` como arrays. En el formato binario de `COPY` cada
+    fila ocupa 22 bytes fijos: nº de campos y, por campo, longitud y valor."""
+    buffer = io.BytesIO()
+    if is_psycopg3:
+        with cursor.copy(PARES) as copy:
+            for bloque in copy:
+                buffer.write(bloque)
+    else:
+        cursor.copy_expert(PARES, buffer)
+    datos = buffer.getvalue()
+    cabecera = 19 + int.from_bytes(datos[15:19], "big")  # firma, flags, extensión
+    fila = np.dtype([("campos", ">i2"), ("l1", ">i4"), ("usuario", ">i8"),
+                     ("l2", ">i4"), ("libro", ">i4")])
+    filas = np.frombuffer(datos, dtype=fila, offset=cabecera,
+                          count=(len(datos) - cabecera - 2) // fila.itemsize)
+    return filas["usuario"].astype(np.int64), filas["libro"].astype(np.int32)
+
+
+def matriz_lectores(usuarios, libros, n_libros):
+    """B: usuarios × libros con un 1 si el usuario pidió el libro (al pasar a
+    CSR los préstamos repetidos se suman; luego se dejan en 1)."""
+    B = sparse.csr_matrix(
+        (np.ones(len(usuarios), dtype=np.float32), (usuarios, libros)),
+        shape=(int(usuarios.max(initial=0)) + 1, n_libros),
+    )
+    B.data[:] = 1
+    return B
+
+
+def vecinos(B, filas, k, min_lectores, bloque):
+    """Para cada libro de `filas` que tenga vecinos, `(libro, vecinos,
+    puntuaciones)`, de mayor a menor similitud y los empates por ISBN."""
+    Bt = B.T.tocsr()
+    lectores = np.diff(Bt.indptr).astype(np.float32)
+    for inicio in range(0, len(filas), bloque):
+        libros = filas[inicio:inicio + bloque]
+        C = (Bt[libros] @ B).tocoo()  # lectores comunes: bloque × libros
+        r, c, comunes = C.row, C.col, C.data
+        quedan = (c != libros[r]) & (comunes >= min_lectores)
+        r, c, comunes = r[quedan], c[quedan], comunes[quedan]
+        puntuacion = comunes / np.sqrt(lectores[libros[r]] * lectores[c])
+
+        orden = np.lexsort((c, -puntuacion, r))
+        r, c, puntuacion = r[orden], c[orden], puntuacion[orden]
+        # Posición de cada entrada dentro de su fila (r ya está ordenado)
+        quedan = np.arange(len(r)) - np.searchsorted(r, r) < k
+        r, c, puntuacion = r[quedan], c[quedan], puntuacion[quedan]
+        if not len(r):
+            continue
+        cortes = np.flatnonzero(np.diff(r)) + 1
+        yield from zip(libros[r[np.r_[0, cortes]]], np.split(c, cortes), np.split(puntuacion, cortes))
+
+
+class Command(BaseCommand):
+    help = "Calcula los libros prestados juntos (BookRecommendation) desde el historial."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vecinos", type=int, default=20,
+                            help="Recomendaciones guardadas por libro.")
+        parser.add_argument("--min-lectores", type=int, default=2,
+                            help="Lectores en común mínimos para recomendar un libro.")
+        parser.add_argument("--bloque", type=int, default=2000,
+                            help="Libros por producto de matrices.")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Solo los libros de los usuarios con préstamos nuevos.")
+
+    def handle(self, *args, **opts):
+        if np is None:
+            raise CommandError("calcular_recomendaciones requiere numpy y scipy "
+                               "(pip install numpy scipy).")
+        t0 = time.perf_counter()
+        # Préstamos, libros y marca de la misma instantánea (dentro de una
+        # transacción ya abierta, como en las pruebas, se usa la suya)
+        anidada = connection.in_atomic_block
+        with transaction.atomic(), connection.cursor() as c:
+            if not anidada:
+                c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            c.execute("SELECT pg_try_advisory_xact_lock(hashtext('calcular_recomendaciones'))")
+            if not c.fetchone()[0]:
+                raise CommandError("Ya hay un cálculo de recomendaciones en curso.")
+            c.execute("SELECT ultimo_prestamo FROM biblioteca_recomendacion_estado")
+            estado = c.fetchone()
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM biblioteca_loan")
+            marca = c.fetchone()[0]
+            c.execute("SELECT isbn FROM biblioteca_book ORDER BY isbn")
+            isbns = np.array([isbn for (isbn,) in c.fetchall()])
+            usuarios, libros = leer_pares(c)
+            B = matriz_lectores(usuarios, libros, len(isbns))
+            self.stdout.write(f"{len(usuarios)} préstamos de {B.shape[0]} usuarios y "
+                              f"{len(isbns)} libros leídos en {time.perf_counter() - t0:.1f} s")
+
+            incremental = opts["incremental"] and estado is not None
+            if opts["incremental"] and not incremental:
+                self.stdout.write(self.style.WARNING("Sin cálculo previo: se calcula todo."))
+            if incremental:
+                c.execute("SELECT DISTINCT user_id FROM biblioteca_loan WHERE id > %s", [estado[0]])
+                nuevos = np.array([u for (u,) in c.fetchall()], dtype=np.int64)
+                filas = np.unique(B[nuevos].indices).astype(np.int32)
+                c.execute("DELETE FROM biblioteca_bookrecommendation WHERE book_id = ANY(%s)",
+                          [isbns[filas].tolist()])
+            else:
+                filas = np.arange(len(isbns), dtype=np.int32)
+                c.execute("DELETE FROM biblioteca_bookrecommendation")
+
+            t1 = time.perf_counter()
+            ahora = timezone.now().isoformat()
+            lineas = (
+                f"{isbns[libro]}\t{{{','.join(isbns[cs])}}}\t"
+                f"{{{','.join(f'{p:.4f}' for p in ps.tolist())}}}\t{ahora}\n"
+                for libro, cs, ps in vecinos(B, filas, opts["vecinos"], opts["min_lectores"],
+                                             opts["bloque"])
+            )
+            escritas = copiar(c, "biblioteca_bookrecommendation",
+                              "book_id, related, scores, computed_at", lineas)
+            c.execute("""
+                INSERT INTO biblioteca_recomendacion_estado (ultimo_prestamo, calculado_en)
+                VALUES (%s, NOW())
+                ON CONFLICT (id) DO UPDATE SET ultimo_prestamo = EXCLUDED.ultimo_prestamo,
+                                               calculado_en = EXCLUDED.calculado_en
+            """, [marca])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(filas)} libros recalculados, {escritas} con recomendaciones, en "
+            f"{time.perf_counter() - t1:.1f} s (total {time.perf_counter() - t0:.1f} s)"))
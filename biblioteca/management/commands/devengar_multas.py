@@ -0,0 +1,54 @@
+"""Devengo nocturno de multas de los préstamos abiertos vencidos.
+
+    python manage.py devengar_multas [--fecha AAAA-MM-DD] [--lote 5000]
+
+Recorre los préstamos abiertos por id en lotes de `--lote`, cada uno en su
+propia transacción (los bloqueos sobre `biblioteca_fine` duran un lote), y
+deja en cada multa el importe acumulado hasta `--fecha` (por defecto hoy)
+llamando a `devengar_multas()` en la base. Volver a ejecutarlo el mismo día
+no reescribe nada. Al devolver el préstamo, `trg_generate_fine` fija el
+importe final.
+
+La tarifa diaria (0.50 por defecto) se configura en la base:
+
+    ALTER DATABASE proyecto4 SET biblioteca.multa_diaria = '0.75';
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date
+
+
+class Command(BaseCommand):
+    help = "Devenga en bloque las multas de los préstamos abiertos vencidos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fecha", type=parse_date, default=None,
+                            help="Fecha hasta la que se devenga (por defecto hoy).")
+        parser.add_argument("--lote", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        with connection.cursor() as c:
+            c.execute("SELECT COALESCE(%s::date, CURRENT_DATE), multa_diaria()", [opts["fecha"]])
+            fecha, tarifa = c.fetchone()
+        self.stdout.write(f"Devengando multas hasta {fecha} a {tarifa} por día")
+
+        desde, examinados, escritas = 0, 0, 0
+        t0 = time.perf_counter()
+        while True:
+            with transaction.atomic(), connection.cursor() as c:
+                c.execute("SELECT * FROM devengar_multas(%s, %s, %s)",
+                          [fecha, desde, opts["lote"]])
+                hasta, n, e = c.fetchone()
+            if not n:
+                break
+            desde, examinados, escritas = hasta, examinados + n, escritas + e
+            if opts["verbosity"] > 1:
+                self.stdout.write(f"  hasta id {hasta}: {n} préstamos, {e} multas")
+
+        total = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"{examinados} préstamos abiertos, {escritas} multas escritas en "
+            f"{total:.2f} s ({examinados / max(total, 1e-9):.0f} préstamos/s)"
+        ))
@@ -0,0 +1,54 @@
+"""Escucha `pg_notify` de los triggers e invalida la caché de reportes.
+
+    python manage.py escuchar_reportes
+
+Debe correr como proceso aparte y las cachés (`settings.REPORTES_CACHE` y
+`settings.REPORTES_GENERACIONES_CACHE`) deben ser compartidas entre procesos
+(base de datos, Redis, Memcached...).
+"""
+import select
+import time
+
+import psycopg2
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from biblioteca.report_cache import CHANNEL, FAMILIAS, invalidate
+
+
+class Command(BaseCommand):
+    help = "Invalida la caché de reportes al recibir notificaciones de la base de datos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--timeout", type=float, default=5.0,
+                            help="Segundos de espera por iteración.")
+
+    def handle(self, *args, **opts):
+        while True:
+            try:
+                self.escuchar(opts["timeout"])
+            except (OperationalError, psycopg2.OperationalError) as exc:
+                self.stderr.write(f"Conexión perdida ({exc}); reintentando…")
+                connection.close()
+                time.sleep(opts["timeout"])
+
+    def escuchar(self, timeout):
+        connection.ensure_connection()
+        with connection.cursor() as c:
+            c.execute(f"LISTEN {CHANNEL}")
+        pg = connection.connection
+        # Pudimos perder avisos mientras no escuchábamos
+        invalidate(FAMILIAS)
+        self.stdout.write(f"Escuchando '{CHANNEL}'…")
+
+        while True:
+            if select.select([pg], [], [], timeout) == ([], [], []):
+                continue
+            pg.poll()
+            familias = set()
+            while pg.notifies:
+                aviso = pg.notifies.pop(0)
+                familias.update(f for f in aviso.payload.split(",") if f)
+            if familias:
+                invalidate(familias)
+                self.stdout.write(f"Invalidadas: {', '.join(sorted(familias))}")
@@ -0,0 +1,282 @@
+"""Carga de datos sintéticos a gran escala con `COPY`.
+
+    python manage.py generar_datos --escala 0.01 --vaciar
+    python manage.py generar_datos --escala 1 --procesos 8   # ~1M libros, 20M préstamos
+
+Genera todas las tablas de `biblioteca/models.py` (ver
+`biblioteca/datos_sinteticos.py`) y las envía por `COPY ... FROM STDIN` en
+trozos repartidos entre `--procesos` procesos, cada uno con su conexión. Pasos:
+
+1. Crea las particiones anuales de préstamos necesarias y guarda y elimina
+   los índices secundarios (los que no respaldan una PK/UNIQUE) de las tablas
+   a cargar, en `generar_datos_indices` para poder restaurarlos si la carga
+   se interrumpe (la siguiente ejecución lo hace antes de nada).
+2. Carga con `session_replication_role = replica`: ni triggers ni
+   comprobaciones de FK durante la carga (requiere superusuario). Los datos
+   ya salen coherentes: disponibilidad de copias y contadores de libros
+   cuadran con los préstamos abiertos.
+3. Calcula la valoración de los libros, los votos de las reseñas y los
+   contadores de las sucursales, vuelve a crear los índices en paralelo,
+   reconstruye en bloque lo que mantienen los triggers
+   (`biblioteca_booksearch`, `mv_catalogo_libros`, `circulation_daily`),
+   ajusta las secuencias y hace `ANALYZE`.
+
+No se genera auditoría (sería la de la propia carga). Las multas de los
+préstamos abiertos vencidos se devengan después con `manage.py devengar_multas`.
+"""
+import multiprocessing
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from django.utils import timezone
+
+from biblioteca import datos_sinteticos as ds
+from biblioteca.copy import copiar
+
+# Estado de cada proceso (se hereda con fork)
+_plan = None
+
+
+def _iniciar(plan):
+    global _plan
+    _plan = plan
+
+
+def _cargar(tarea):
+    nombre, desde, hasta, extra = tarea
+    generador, _ = ds.GENERADORES[nombre]
+    rng = random.Random(f"{_plan.semilla}:{nombre}:{desde}")
+    t0 = time.perf_counter()
+    filas = {}
+    with transaction.atomic(), connection.cursor() as c:
+        c.execute("SET LOCAL session_replication_role = replica")
+        c.execute("SET LOCAL synchronous_commit = off")
+        for tabla, columnas, lineas in generador(_plan, rng, desde, hasta, extra):
+            filas[tabla] = filas.get(tabla, 0) + copiar(c, tabla, columnas, lineas)
+    return nombre, filas, time.perf_counter() - t0
+
+
+def _ejecutar(sql):
+    t0 = time.perf_counter()
+    with connection.cursor() as c:
+        c.execute("SET session_replication_role = replica")
+        c.execute(sql)
+        c.execute("RESET session_replication_role")
+    return sql, time.perf_counter() - t0
+
+
+class Command(BaseCommand):
+    help = "Genera datos sintéticos a escala y los carga con COPY en paralelo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--escala", type=float, default=0.01,
+                            help="1 = 1M libros, ~5M copias, 20M préstamos (por defecto 0.01).")
+        parser.add_argument("--procesos", type=int, default=multiprocessing.cpu_count())
+        parser.add_argument("--filas-por-tarea", type=int, default=200_000)
+        parser.add_argument("--anios-historia", type=int, default=3)
+        parser.add_argument("--semilla", default="biblioteca")
+        parser.add_argument("--vaciar", action="store_true",
+                            help="Vacía (TRUNCATE) las tablas antes de cargar.")
+
+    def handle(self, *args, **opts):
+        self.procesos = max(1, opts["procesos"])
+        self.verbosity = opts["verbosity"]
+        t_inicio = time.perf_counter()
+        self.restaurar_indices()
+
+        plan = ds.Plan(opts["escala"], opts["semilla"], opts["anios_historia"], timezone.now())
+        self.stdout.write(", ".join(f"{k} {v:,}" for k, v in plan.n.items()))
+        self.preparar(plan, opts["vaciar"])
+
+        tareas = []
+        for nombre, (_, total) in ds.GENERADORES.items():
+            n = total(plan)
+            paso = 1 if nombre == "catalogos" else opts["filas_por_tarea"]
+            for desde in range(0, n, paso):
+                hasta = min(n, desde + paso)
+                extra = plan.abiertos_antes_de(desde) if nombre == "prestamos_abiertos" else None
+                tareas.append((nombre, desde, hasta, extra))
+        # Las más largas primero para repartir mejor la carga
+        tareas.sort(key=lambda t: t[2] - t[1], reverse=True)
+
+        t0 = time.perf_counter()
+        filas = {}
+        for nombre, f, _ in self.en_paralelo(_cargar, tareas, plan):
+            for tabla, n in f.items():
+                filas[tabla] = filas.get(tabla, 0) + n
+        total = sum(filas.values())
+        t = time.perf_counter() - t0
+        for tabla in ds.TABLAS:
+            self.stdout.write(f"  {tabla:28} {filas.get(tabla, 0):>12,}")
+        self.stdout.write(f"COPY: {total:,} filas en {t:.1f} s ({total / max(t, 1e-9):,.0f} filas/s)")
+
+        self.contadores(plan, opts["filas_por_tarea"])
+        self.crear_indices(excluir=ds.DERIVADAS)
+        self.derivadas(plan, opts["filas_por_tarea"])
+        self.crear_indices()
+        self.finalizar()
+        self.stdout.write(self.style.SUCCESS(
+            f"Carga completa en {time.perf_counter() - t_inicio:.1f} s. "
+            "Para devengar las multas de los préstamos vencidos: manage.py devengar_multas"
+        ))
+
+    def en_paralelo(self, funcion, tareas, plan=None):
+        # Las conexiones no pueden compartirse entre procesos: se cierran
+        # antes del fork y cada proceso abre la suya
+        connections.close_all()
+        contexto = multiprocessing.get_context("fork")
+        with contexto.Pool(self.procesos, initializer=_iniciar, initargs=(plan,)) as pool:
+            yield from pool.imap_unordered(funcion, tareas)
+
+    def preparar(self, plan, vaciar):
+        tablas = ds.TABLAS + ds.DERIVADAS
+        with transaction.atomic(), connection.cursor() as c:
+            try:
+                c.execute("SET LOCAL session_replication_role = replica")
+            except DatabaseError:
+                raise CommandError("La carga requiere un superusuario (session_replication_role).")
+
+            if vaciar:
+                c.execute(f"TRUNCATE {', '.join(tablas)}, biblioteca_loan_archivo, "
+                          "biblioteca_auditlog RESTART IDENTITY CASCADE")
+            else:
+                for tabla in tablas:
+                    c.execute(f"SELECT EXISTS (SELECT 1 FROM {tabla})")
+                    if c.fetchone()[0]:
+                        raise CommandError(f"{tabla} no está vacía (usa --vaciar).")
+
+            for anio in plan.anios_prestamos():
+                c.execute("SELECT prestamos_crear_particion(%s)", [anio])
+
+            c.execute("""CREATE TABLE generar_datos_indices (
+                             tabla TEXT NOT NULL, nombre TEXT NOT NULL, definicion TEXT NOT NULL)""")
+            # Índices que no respaldan restricciones; en las tablas particionadas
+            # el del padre (su definición lleva ON ONLY, que se quita al crearlo)
+            c.execute("""
+                INSERT INTO generar_datos_indices
+                SELECT t.relname, i.relname, pg_get_indexdef(x.indexrelid)
+                FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                JOIN pg_class t ON t.oid = x.indrelid
+                WHERE t.relname = ANY(%s)
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = x.indexrelid)
+            """, [tablas])
+            c.execute("SELECT nombre FROM generar_datos_indices")
+            indices = [nombre for (nombre,) in c.fetchall()]
+            for nombre in indices:
+                c.execute(f'DROP INDEX "{nombre}"')
+        self.stdout.write(f"{len(indices)} índices secundarios eliminados hasta el final de la carga.")
+
+    def restaurar_indices(self):
+        with connection.cursor() as c:
+            c.execute("SELECT to_regclass('generar_datos_indices') IS NOT NULL")
+            if not c.fetchone()[0]:
+                return
+        self.stdout.write(self.style.WARNING("Restaurando índices de una carga interrumpida..."))
+        self.crear_indices()
+        with connection.cursor() as c:
+            c.execute("DROP TABLE generar_datos_indices")
+
+    def crear_indices(self, excluir=()):
+        with connection.cursor() as c:
+            c.execute("""SELECT nombre, definicion FROM generar_datos_indices
+                         WHERE NOT (tabla = ANY(%s))""", [list(excluir)])
+            indices = dict(c.fetchall())
+        # IF NOT EXISTS: si se interrumpe a medias, la restauración solo crea
+        # los que falten; cada definición se borra de la tabla tras crearse
+        definiciones = [
+            re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX IF NOT EXISTS ", d)
+            .replace(" ON ONLY ", " ON ", 1)
+            for d in indices.values()
+        ]
+        t0 = time.perf_counter()
+        for sql, t in self.en_paralelo(_ejecutar, definiciones):
+            if self.verbosity > 1:
+                self.stdout.write(f"  {t:6.1f} s  {sql}")
+        with connection.cursor() as c:
+            c.execute("DELETE FROM generar_datos_indices WHERE nombre = ANY(%s)", [list(indices)])
+        self.stdout.write(f"{len(definiciones)} índices creados en {time.perf_counter() - t0:.1f} s")
+
+    @staticmethod
+    def rangos(plan, paso):
+        """Condiciones `isbn >= … AND isbn < …` que cubren todos los libros."""
+        n = plan.n["libros"]
+        return [
+            f"isbn >= '{ds.isbn(desde)}' AND isbn < '{ds.isbn(min(n, desde + paso))}'"
+            if desde + paso < n else f"isbn >= '{ds.isbn(desde)}'"
+            for desde in range(0, n, paso)
+        ]
+
+    def contadores(self, plan, paso):
+        """Valoración de cada libro y votos de cada reseña (triggers de la
+        migración 0018) y copias y préstamos de cada sucursal (0021). Van antes
+        de recrear los índices secundarios: el UPDATE reescribe todas las filas
+        y así no tiene que mantenerlos."""
+        sentencias = [
+            f"""UPDATE biblioteca_book b
+                SET rating_sum = r.suma, rating_count = r.total
+                FROM (SELECT book_id, SUM(rating_valor(rating)) AS suma, COUNT(*) AS total
+                      FROM biblioteca_review WHERE {rango.replace('isbn', 'book_id')}
+                      GROUP BY book_id) r
+                WHERE b.isbn = r.book_id"""
+            for rango in self.rangos(plan, paso)
+        ] + [
+            f"""UPDATE biblioteca_review r
+                SET upvotes = v.utiles, downvotes = v.no_utiles,
+                    helpfulness = wilson_inferior(v.utiles, v.no_utiles)
+                FROM (SELECT review_id, COUNT(*) FILTER (WHERE is_upvote) AS utiles,
+                             COUNT(*) FILTER (WHERE NOT is_upvote) AS no_utiles
+                      FROM biblioteca_reviewvote
+                      WHERE review_id > {desde} AND review_id <= {desde + paso}
+                      GROUP BY review_id) v
+                WHERE r.id = v.review_id"""
+            for desde in range(0, plan.n["resenias"], paso)
+        ] + [
+            """UPDATE biblioteca_branch br
+               SET total_copies = d.copias, total_loans = d.prestamos
+               FROM (SELECT sh.branch_id, COUNT(*) AS copias,
+                            COALESCE(SUM(p.total), 0) AS prestamos
+                     FROM biblioteca_shelf sh
+                     JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                     LEFT JOIN (SELECT copy_id, COUNT(*) AS total
+                                FROM biblioteca_loan GROUP BY copy_id) p ON p.copy_id = co.id
+                     GROUP BY sh.branch_id) d
+               WHERE br.id = d.branch_id"""
+        ]
+        t0 = time.perf_counter()
+        for _ in self.en_paralelo(_ejecutar, sentencias):
+            pass
+        self.stdout.write(f"Valoraciones, votos de reseñas y sucursales en {time.perf_counter() - t0:.1f} s")
+
+    def derivadas(self, plan, paso):
+        """Lo que mantienen los triggers, calculado en bloque por rangos de ISBN."""
+        sentencias = []
+        for rango in self.rangos(plan, paso):
+            sentencias += [
+                f"""INSERT INTO biblioteca_booksearch (book_id, search_vector)
+                    SELECT isbn, book_search_document(isbn) FROM biblioteca_book WHERE {rango}""",
+                f"INSERT INTO mv_catalogo_libros SELECT * FROM vista_catalogo_libros WHERE {rango}",
+                f"""INSERT INTO circulation_daily
+                        (day, branch_id, book_id, loans_opened, loans_returned, overdue,
+                         fines_issued, fine_amount)
+                    SELECT * FROM circulacion_historial(NULL, NULL)
+                    WHERE {rango.replace('isbn', 'book_id')}""",
+            ]
+        t0 = time.perf_counter()
+        for _ in self.en_paralelo(_ejecutar, sentencias):
+            pass
+        self.stdout.write(f"Búsqueda, catálogo y circulación reconstruidos en {time.perf_counter() - t0:.1f} s")
+
+    def finalizar(self):
+        with connection.cursor() as c:
+            for tabla in ds.TABLAS:
+                if tabla == "biblioteca_book":
+                    continue
+                c.execute(f"""SELECT setval(pg_get_serial_sequence('{tabla}', 'id'),
+                                            COALESCE((SELECT MAX(id) FROM {tabla}), 0) + 1, false)""")
+            c.execute("DROP TABLE generar_datos_indices")
+            c.execute(f"ANALYZE {', '.join(ds.TABLAS + ds.DERIVADAS)}")
+            c.execute("SELECT notify_reportes('catalogo,prestamos,sucursales')")
@@ -0,0 +1,88 @@
+"""Mantenimiento de las particiones mensuales de `biblioteca_auditlog`.
+
+    python manage.py particiones_auditlog [--dry-run]
+    python manage.py particiones_auditlog --retener-meses 12
+
+Pensado para cron (diario): crea por adelantado las particiones de los
+próximos meses y borra con `DROP TABLE` (sin `DELETE` ni VACUUM posterior) las
+particiones completas anteriores a la retención, que por defecto es
+`settings.AUDITLOG_RETENCION_MESES`; si ese ajuste es `None` y no se pasa
+`--retener-meses`, no se borra nada.
+
+Lo que llegue a `biblioteca_auditlog_default` se mueve a su mes al crear la
+partición. La partición por defecto no se elimina nunca (es la red de
+seguridad), pero sus filas anteriores al corte se borran con `DELETE`: solo
+recibe filas mientras falta la partición del mes, así que es pequeña.
+"""
+import re
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+NOMBRE_RE = re.compile(r"^biblioteca_auditlog_p(\d{4})(\d{2})$")
+
+
+def restar_meses(d, meses):
+    total = d.year * 12 + (d.month - 1) - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = "Crea las particiones próximas de la auditoría y elimina las vencidas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--meses-adelante", type=int, default=3)
+        parser.add_argument(
+            "--retener-meses", type=int,
+            default=getattr(settings, "AUDITLOG_RETENCION_MESES", None),
+            help="Meses completos a conservar además del actual "
+                 "(por defecto AUDITLOG_RETENCION_MESES; si es None no borra).",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        with transaction.atomic(), connection.cursor() as c:
+            if not opts["dry_run"]:
+                c.execute("SELECT auditlog_asegurar_particiones(%s)", [opts["meses_adelante"]])
+                for (nombre,) in c.fetchall():
+                    self.stdout.write(f"Partición lista: {nombre}")
+
+            if opts["retener_meses"] is None:
+                return
+            c.execute("SELECT (NOW() AT TIME ZONE 'UTC')::date")
+            corte = restar_meses(c.fetchone()[0].replace(day=1), opts["retener_meses"])
+            c.execute("""
+                SELECT child.relname
+                FROM pg_inherits i
+                JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE i.inhparent = 'biblioteca_auditlog'::regclass
+                ORDER BY child.relname
+            """)
+            viejas = [
+                nombre for (nombre,) in c.fetchall()
+                if (m := NOMBRE_RE.match(nombre))
+                and date(int(m[1]), int(m[2]), 1) < corte
+            ]
+            c.execute(
+                "SELECT COUNT(*) FROM biblioteca_auditlog_default "
+                "WHERE changed_at < %s::timestamp AT TIME ZONE 'UTC'", [corte]
+            )
+            en_default = c.fetchone()[0]
+            if en_default and opts["dry_run"]:
+                self.stdout.write(f"Se borrarían {en_default} filas de biblioteca_auditlog_default")
+            elif en_default:
+                c.execute(
+                    "DELETE FROM biblioteca_auditlog_default "
+                    "WHERE changed_at < %s::timestamp AT TIME ZONE 'UTC'", [corte]
+                )
+                self.stdout.write(f"Borradas {c.rowcount} filas de biblioteca_auditlog_default")
+            for nombre in viejas:
+                if opts["dry_run"]:
+                    self.stdout.write(f"Se eliminaría {nombre}")
+                else:
+                    c.execute(f'DROP TABLE "{nombre}"')
+                    self.stdout.write(f"Eliminada {nombre}")
+            if not viejas and not en_default:
+                self.stdout.write(f"Nada anterior a {corte:%Y-%m}.")
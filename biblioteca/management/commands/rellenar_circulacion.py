@@ -0,0 +1,90 @@
+"""Recalcula `circulation_daily` desde el historial de préstamos y multas.
+
+    python manage.py rellenar_circulacion
+    python manage.py rellenar_circulacion --desde 2024-01-01 --hasta 2024-12-31
+    python manage.py rellenar_circulacion --comprobar
+
+Los triggers de la migración 0016 mantienen el resumen al día; este comando
+lo construye la primera vez y lo corrige si alguien cargó datos sin triggers
+o movió copias de sucursal. Borra y vuelve a calcular los días del rango
+(ambos extremos incluidos; sin rango, todos) a partir de los préstamos
+actuales y archivados. Mientras dura, las escrituras de préstamos y multas
+esperan (sus triggers escriben en el resumen).
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+COLUMNAS = ("day, branch_id, book_id, loans_opened, loans_returned, overdue, "
+            "fines_issued, fine_amount")
+
+DIFERENCIAS = f"""
+    SELECT COUNT(*) FROM (
+        (SELECT {COLUMNAS} FROM circulation_daily
+         WHERE day >= COALESCE(%(desde)s, '-infinity'::date)
+           AND day < COALESCE(%(hasta)s, 'infinity'::date)
+           AND (loans_opened, loans_returned, overdue, fines_issued, fine_amount)
+               <> (0, 0, 0, 0, 0)
+         EXCEPT ALL
+         SELECT * FROM circulacion_historial(%(desde)s, %(hasta)s))
+        UNION ALL
+        (SELECT * FROM circulacion_historial(%(desde)s, %(hasta)s)
+         EXCEPT ALL
+         SELECT {COLUMNAS} FROM circulation_daily
+         WHERE day >= COALESCE(%(desde)s, '-infinity'::date)
+           AND day < COALESCE(%(hasta)s, 'infinity'::date))
+    ) d
+"""
+
+
+def fecha(valor):
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise CommandError(f"Fecha no válida: {valor} (AAAA-MM-DD).")
+
+
+class Command(BaseCommand):
+    help = "Recalcula el resumen diario de circulación desde el historial."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--desde", type=fecha, help="Primer día (incluido).")
+        parser.add_argument("--hasta", type=fecha, help="Último día (incluido).")
+        parser.add_argument("--comprobar", action="store_true",
+                            help="Solo cuenta las filas que difieren del historial.")
+
+    def handle(self, *args, **opts):
+        rango = {
+            "desde": opts["desde"],
+            "hasta": opts["hasta"] + timedelta(days=1) if opts["hasta"] else None,
+        }
+        if rango["desde"] and rango["hasta"] and rango["desde"] >= rango["hasta"]:
+            raise CommandError("--desde debe ser anterior o igual a --hasta.")
+
+        with transaction.atomic(), connection.cursor() as c:
+            if opts["comprobar"]:
+                c.execute(DIFERENCIAS, rango)
+                diferencias = c.fetchone()[0]
+                if diferencias:
+                    self.stdout.write(self.style.WARNING(
+                        f"{diferencias} filas difieren del historial (ejecuta sin --comprobar)."))
+                else:
+                    self.stdout.write(self.style.SUCCESS("Resumen de circulación correcto."))
+                return
+
+            # Sin escrituras de los triggers mientras se recalcula
+            c.execute("LOCK TABLE circulation_daily IN EXCLUSIVE MODE")
+            c.execute("""
+                DELETE FROM circulation_daily
+                WHERE day >= COALESCE(%(desde)s, '-infinity'::date)
+                  AND day < COALESCE(%(hasta)s, 'infinity'::date)
+            """, rango)
+            borradas = c.rowcount
+            c.execute(f"""
+                INSERT INTO circulation_daily ({COLUMNAS})
+                SELECT * FROM circulacion_historial(%(desde)s, %(hasta)s)
+                ORDER BY 1, 2, 3
+            """, rango)
+            self.stdout.write(f"Resumen recalculado: {borradas} filas borradas, {c.rowcount} escritas.")
+            c.execute("SELECT notify_reportes('prestamos')")
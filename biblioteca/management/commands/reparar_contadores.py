@@ -0,0 +1,132 @@
+"""Verifica (y con --reparar corrige) los contadores mantenidos por triggers:
+`Book.total_copies`/`available_copies`, `Book.rating_count`/`rating_sum`,
+`Review.upvotes`/`downvotes` (con su `helpfulness`) y
+`Branch.total_copies`/`total_loans`.
+
+    python manage.py reparar_contadores
+    python manage.py reparar_contadores --reparar
+
+Los contadores los mantienen los triggers de biblioteca_copy, biblioteca_review,
+biblioteca_reviewvote, biblioteca_loan y biblioteca_shelf; este comando solo hace falta si alguien los desactivó
+o cargó datos sin ellos.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# Cada consulta devuelve (clave, actual1, actual2, real1, real2) de las filas
+# con diferencias
+COPIAS = """
+    SELECT b.isbn, b.total_copies, b.available_copies,
+           COALESCE(c.total, 0), COALESCE(c.disponibles, 0)
+    FROM biblioteca_book b
+    LEFT JOIN (
+        SELECT book_id, COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE is_available) AS disponibles
+        FROM biblioteca_copy GROUP BY book_id
+    ) c ON c.book_id = b.isbn
+    WHERE (b.total_copies, b.available_copies)
+          IS DISTINCT FROM (COALESCE(c.total, 0), COALESCE(c.disponibles, 0))
+    ORDER BY b.isbn
+"""
+
+RESENAS = """
+    SELECT b.isbn, b.rating_count, b.rating_sum,
+           COALESCE(r.total, 0), COALESCE(r.suma, 0)
+    FROM biblioteca_book b
+    LEFT JOIN (
+        SELECT book_id, COUNT(*) AS total, SUM(rating_valor(rating)) AS suma
+        FROM biblioteca_review GROUP BY book_id
+    ) r ON r.book_id = b.isbn
+    WHERE (b.rating_count, b.rating_sum)
+          IS DISTINCT FROM (COALESCE(r.total, 0), COALESCE(r.suma, 0))
+    ORDER BY b.isbn
+"""
+
+VOTOS = """
+    SELECT r.id, r.upvotes, r.downvotes,
+           COALESCE(v.utiles, 0), COALESCE(v.no_utiles, 0)
+    FROM biblioteca_review r
+    LEFT JOIN (
+        SELECT review_id, COUNT(*) FILTER (WHERE is_upvote) AS utiles,
+               COUNT(*) FILTER (WHERE NOT is_upvote) AS no_utiles
+        FROM biblioteca_reviewvote GROUP BY review_id
+    ) v ON v.review_id = r.id
+    WHERE (r.upvotes, r.downvotes)
+          IS DISTINCT FROM (COALESCE(v.utiles, 0), COALESCE(v.no_utiles, 0))
+    ORDER BY r.id
+"""
+
+SUCURSALES = """
+    SELECT br.id, br.total_copies, br.total_loans,
+           COALESCE(d.copias, 0), COALESCE(d.prestamos, 0)
+    FROM biblioteca_branch br
+    LEFT JOIN (
+        SELECT sh.branch_id, COUNT(*) AS copias, COALESCE(SUM(p.total), 0) AS prestamos
+        FROM biblioteca_shelf sh
+        JOIN biblioteca_copy co ON co.shelf_id = sh.id
+        LEFT JOIN (
+            SELECT copy_id, COUNT(*) AS total FROM biblioteca_loan GROUP BY copy_id
+        ) p ON p.copy_id = co.id
+        GROUP BY sh.branch_id
+    ) d ON d.branch_id = br.id
+    WHERE (br.total_copies, br.total_loans)
+          IS DISTINCT FROM (COALESCE(d.copias, 0), COALESCE(d.prestamos, 0))
+    ORDER BY br.id
+"""
+
+# (orígenes que se bloquean, diferencias, tabla, clave, columnas, SET adicional)
+CONTADORES = [
+    ("biblioteca_copy", COPIAS, "biblioteca_book", "isbn",
+     ("total_copies", "available_copies"), ""),
+    ("biblioteca_review", RESENAS, "biblioteca_book", "isbn",
+     ("rating_count", "rating_sum"), ""),
+    ("biblioteca_reviewvote", VOTOS, "biblioteca_review", "id",
+     ("upvotes", "downvotes"), ", helpfulness = wilson_inferior(d.real1, d.real2)"),
+    ("biblioteca_shelf, biblioteca_copy, biblioteca_loan", SUCURSALES, "biblioteca_branch", "id",
+     ("total_copies", "total_loans"), ""),
+]
+
+
+class Command(BaseCommand):
+    help = "Compara los contadores de libros, reseñas y sucursales con las tablas de las que salen."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reparar", action="store_true",
+                            help="Corrige las filas con diferencias.")
+        parser.add_argument("--mostrar", type=int, default=20,
+                            help="Cuántas diferencias listar por contador.")
+
+    def handle(self, *args, **opts):
+        with transaction.atomic(), connection.cursor() as c:
+            if opts["reparar"]:
+                # Sin escrituras concurrentes en los orígenes mientras se recuenta
+                for origen, *_ in CONTADORES:
+                    c.execute(f"LOCK TABLE {origen} IN SHARE MODE")
+                c.execute("SELECT set_config('biblioteca.reparar_contadores', 'on', true)")
+
+            for origen, diferencias, tabla, clave, (col1, col2), extra in CONTADORES:
+                c.execute(diferencias)
+                filas = c.fetchall()
+
+                for fila, actual1, actual2, real1, real2 in filas[:opts["mostrar"]]:
+                    self.stdout.write(
+                        f"{tabla} {fila}: {col1} {actual1} -> {real1}, "
+                        f"{col2} {actual2} -> {real2}"
+                    )
+                if not filas:
+                    self.stdout.write(self.style.SUCCESS(f"{tabla}.{col1}/{col2} correctos."))
+                    continue
+                if not opts["reparar"]:
+                    self.stdout.write(self.style.WARNING(
+                        f"{len(filas)} filas de {tabla} con diferencias en {col1}/{col2} "
+                        "(usa --reparar)."
+                    ))
+                    continue
+
+                c.execute(f"""
+                    UPDATE {tabla} t
+                    SET {col1} = d.real1, {col2} = d.real2{extra}
+                    FROM ({diferencias}) AS d(clave, actual1, actual2, real1, real2)
+                    WHERE t.{clave} = d.clave
+                """)
+                self.stdout.write(self.style.SUCCESS(f"{c.rowcount} filas de {tabla} reparadas."))
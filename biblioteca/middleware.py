@@ -0,0 +1,277 @@
+"""Instrumentación SQL por petición.
+
+`InstrumentacionSQLMiddleware` envuelve la ejecución de SQL de todas las
+conexiones (`connection.execute_wrapper`, sin necesidad de `DEBUG`) y en una
+fracción `SQL_MUESTREO` de las peticiones anota:
+
+- número de consultas y tiempo total en la base;
+- las `SQL_LENTAS` sentencias más lentas;
+- sentencias repetidas: la misma SQL (con distintos parámetros) ejecutada
+  `SQL_REPETIDAS_MIN` veces o más en una petición, el patrón N+1 de una
+  plantilla que recorre una relación sin `select_related`;
+- consultas de metadatos (`SQL_CONSTANTES`, p. ej. `enum_range`) cuyo
+  resultado no cambia entre peticiones y debería cachearse.
+
+El resumen sale en la cabecera `Server-Timing` (si `SQL_SERVER_TIMING`) y en
+el logger `biblioteca.sql` como JSON, con nivel WARNING si hay repetidas o
+constantes. En las respuestas en streaming (CSV) la cabecera solo cuenta lo
+ejecutado antes de empezar a enviar; el log se escribe al terminar.
+
+Los dos middlewares son síncronos y asíncronos: un middleware solo síncrono
+obligaría a Django a atender cada petición ASGI en un hilo, también las de
+las vistas de `async_views.py`.
+
+`ReplicaLecturaMiddleware` fija por petición el estado que usa
+`biblioteca.routers.ReplicaRouter` para decidir qué lecturas van a la réplica.
+"""
+import contextvars
+import json
+import logging
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import routers
+
+logger = logging.getLogger("biblioteca.sql")
+
+CONSTANTES_POR_DEFECTO = (r"\benum_range\s*\(", r"\bpg_enum\b")
+
+# Registro de la petición en curso. Las conexiones son por hilo y el SQL de
+# una vista asíncrona corre en hilos de `sync_to_async`, que heredan el
+# contexto: el wrapper fijo de cada conexión anota en el registro del contexto.
+_registro = contextvars.ContextVar("registro_sql", default=None)
+
+
+def _anotar(execute, sql, params, many, context):
+    registro = _registro.get()
+    if registro is None:
+        return execute(sql, params, many, context)
+    return registro(execute, sql, params, many, context)
+
+
+def instalar(sender=None, connection=None, **kwargs):
+    """`connection_created`: instala `_anotar` en la conexión (una vez)."""
+    if _anotar not in connection.execute_wrappers:
+        # Al principio: `execute_wrapper()` quita el último al salir
+        connection.execute_wrappers.insert(0, _anotar)
+
+
+class RegistroSQL:
+    """`execute_wrapper`: guarda (sql, duración en ms) de cada sentencia."""
+
+    def __init__(self):
+        self.sentencias = []
+
+    def __call__(self, execute, sql, params, many, context):
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sentencias.append((sql, (time.perf_counter() - t0) * 1000))
+
+    def resumen(self, lentas, repetidas_min, constantes):
+        total = sum(ms for _, ms in self.sentencias)
+        por_sql = {}
+        for sql, ms in self.sentencias:
+            n, acumulado = por_sql.get(sql, (0, 0.0))
+            por_sql[sql] = (n + 1, acumulado + ms)
+        return {
+            "consultas": len(self.sentencias),
+            "db_ms": round(total, 2),
+            "lentas": [
+                {"ms": round(ms, 2), "sql": sql}
+                for sql, ms in sorted(self.sentencias, key=lambda s: s[1], reverse=True)[:lentas]
+            ],
+            "repetidas": [
+                {"veces": n, "ms": round(ms, 2), "sql": sql}
+                for sql, (n, ms) in sorted(por_sql.items(), key=lambda s: s[1][0], reverse=True)
+                if n >= repetidas_min
+            ],
+            "constantes": [
+                {"veces": n, "sql": sql}
+                for sql, (n, _) in por_sql.items()
+                if any(p.search(sql) for p in constantes)
+            ],
+        }
+
+
+class InstrumentacionSQLMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.muestreo = getattr(settings, "SQL_MUESTREO", 0.0)
+        if self.muestreo <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        self.lentas = getattr(settings, "SQL_LENTAS", 5)
+        self.repetidas_min = getattr(settings, "SQL_REPETIDAS_MIN", 3)
+        self.server_timing = getattr(settings, "SQL_SERVER_TIMING", settings.DEBUG)
+        self.constantes = [re.compile(p, re.IGNORECASE)
+                           for p in getattr(settings, "SQL_CONSTANTES", CONSTANTES_POR_DEFECTO)]
+        connection_created.connect(instalar, dispatch_uid="biblioteca.sql")
+        for conexion in connections.all(initialized_only=True):
+            instalar(connection=conexion)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        if not self.muestrear():
+            return self.get_response(request)
+
+        registro = RegistroSQL()
+        t0 = time.perf_counter()
+        token = _registro.set(registro)
+        try:
+            response = self.get_response(request)
+        finally:
+            _registro.reset(token)
+        return self.terminar(registro, request, response, t0)
+
+    async def __acall__(self, request):
+        if not self.muestrear():
+            return await self.get_response(request)
+
+        registro = RegistroSQL()
+        t0 = time.perf_counter()
+        token = _registro.set(registro)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _registro.reset(token)
+        return self.terminar(registro, request, response, t0)
+
+    def muestrear(self):
+        return random.random() < self.muestreo
+
+    def terminar(self, registro, request, response, t0):
+        app_ms = (time.perf_counter() - t0) * 1000
+        if self.server_timing:
+            response["Server-Timing"] = self.cabecera(registro, app_ms)
+        if response.streaming:
+            al_terminar = self.al_terminar_async if response.is_async else self.al_terminar
+            response.streaming_content = al_terminar(
+                response.streaming_content, registro, request, response, t0)
+        else:
+            self.registrar(registro, request, response, app_ms)
+        return response
+
+    def al_terminar(self, contenido, registro, request, response, t0):
+        token = _registro.set(registro)
+        try:
+            yield from contenido
+        finally:
+            _registro.reset(token)
+        self.registrar(registro, request, response, (time.perf_counter() - t0) * 1000)
+
+    async def al_terminar_async(self, contenido, registro, request, response, t0):
+        token = _registro.set(registro)
+        try:
+            async for parte in contenido:
+                yield parte
+        finally:
+            _registro.reset(token)
+        self.registrar(registro, request, response, (time.perf_counter() - t0) * 1000)
+
+    def cabecera(self, registro, app_ms):
+        resumen = registro.resumen(0, self.repetidas_min, self.constantes)
+        partes = [
+            f'db;dur={resumen["db_ms"]:.1f};desc="{resumen["consultas"]} consultas"',
+            f"app;dur={app_ms:.1f}",
+        ]
+        if resumen["repetidas"]:
+            veces = sum(r["veces"] for r in resumen["repetidas"])
+            partes.append(f'db-repetidas;desc="{veces} en {len(resumen["repetidas"])} sentencias"')
+        if resumen["constantes"]:
+            partes.append(f'db-constantes;desc="{len(resumen["constantes"])} sentencias"')
+        return ", ".join(partes)
+
+    def registrar(self, registro, request, response, app_ms):
+        datos = {
+            "metodo": request.method,
+            "ruta": request.path,
+            "vista": getattr(request.resolver_match, "view_name", None),
+            "estado": response.status_code,
+            "app_ms": round(app_ms, 2),
+            **registro.resumen(self.lentas, self.repetidas_min, self.constantes),
+        }
+        nivel = logging.WARNING if datos["repetidas"] or datos["constantes"] else logging.INFO
+        logger.log(nivel, json.dumps(datos, ensure_ascii=False), extra={"sql": datos})
+
+
+class ReplicaLecturaMiddleware:
+    sync_capable = True
+    async_capable = True
+    METODOS_SEGUROS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        if routers.replica_alias() is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.fijar = getattr(settings, "REPLICA_FIJAR_PRIMARIA", 15)
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def estado(self, request):
+        return routers.EstadoPeticion(
+            primaria=request.method not in self.METODOS_SEGUROS or routers.COOKIE in request.COOKIES)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        estado = self.estado(request)
+        token = routers.activar(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.desactivar(token)
+        return self.terminar(request, response, estado)
+
+    async def __acall__(self, request):
+        estado = self.estado(request)
+        token = routers.activar(estado)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.desactivar(token)
+        return self.terminar(request, response, estado)
+
+    def terminar(self, request, response, estado):
+        if response.streaming:
+            # El CSV se consulta al enviarse, fuera de get_response
+            con_estado = self.con_estado_async if response.is_async else self.con_estado
+            response.streaming_content = con_estado(response.streaming_content, estado)
+        if estado.escrito or request.method not in self.METODOS_SEGUROS:
+            response.set_cookie(routers.COOKIE, "1", max_age=self.fijar, httponly=True, samesite="Lax")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        estado = routers.estado_actual()
+        if estado is not None:
+            estado.reporte = getattr(getattr(view_func, "view_class", None), "usar_replica", False)
+
+    def con_estado(self, contenido, estado):
+        token = routers.activar(estado)
+        try:
+            yield from contenido
+        finally:
+            routers.desactivar(token)
+
+    async def con_estado_async(self, contenido, estado):
+        token = routers.activar(estado)
+        try:
+            async for parte in contenido:
+                yield parte
+        finally:
+            routers.desactivar(token)
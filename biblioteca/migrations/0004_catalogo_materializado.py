@@ -0,0 +1,172 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0003_create_views'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            -- Tabla materializada del catálogo (misma forma que la vista)
+            CREATE TABLE mv_catalogo_libros AS
+                SELECT * FROM vista_catalogo_libros;
+            ALTER TABLE mv_catalogo_libros ADD PRIMARY KEY (isbn);
+            CREATE INDEX mv_catalogo_libros_title_idx ON mv_catalogo_libros (title, isbn);
+
+            -- Refresco incremental: recalcula solo los ISBN indicados
+            CREATE OR REPLACE FUNCTION refresh_catalogo_libros(p_isbns VARCHAR[])
+            RETURNS void AS $$
+            BEGIN
+                -- serializa refrescos concurrentes del mismo ISBN
+                PERFORM pg_advisory_xact_lock(hashtext('mv_catalogo_libros'), hashtext(s.isbn))
+                FROM (SELECT DISTINCT i AS isbn FROM unnest(p_isbns) i ORDER BY 1) s;
+
+                DELETE FROM mv_catalogo_libros WHERE isbn = ANY(p_isbns);
+                INSERT INTO mv_catalogo_libros
+                SELECT * FROM vista_catalogo_libros WHERE isbn = ANY(p_isbns);
+            END;$$ LANGUAGE plpgsql;
+
+            -- Trigger (por sentencia): tablas hijas con columna book_id
+            CREATE OR REPLACE FUNCTION trg_catalogo_hijos() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM nuevas;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM viejas;
+                ELSE
+                    SELECT array_agg(DISTINCT book_id) INTO isbns
+                    FROM (SELECT book_id FROM nuevas UNION SELECT book_id FROM viejas) t;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_catalogo_libros(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Trigger (por sentencia): cambios en el propio libro
+            CREATE OR REPLACE FUNCTION trg_catalogo_libro() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(isbn) INTO isbns FROM nuevas;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(isbn) INTO isbns FROM viejas;
+                ELSE
+                    SELECT array_agg(DISTINCT isbn) INTO isbns
+                    FROM (SELECT isbn FROM nuevas UNION SELECT isbn FROM viejas) t;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_catalogo_libros(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Trigger (por sentencia): renombrar autores o géneros
+            CREATE OR REPLACE FUNCTION trg_catalogo_nombres() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_author' THEN
+                    SELECT array_agg(DISTINCT isbn) INTO isbns FROM (
+                        SELECT b.isbn FROM biblioteca_book b JOIN nuevas n ON b.main_author_id = n.id
+                        UNION
+                        SELECT ba.book_id FROM biblioteca_bookauthor ba JOIN nuevas n ON ba.author_id = n.id
+                    ) t;
+                ELSE
+                    SELECT array_agg(DISTINCT bg.book_id) INTO isbns
+                    FROM biblioteca_bookgenre bg JOIN nuevas n ON bg.genre_id = n.id;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_catalogo_libros(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_catalogo_book_ins AFTER INSERT ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_libro();
+            CREATE TRIGGER trg_catalogo_book_upd AFTER UPDATE ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_libro();
+            CREATE TRIGGER trg_catalogo_book_del AFTER DELETE ON biblioteca_book
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_libro();
+
+            CREATE TRIGGER trg_catalogo_copy_ins AFTER INSERT ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_copy_upd AFTER UPDATE ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_copy_del AFTER DELETE ON biblioteca_copy
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+
+            CREATE TRIGGER trg_catalogo_review_ins AFTER INSERT ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_review_upd AFTER UPDATE ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_review_del AFTER DELETE ON biblioteca_review
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+
+            CREATE TRIGGER trg_catalogo_bookgenre_ins AFTER INSERT ON biblioteca_bookgenre
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_bookgenre_upd AFTER UPDATE ON biblioteca_bookgenre
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_bookgenre_del AFTER DELETE ON biblioteca_bookgenre
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+
+            CREATE TRIGGER trg_catalogo_bookauthor_ins AFTER INSERT ON biblioteca_bookauthor
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_bookauthor_upd AFTER UPDATE ON biblioteca_bookauthor
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_bookauthor_del AFTER DELETE ON biblioteca_bookauthor
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+
+            CREATE TRIGGER trg_catalogo_author_upd AFTER UPDATE ON biblioteca_author
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_nombres();
+            CREATE TRIGGER trg_catalogo_genre_upd AFTER UPDATE ON biblioteca_genre
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_nombres();
+            """,
+            reverse_sql="""
+            DROP TRIGGER IF EXISTS trg_catalogo_genre_upd ON biblioteca_genre;
+            DROP TRIGGER IF EXISTS trg_catalogo_author_upd ON biblioteca_author;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookauthor_del ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookauthor_upd ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookauthor_ins ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookgenre_del ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookgenre_upd ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_catalogo_bookgenre_ins ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_catalogo_review_del ON biblioteca_review;
+            DROP TRIGGER IF EXISTS trg_catalogo_review_upd ON biblioteca_review;
+            DROP TRIGGER IF EXISTS trg_catalogo_review_ins ON biblioteca_review;
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_del ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_upd ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_ins ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_catalogo_book_del ON biblioteca_book;
+            DROP TRIGGER IF EXISTS trg_catalogo_book_upd ON biblioteca_book;
+            DROP TRIGGER IF EXISTS trg_catalogo_book_ins ON biblioteca_book;
+            DROP FUNCTION IF EXISTS trg_catalogo_nombres();
+            DROP FUNCTION IF EXISTS trg_catalogo_libro();
+            DROP FUNCTION IF EXISTS trg_catalogo_hijos();
+            DROP FUNCTION IF EXISTS refresh_catalogo_libros(VARCHAR[]);
+            DROP TABLE IF EXISTS mv_catalogo_libros;
+            """,
+        ),
+    ]
@@ -0,0 +1,251 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0004_catalogo_materializado'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+CREATE OR REPLACE VIEW vista_prestamos_usuarios AS
+                -- Cada tabla hija se agrega por separado antes de unirse al
+                -- usuario, para no multiplicar préstamos × reservas × reseñas.
+                SELECT
+                    u.id as usuario_id,
+                    u.username,
+                    CONCAT(u.first_name, ' ', u.last_name) as nombre_completo,
+                    u.email,
+                    u.status as estado_usuario,
+                    COALESCE(l.total, 0) as total_prestamos,
+                    COALESCE(l.activos, 0) as prestamos_activos,
+                    COALESCE(l.devueltos, 0) as prestamos_devueltos,
+                    COALESCE(l.vencidos, 0) as prestamos_vencidos,
+                    COALESCE(f.total, 0) as total_multas,
+                    COALESCE(f.pendientes, 0) as multas_pendientes,
+                    COALESCE(f.monto_pendiente, 0) as monto_multas_pendientes,
+                    COALESCE(r.total, 0) as total_reservas,
+                    COALESCE(r.activas, 0) as reservas_activas,
+                    COALESCE(rev.total, 0) as total_reviews,
+                    u.date_joined,
+                    CASE
+                        WHEN COALESCE(l.vencidos, 0) > 0
+                        THEN 'Con retrasos'
+                        WHEN COALESCE(f.pendientes, 0) > 0
+                        THEN 'Con multas'
+                        WHEN COALESCE(l.activos, 0) > 0
+                        THEN 'Con préstamos'
+                        ELSE 'Sin actividad'
+                    END as estado_prestamos
+                FROM library_users u
+                LEFT JOIN (
+                    SELECT user_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE returned_at IS NULL) as activos,
+                           COUNT(*) FILTER (WHERE returned_at IS NOT NULL) as devueltos,
+                           COUNT(*) FILTER (WHERE returned_at IS NULL AND due_date < CURRENT_DATE) as vencidos
+                    FROM biblioteca_loan
+                    GROUP BY user_id
+                ) l ON l.user_id = u.id
+                LEFT JOIN (
+                    SELECT lo.user_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE fi.paid = false) as pendientes,
+                           SUM(fi.amount) FILTER (WHERE fi.paid = false) as monto_pendiente
+                    FROM biblioteca_fine fi
+                    JOIN biblioteca_loan lo ON lo.id = fi.loan_id
+                    GROUP BY lo.user_id
+                ) f ON f.user_id = u.id
+                LEFT JOIN (
+                    SELECT user_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE expires_at > CURRENT_TIMESTAMP) as activas
+                    FROM biblioteca_reservation
+                    GROUP BY user_id
+                ) r ON r.user_id = u.id
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) as total
+                    FROM biblioteca_review
+                    GROUP BY user_id
+                ) rev ON rev.user_id = u.id
+                WHERE u.status = 'active'
+                ORDER BY u.username;
+            """,
+            reverse_sql="""
+CREATE OR REPLACE VIEW vista_prestamos_usuarios AS
+                SELECT
+                    u.id as usuario_id,
+                    u.username,
+                    CONCAT(u.first_name, ' ', u.last_name) as nombre_completo,
+                    u.email,
+                    u.status as estado_usuario,
+                    COUNT(DISTINCT l.id) as total_prestamos,
+                    COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) as prestamos_activos,
+                    COUNT(DISTINCT CASE WHEN l.returned_at IS NOT NULL THEN l.id END) as prestamos_devueltos,
+                    COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) as prestamos_vencidos,
+                    COUNT(DISTINCT f.id) as total_multas,
+                    COUNT(DISTINCT CASE WHEN f.paid = false THEN f.id END) as multas_pendientes,
+                    COALESCE(SUM(CASE WHEN f.paid = false THEN f.amount ELSE 0 END), 0) as monto_multas_pendientes,
+                    COUNT(DISTINCT r.id) as total_reservas,
+                    COUNT(DISTINCT CASE WHEN r.expires_at > CURRENT_TIMESTAMP THEN r.id END) as reservas_activas,
+                    COUNT(DISTINCT rev.id) as total_reviews,
+                    u.date_joined,
+                    CASE
+                        WHEN COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) > 0
+                        THEN 'Con retrasos'
+                        WHEN COUNT(DISTINCT CASE WHEN f.paid = false THEN f.id END) > 0
+                        THEN 'Con multas'
+                        WHEN COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) > 0
+                        THEN 'Con préstamos'
+                        ELSE 'Sin actividad'
+                    END as estado_prestamos
+                FROM library_users u
+                LEFT JOIN biblioteca_loan l ON u.id = l.user_id
+                LEFT JOIN biblioteca_fine f ON l.id = f.loan_id
+                LEFT JOIN biblioteca_reservation r ON u.id = r.user_id
+                LEFT JOIN biblioteca_review rev ON u.id = rev.user_id
+                WHERE u.status = 'active'
+                GROUP BY
+                    u.id, u.username, u.first_name, u.last_name,
+                    u.email, u.status, u.date_joined
+                ORDER BY u.username;
+            """,
+        ),
+        migrations.RunSQL(
+            sql="""
+CREATE OR REPLACE VIEW vista_actividad_sucursales AS
+                -- Estantes, copias, préstamos, eventos y asistencias se agregan
+                -- por sucursal en subconsultas independientes.
+                SELECT
+                    br.id as sucursal_id,
+                    br.name as nombre_sucursal,
+                    br.address,
+                    br.phone,
+                    COALESCE(s.total, 0) as total_estantes,
+                    COALESCE(c.total, 0) as total_copias,
+                    COALESCE(c.disponibles, 0) as copias_disponibles,
+                    COALESCE(c.prestadas, 0) as copias_prestadas,
+                    COALESCE(l.total, 0) as total_prestamos_historicos,
+                    COALESCE(l.activos, 0) as prestamos_activos,
+                    COALESCE(l.vencidos, 0) as prestamos_vencidos,
+                    COALESCE(e.total, 0) as total_eventos,
+                    COALESCE(e.futuros, 0) as eventos_futuros,
+                    COALESCE(ea.total, 0) as total_asistencias_eventos,
+                    ROUND(
+                        CASE
+                            WHEN COALESCE(c.total, 0) > 0
+                            THEN (c.prestadas * 100.0 / c.total)
+                            ELSE 0
+                        END, 2
+                    ) as porcentaje_ocupacion,
+                    ROUND(
+                        CASE
+                            WHEN COALESCE(e.total, 0) > 0
+                            THEN (COALESCE(ea.total, 0) * 1.0 / e.total)
+                            ELSE 0
+                        END, 2
+                    ) as promedio_asistencia_eventos,
+                    br.created_at,
+                    CASE
+                        WHEN c.prestadas * 100.0 / NULLIF(c.total, 0) >= 80
+                        THEN 'Alta ocupación'
+                        WHEN c.prestadas * 100.0 / NULLIF(c.total, 0) >= 50
+                        THEN 'Ocupación media'
+                        WHEN COALESCE(c.total, 0) > 0
+                        THEN 'Baja ocupación'
+                        ELSE 'Sin actividad'
+                    END as nivel_actividad
+                FROM biblioteca_branch br
+                LEFT JOIN (
+                    SELECT branch_id, COUNT(*) as total
+                    FROM biblioteca_shelf
+                    GROUP BY branch_id
+                ) s ON s.branch_id = br.id
+                LEFT JOIN (
+                    SELECT sh.branch_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE co.is_available = true) as disponibles,
+                           COUNT(*) FILTER (WHERE co.is_available = false) as prestadas
+                    FROM biblioteca_copy co
+                    JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                    GROUP BY sh.branch_id
+                ) c ON c.branch_id = br.id
+                LEFT JOIN (
+                    SELECT sh.branch_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL) as activos,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL AND lo.due_date < CURRENT_DATE) as vencidos
+                    FROM biblioteca_loan lo
+                    JOIN biblioteca_copy co ON co.id = lo.copy_id
+                    JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                    GROUP BY sh.branch_id
+                ) l ON l.branch_id = br.id
+                LEFT JOIN (
+                    SELECT branch_id,
+                           COUNT(*) as total,
+                           COUNT(*) FILTER (WHERE ends_at > CURRENT_TIMESTAMP) as futuros
+                    FROM biblioteca_event
+                    GROUP BY branch_id
+                ) e ON e.branch_id = br.id
+                LEFT JOIN (
+                    SELECT ev.branch_id, COUNT(*) as total
+                    FROM biblioteca_eventattendance asi
+                    JOIN biblioteca_event ev ON ev.id = asi.event_id
+                    GROUP BY ev.branch_id
+                ) ea ON ea.branch_id = br.id
+                ORDER BY br.name;
+            """,
+            reverse_sql="""
+CREATE OR REPLACE VIEW vista_actividad_sucursales AS
+                SELECT
+                    br.id as sucursal_id,
+                    br.name as nombre_sucursal,
+                    br.address,
+                    br.phone,
+                    COUNT(DISTINCT s.id) as total_estantes,
+                    COUNT(DISTINCT c.id) as total_copias,
+                    COUNT(DISTINCT CASE WHEN c.is_available = true THEN c.id END) as copias_disponibles,
+                    COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) as copias_prestadas,
+                    COUNT(DISTINCT l.id) as total_prestamos_historicos,
+                    COUNT(DISTINCT CASE WHEN l.returned_at IS NULL THEN l.id END) as prestamos_activos,
+                    COUNT(DISTINCT CASE WHEN l.returned_at IS NULL AND l.due_date < CURRENT_DATE THEN l.id END) as prestamos_vencidos,
+                    COUNT(DISTINCT e.id) as total_eventos,
+                    COUNT(DISTINCT CASE WHEN e.ends_at > CURRENT_TIMESTAMP THEN e.id END) as eventos_futuros,
+                    COUNT(DISTINCT ea.id) as total_asistencias_eventos,
+                    ROUND(
+                        CASE
+                            WHEN COUNT(DISTINCT c.id) > 0
+                            THEN (COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / COUNT(DISTINCT c.id))
+                            ELSE 0
+                        END, 2
+                    ) as porcentaje_ocupacion,
+                    ROUND(
+                        CASE
+                            WHEN COUNT(DISTINCT e.id) > 0
+                            THEN (COUNT(DISTINCT ea.id) * 1.0 / COUNT(DISTINCT e.id))
+                            ELSE 0
+                        END, 2
+                    ) as promedio_asistencia_eventos,
+                    br.created_at,
+                    CASE
+                        WHEN COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / NULLIF(COUNT(DISTINCT c.id), 0) >= 80
+                        THEN 'Alta ocupación'
+                        WHEN COUNT(DISTINCT CASE WHEN c.is_available = false THEN c.id END) * 100.0 / NULLIF(COUNT(DISTINCT c.id), 0) >= 50
+                        THEN 'Ocupación media'
+                        WHEN COUNT(DISTINCT c.id) > 0
+                        THEN 'Baja ocupación'
+                        ELSE 'Sin actividad'
+                    END as nivel_actividad
+                FROM biblioteca_branch br
+                LEFT JOIN biblioteca_shelf s ON br.id = s.branch_id
+                LEFT JOIN biblioteca_copy c ON s.id = c.shelf_id
+                LEFT JOIN biblioteca_loan l ON c.id = l.copy_id
+                LEFT JOIN biblioteca_event e ON br.id = e.branch_id
+                LEFT JOIN biblioteca_eventattendance ea ON e.id = ea.event_id
+                GROUP BY
+                    br.id, br.name, br.address, br.phone, br.created_at
+                ORDER BY br.name;
+            """,
+        ),
+    ]
@@ -0,0 +1,121 @@
+from django.db import migrations
+
+# (tabla, familias de reporte afectadas)
+TABLAS_NOTIFICADAS = [
+    ('biblioteca_copy', 'catalogo,sucursales'),
+    ('biblioteca_review', 'catalogo,prestamos'),
+    ('biblioteca_bookauthor', 'catalogo'),
+    ('biblioteca_bookgenre', 'catalogo'),
+    ('biblioteca_author', 'catalogo'),
+    ('biblioteca_genre', 'catalogo'),
+    ('biblioteca_fine', 'prestamos'),
+    ('biblioteca_reservation', 'prestamos'),
+    ('library_users', 'prestamos'),
+    ('biblioteca_event', 'sucursales'),
+    ('biblioteca_eventattendance', 'sucursales'),
+    ('biblioteca_branch', 'sucursales'),
+    ('biblioteca_shelf', 'sucursales'),
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0005_vistas_sin_fanout'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            -- Aviso a los procesos que escuchan (manage.py escuchar_reportes).
+            -- Postgres agrupa notificaciones idénticas dentro de una transacción.
+            CREATE OR REPLACE FUNCTION notify_reportes(p_familias TEXT)
+            RETURNS void AS $$
+                SELECT pg_notify('reportes_cambios', p_familias);
+            $$ LANGUAGE sql;
+
+            CREATE OR REPLACE FUNCTION trg_notify_reportes() RETURNS trigger AS $$
+            BEGIN
+                PERFORM notify_reportes(TG_ARGV[0]);
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Triggers existentes: además de su trabajo, notifican
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy SET is_available = FALSE WHERE id = NEW.copy_id;
+                ELSIF TG_OP = 'UPDATE' AND NEW.returned_at IS NOT NULL THEN
+                    UPDATE biblioteca_copy SET is_available = TRUE WHERE id = NEW.copy_id;
+                END IF;
+                PERFORM notify_reportes('prestamos,sucursales');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM biblioteca_fine WHERE loan_id = NEW.id)
+                THEN RETURN NEW;
+                END IF;
+                IF NEW.returned_at IS NOT NULL AND NEW.returned_at::date > NEW.due_date THEN
+                    INSERT INTO biblioteca_fine(loan_id, amount, created_at, paid)
+                    VALUES(NEW.id, calc_overdue_fine(NEW), NOW(), FALSE);
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_book_audit() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO biblioteca_auditlog(table_name, record_id, op, changed_at, change_user)
+                VALUES('books', COALESCE(NEW.isbn, OLD.isbn), TG_OP, NOW(), current_user);
+                PERFORM notify_reportes('catalogo');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+            """ + "".join(
+                f"""
+            CREATE TRIGGER trg_{tabla}_notify
+            AFTER INSERT OR UPDATE OR DELETE ON {tabla}
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_notify_reportes('{familias}');
+            """
+                for tabla, familias in TABLAS_NOTIFICADAS
+            ),
+            reverse_sql="".join(
+                f"""
+            DROP TRIGGER IF EXISTS trg_{tabla}_notify ON {tabla};
+            """
+                for tabla, _ in TABLAS_NOTIFICADAS
+            ) + """
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy SET is_available = FALSE WHERE id = NEW.copy_id;
+                ELSIF TG_OP = 'UPDATE' AND NEW.returned_at IS NOT NULL THEN
+                    UPDATE biblioteca_copy SET is_available = TRUE WHERE id = NEW.copy_id;
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM biblioteca_fine WHERE loan_id = NEW.id)
+                THEN RETURN NEW;
+                END IF;
+                IF NEW.returned_at IS NOT NULL AND NEW.returned_at::date > NEW.due_date THEN
+                    INSERT INTO biblioteca_fine(loan_id, amount, created_at, paid)
+                    VALUES(NEW.id, calc_overdue_fine(NEW), NOW(), FALSE);
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_book_audit() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO biblioteca_auditlog(table_name, record_id, op, changed_at, change_user)
+                VALUES('books', COALESCE(NEW.isbn, OLD.isbn), TG_OP, NOW(), current_user);
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            DROP FUNCTION IF EXISTS trg_notify_reportes();
+            DROP FUNCTION IF EXISTS notify_reportes(TEXT);
+            """,
+        ),
+    ]
@@ -0,0 +1,175 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0006_notificar_reportes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='BookSearch',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search', serialize=False, to='biblioteca.book')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='booksearch_vector_gin')],
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+            -- Documento: título (A), autores (B), géneros (C)
+            CREATE OR REPLACE FUNCTION book_search_document(p_isbn VARCHAR)
+            RETURNS tsvector AS $$
+                SELECT setweight(to_tsvector('simple', b.title), 'A')
+                    || setweight(to_tsvector('simple',
+                           COALESCE(a.first_name || ' ' || a.last_name, '')), 'B')
+                    || setweight(to_tsvector('simple', COALESCE((
+                           SELECT string_agg(oa.first_name || ' ' || oa.last_name, ' ')
+                           FROM biblioteca_bookauthor ba
+                           JOIN biblioteca_author oa ON oa.id = ba.author_id
+                           WHERE ba.book_id = b.isbn), '')), 'B')
+                    || setweight(to_tsvector('simple', COALESCE((
+                           SELECT string_agg(g.name, ' ')
+                           FROM biblioteca_bookgenre bg
+                           JOIN biblioteca_genre g ON g.id = bg.genre_id
+                           WHERE bg.book_id = b.isbn), '')), 'C')
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON a.id = b.main_author_id
+                WHERE b.isbn = p_isbn;
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION refresh_book_search(p_isbns VARCHAR[])
+            RETURNS void AS $$
+                INSERT INTO biblioteca_booksearch (book_id, search_vector)
+                SELECT b.isbn, book_search_document(b.isbn)
+                FROM biblioteca_book b
+                WHERE b.isbn = ANY(p_isbns)
+                ON CONFLICT (book_id) DO UPDATE SET search_vector = EXCLUDED.search_vector;
+            $$ LANGUAGE sql;
+
+            -- Trigger (por sentencia): recalcula los libros afectados
+            CREATE OR REPLACE FUNCTION trg_book_search() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_book' THEN
+                    IF TG_OP = 'DELETE' THEN
+                        DELETE FROM biblioteca_booksearch s USING viejas v
+                        WHERE s.book_id = v.isbn;
+                        RETURN NULL;
+                    END IF;
+                    SELECT array_agg(isbn) INTO isbns FROM nuevas;
+                ELSIF TG_TABLE_NAME = 'biblioteca_author' THEN
+                    SELECT array_agg(DISTINCT isbn) INTO isbns FROM (
+                        SELECT b.isbn FROM biblioteca_book b JOIN nuevas n ON b.main_author_id = n.id
+                        UNION
+                        SELECT ba.book_id FROM biblioteca_bookauthor ba JOIN nuevas n ON ba.author_id = n.id
+                    ) t;
+                ELSIF TG_TABLE_NAME = 'biblioteca_genre' THEN
+                    SELECT array_agg(DISTINCT bg.book_id) INTO isbns
+                    FROM biblioteca_bookgenre bg JOIN nuevas n ON bg.genre_id = n.id;
+                ELSIF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM nuevas;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM viejas;
+                ELSE
+                    SELECT array_agg(DISTINCT book_id) INTO isbns
+                    FROM (SELECT book_id FROM nuevas UNION SELECT book_id FROM viejas) t;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_book_search(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_book_search_ins AFTER INSERT ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_upd AFTER UPDATE ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_del AFTER DELETE ON biblioteca_book
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            CREATE TRIGGER trg_book_search_bookauthor_ins AFTER INSERT ON biblioteca_bookauthor
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_bookauthor_upd AFTER UPDATE ON biblioteca_bookauthor
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_bookauthor_del AFTER DELETE ON biblioteca_bookauthor
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            CREATE TRIGGER trg_book_search_bookgenre_ins AFTER INSERT ON biblioteca_bookgenre
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_bookgenre_upd AFTER UPDATE ON biblioteca_bookgenre
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_bookgenre_del AFTER DELETE ON biblioteca_bookgenre
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            CREATE TRIGGER trg_book_search_author_upd AFTER UPDATE ON biblioteca_author
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+            CREATE TRIGGER trg_book_search_genre_upd AFTER UPDATE ON biblioteca_genre
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            -- Carga inicial
+            SELECT refresh_book_search(array_agg(isbn)) FROM biblioteca_book;
+
+            -- Trigramas: `%` (similitud) y los `UPPER(col) LIKE` que genera icontains
+            CREATE INDEX book_title_trgm ON biblioteca_book
+                USING gin (title gin_trgm_ops);
+            CREATE INDEX book_title_upper_trgm ON biblioteca_book
+                USING gin (UPPER(title::text) gin_trgm_ops);
+            CREATE INDEX mv_catalogo_title_trgm ON mv_catalogo_libros
+                USING gin (title gin_trgm_ops);
+            CREATE INDEX mv_catalogo_title_upper_trgm ON mv_catalogo_libros
+                USING gin (UPPER(title::text) gin_trgm_ops);
+            CREATE INDEX mv_catalogo_autor_trgm ON mv_catalogo_libros
+                USING gin (autor_principal gin_trgm_ops);
+            CREATE INDEX mv_catalogo_autor_upper_trgm ON mv_catalogo_libros
+                USING gin (UPPER(autor_principal::text) gin_trgm_ops);
+            CREATE INDEX mv_catalogo_generos_upper_trgm ON mv_catalogo_libros
+                USING gin (UPPER(generos::text) gin_trgm_ops);
+            CREATE INDEX mv_catalogo_isbn_like ON mv_catalogo_libros
+                (isbn varchar_pattern_ops);
+            """,
+            reverse_sql="""
+            DROP INDEX IF EXISTS mv_catalogo_isbn_like;
+            DROP INDEX IF EXISTS mv_catalogo_generos_upper_trgm;
+            DROP INDEX IF EXISTS mv_catalogo_autor_upper_trgm;
+            DROP INDEX IF EXISTS mv_catalogo_autor_trgm;
+            DROP INDEX IF EXISTS mv_catalogo_title_upper_trgm;
+            DROP INDEX IF EXISTS mv_catalogo_title_trgm;
+            DROP INDEX IF EXISTS book_title_upper_trgm;
+            DROP INDEX IF EXISTS book_title_trgm;
+            DROP TRIGGER IF EXISTS trg_book_search_genre_upd ON biblioteca_genre;
+            DROP TRIGGER IF EXISTS trg_book_search_author_upd ON biblioteca_author;
+            DROP TRIGGER IF EXISTS trg_book_search_bookgenre_del ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_book_search_bookgenre_upd ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_book_search_bookgenre_ins ON biblioteca_bookgenre;
+            DROP TRIGGER IF EXISTS trg_book_search_bookauthor_del ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_book_search_bookauthor_upd ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_book_search_bookauthor_ins ON biblioteca_bookauthor;
+            DROP TRIGGER IF EXISTS trg_book_search_del ON biblioteca_book;
+            DROP TRIGGER IF EXISTS trg_book_search_upd ON biblioteca_book;
+            DROP TRIGGER IF EXISTS trg_book_search_ins ON biblioteca_book;
+            DROP FUNCTION IF EXISTS trg_book_search();
+            DROP FUNCTION IF EXISTS refresh_book_search(VARCHAR[]);
+            DROP FUNCTION IF EXISTS book_search_document(VARCHAR);
+            """,
+        ),
+    ]
@@ -0,0 +1,361 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0007_busqueda_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""
+            -- Carga inicial
+            UPDATE biblioteca_book b
+            SET total_copies = c.total, available_copies = c.disponibles
+            FROM (
+                SELECT book_id, COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE is_available) AS disponibles
+                FROM biblioteca_copy GROUP BY book_id
+            ) c
+            WHERE b.isbn = c.book_id;
+
+            -- Trigger (por sentencia): suma el saldo de cada libro afectado
+            CREATE OR REPLACE FUNCTION trg_copy_contadores() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_book b
+                    SET total_copies = b.total_copies + d.total,
+                        available_copies = b.available_copies + d.disponibles
+                    FROM (
+                        SELECT book_id, COUNT(*) AS total,
+                               COUNT(*) FILTER (WHERE is_available) AS disponibles
+                        FROM nuevas GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id;
+                ELSIF TG_OP = 'DELETE' THEN
+                    UPDATE biblioteca_book b
+                    SET total_copies = b.total_copies - d.total,
+                        available_copies = b.available_copies - d.disponibles
+                    FROM (
+                        SELECT book_id, COUNT(*) AS total,
+                               COUNT(*) FILTER (WHERE is_available) AS disponibles
+                        FROM viejas GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id;
+                ELSE
+                    UPDATE biblioteca_book b
+                    SET total_copies = b.total_copies + d.total,
+                        available_copies = b.available_copies + d.disponibles
+                    FROM (
+                        SELECT book_id, SUM(total) AS total, SUM(disponibles) AS disponibles
+                        FROM (
+                            SELECT book_id, 1 AS total, is_available::int AS disponibles
+                            FROM nuevas
+                            UNION ALL
+                            SELECT book_id, -1, -(is_available::int) FROM viejas
+                        ) t
+                        GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id AND (d.total <> 0 OR d.disponibles <> 0);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_copy_contadores_ins AFTER INSERT ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_copy_contadores();
+            CREATE TRIGGER trg_copy_contadores_upd AFTER UPDATE ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_copy_contadores();
+            CREATE TRIGGER trg_copy_contadores_del AFTER DELETE ON biblioteca_copy
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_copy_contadores();
+
+            -- Los contadores solo los cambian los triggers (o reparar_contadores):
+            -- un UPDATE del formulario con valores viejos no los pisa.
+            CREATE OR REPLACE FUNCTION trg_book_contadores_guard() RETURNS trigger AS $$
+            BEGIN
+                IF pg_trigger_depth() = 1
+                   AND current_setting('biblioteca.reparar_contadores', true)
+                       IS DISTINCT FROM 'on' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        NEW.total_copies := 0;
+                        NEW.available_copies := 0;
+                    ELSE
+                        NEW.total_copies := OLD.total_copies;
+                        NEW.available_copies := OLD.available_copies;
+                    END IF;
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_book_contadores_guard
+            BEFORE INSERT OR UPDATE ON biblioteca_book
+            FOR EACH ROW EXECUTE FUNCTION trg_book_contadores_guard();
+
+            -- Préstamos: solo se tocan las copias cuyo estado cambia de verdad
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy SET is_available = FALSE
+                    WHERE id = NEW.copy_id AND is_available;
+                ELSIF TG_OP = 'UPDATE' AND NEW.returned_at IS NOT NULL THEN
+                    UPDATE biblioteca_copy SET is_available = TRUE
+                    WHERE id = NEW.copy_id AND NOT is_available;
+                END IF;
+                PERFORM notify_reportes('prestamos,sucursales');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Auditoría: un cambio solo de contadores no es una edición del libro
+            CREATE OR REPLACE FUNCTION trg_book_audit() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'UPDATE'
+                   AND (NEW.total_copies, NEW.available_copies)
+                       IS DISTINCT FROM (OLD.total_copies, OLD.available_copies)
+                   AND to_jsonb(NEW) - 'total_copies' - 'available_copies'
+                     = to_jsonb(OLD) - 'total_copies' - 'available_copies' THEN
+                    RETURN NEW;
+                END IF;
+                INSERT INTO biblioteca_auditlog(table_name, record_id, op, changed_at, change_user)
+                VALUES('books', COALESCE(NEW.isbn, OLD.isbn), TG_OP, NOW(), current_user);
+                PERFORM notify_reportes('catalogo');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Búsqueda: en UPDATE del libro solo cuentan título y autor
+            CREATE OR REPLACE FUNCTION trg_book_search() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_book' THEN
+                    IF TG_OP = 'DELETE' THEN
+                        DELETE FROM biblioteca_booksearch s USING viejas v
+                        WHERE s.book_id = v.isbn;
+                        RETURN NULL;
+                    END IF;
+                    IF TG_OP = 'INSERT' THEN
+                        SELECT array_agg(isbn) INTO isbns FROM nuevas;
+                    ELSE
+                        SELECT array_agg(n.isbn) INTO isbns
+                        FROM nuevas n LEFT JOIN viejas v ON v.isbn = n.isbn
+                        WHERE (n.title, n.main_author_id)
+                              IS DISTINCT FROM (v.title, v.main_author_id);
+                    END IF;
+                ELSIF TG_TABLE_NAME = 'biblioteca_author' THEN
+                    SELECT array_agg(DISTINCT isbn) INTO isbns FROM (
+                        SELECT b.isbn FROM biblioteca_book b JOIN nuevas n ON b.main_author_id = n.id
+                        UNION
+                        SELECT ba.book_id FROM biblioteca_bookauthor ba JOIN nuevas n ON ba.author_id = n.id
+                    ) t;
+                ELSIF TG_TABLE_NAME = 'biblioteca_genre' THEN
+                    SELECT array_agg(DISTINCT bg.book_id) INTO isbns
+                    FROM biblioteca_bookgenre bg JOIN nuevas n ON bg.genre_id = n.id;
+                ELSIF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM nuevas;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM viejas;
+                ELSE
+                    SELECT array_agg(DISTINCT book_id) INTO isbns
+                    FROM (SELECT book_id FROM nuevas UNION SELECT book_id FROM viejas) t;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_book_search(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            DROP TRIGGER trg_book_search_upd ON biblioteca_book;
+            CREATE TRIGGER trg_book_search_upd AFTER UPDATE ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            CREATE OR REPLACE FUNCTION copy_available_count(p_book_id VARCHAR)
+            RETURNS INT AS $$
+                SELECT available_copies FROM biblioteca_book WHERE isbn = p_book_id;
+            $$ LANGUAGE sql STABLE;
+            """,
+            reverse_sql="""
+            CREATE OR REPLACE FUNCTION copy_available_count(p_book_id VARCHAR)
+            RETURNS INT AS $$
+                SELECT COUNT(*) FROM biblioteca_copy c
+                WHERE c.book_id = p_book_id AND c.is_available;
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION trg_book_search() RETURNS trigger AS $$
+            DECLARE
+                isbns VARCHAR[];
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_book' THEN
+                    IF TG_OP = 'DELETE' THEN
+                        DELETE FROM biblioteca_booksearch s USING viejas v
+                        WHERE s.book_id = v.isbn;
+                        RETURN NULL;
+                    END IF;
+                    SELECT array_agg(isbn) INTO isbns FROM nuevas;
+                ELSIF TG_TABLE_NAME = 'biblioteca_author' THEN
+                    SELECT array_agg(DISTINCT isbn) INTO isbns FROM (
+                        SELECT b.isbn FROM biblioteca_book b JOIN nuevas n ON b.main_author_id = n.id
+                        UNION
+                        SELECT ba.book_id FROM biblioteca_bookauthor ba JOIN nuevas n ON ba.author_id = n.id
+                    ) t;
+                ELSIF TG_TABLE_NAME = 'biblioteca_genre' THEN
+                    SELECT array_agg(DISTINCT bg.book_id) INTO isbns
+                    FROM biblioteca_bookgenre bg JOIN nuevas n ON bg.genre_id = n.id;
+                ELSIF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM nuevas;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(DISTINCT book_id) INTO isbns FROM viejas;
+                ELSE
+                    SELECT array_agg(DISTINCT book_id) INTO isbns
+                    FROM (SELECT book_id FROM nuevas UNION SELECT book_id FROM viejas) t;
+                END IF;
+                IF isbns IS NOT NULL THEN
+                    PERFORM refresh_book_search(isbns);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_book_search_upd ON biblioteca_book;
+            CREATE TRIGGER trg_book_search_upd AFTER UPDATE ON biblioteca_book
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_book_search();
+
+            CREATE OR REPLACE FUNCTION trg_book_audit() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO biblioteca_auditlog(table_name, record_id, op, changed_at, change_user)
+                VALUES('books', COALESCE(NEW.isbn, OLD.isbn), TG_OP, NOW(), current_user);
+                PERFORM notify_reportes('catalogo');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy SET is_available = FALSE WHERE id = NEW.copy_id;
+                ELSIF TG_OP = 'UPDATE' AND NEW.returned_at IS NOT NULL THEN
+                    UPDATE biblioteca_copy SET is_available = TRUE WHERE id = NEW.copy_id;
+                END IF;
+                PERFORM notify_reportes('prestamos,sucursales');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_book_contadores_guard ON biblioteca_book;
+            DROP FUNCTION IF EXISTS trg_book_contadores_guard();
+            DROP TRIGGER IF EXISTS trg_copy_contadores_del ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_copy_contadores_upd ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_copy_contadores_ins ON biblioteca_copy;
+            DROP FUNCTION IF EXISTS trg_copy_contadores();
+            """,
+        ),
+        # El catálogo lee los contadores en lugar de unir biblioteca_copy. Las
+        # copias llegan a mv_catalogo_libros a través del UPDATE del libro.
+        migrations.RunSQL(
+            sql="""
+CREATE OR REPLACE VIEW vista_catalogo_libros AS
+                SELECT
+                    b.isbn,
+                    b.title,
+                    CONCAT(a.first_name, ' ', a.last_name) as autor_principal,
+                    b.published_year,
+                    b.condition,
+                    b.page_count,
+                    STRING_AGG(DISTINCT g.name, ', ') as generos,
+                    STRING_AGG(DISTINCT CONCAT(oa.first_name, ' ', oa.last_name), ', ') as otros_autores,
+                    b.total_copies::bigint as total_copias,
+                    b.available_copies::bigint as copias_disponibles,
+                    COUNT(DISTINCT r.id) as total_reviews,
+                    ROUND(AVG(
+                        CASE r.rating
+                            WHEN 'poor' THEN 1
+                            WHEN 'average' THEN 2
+                            WHEN 'good' THEN 3
+                            WHEN 'excellent' THEN 4
+                        END
+                    ), 2) as rating_promedio,
+                    b.created_at,
+                    CASE
+                        WHEN b.available_copies > 0
+                        THEN 'Disponible'
+                        ELSE 'No disponible'
+                    END as estado_disponibilidad
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON b.main_author_id = a.id
+                LEFT JOIN biblioteca_bookauthor ba ON b.isbn = ba.book_id
+                LEFT JOIN biblioteca_author oa ON ba.author_id = oa.id AND oa.id != b.main_author_id
+                LEFT JOIN biblioteca_bookgenre bg ON b.isbn = bg.book_id
+                LEFT JOIN biblioteca_genre g ON bg.genre_id = g.id
+                LEFT JOIN biblioteca_review r ON b.isbn = r.book_id
+                GROUP BY
+                    b.isbn, b.title, a.first_name, a.last_name,
+                    b.published_year, b.condition, b.page_count, b.created_at,
+                    b.total_copies, b.available_copies
+                ORDER BY b.title;
+
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_del ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_upd ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_catalogo_copy_ins ON biblioteca_copy;
+            """,
+            reverse_sql="""
+            CREATE TRIGGER trg_catalogo_copy_ins AFTER INSERT ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_copy_upd AFTER UPDATE ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_copy_del AFTER DELETE ON biblioteca_copy
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+
+CREATE OR REPLACE VIEW vista_catalogo_libros AS
+                SELECT
+                    b.isbn,
+                    b.title,
+                    CONCAT(a.first_name, ' ', a.last_name) as autor_principal,
+                    b.published_year,
+                    b.condition,
+                    b.page_count,
+                    STRING_AGG(DISTINCT g.name, ', ') as generos,
+                    STRING_AGG(DISTINCT CONCAT(oa.first_name, ' ', oa.last_name), ', ') as otros_autores,
+                    COUNT(DISTINCT c.id) as total_copias,
+                    COUNT(DISTINCT CASE WHEN c.is_available = true THEN c.id END) as copias_disponibles,
+                    COUNT(DISTINCT r.id) as total_reviews,
+                    ROUND(AVG(
+                        CASE r.rating
+                            WHEN 'poor' THEN 1
+                            WHEN 'average' THEN 2
+                            WHEN 'good' THEN 3
+                            WHEN 'excellent' THEN 4
+                        END
+                    ), 2) as rating_promedio,
+                    b.created_at,
+                    CASE
+                        WHEN COUNT(DISTINCT CASE WHEN c.is_available = true THEN c.id END) > 0
+                        THEN 'Disponible'
+                        ELSE 'No disponible'
+                    END as estado_disponibilidad
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON b.main_author_id = a.id
+                LEFT JOIN biblioteca_bookauthor ba ON b.isbn = ba.book_id
+                LEFT JOIN biblioteca_author oa ON ba.author_id = oa.id AND oa.id != b.main_author_id
+                LEFT JOIN biblioteca_bookgenre bg ON b.isbn = bg.book_id
+                LEFT JOIN biblioteca_genre g ON bg.genre_id = g.id
+                LEFT JOIN biblioteca_copy c ON b.isbn = c.book_id
+                LEFT JOIN biblioteca_review r ON b.isbn = r.book_id
+                GROUP BY
+                    b.isbn, b.title, a.first_name, a.last_name,
+                    b.published_year, b.condition, b.page_count, b.created_at
+                ORDER BY b.title;
+            """,
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0008_contadores_copias'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(
+                condition=models.Q(('is_available', True)),
+                fields=['book', 'id'],
+                name='copy_disponible_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,108 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0009_copia_disponible_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            DROP TRIGGER IF EXISTS trg_loan_copy ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_fine_after_return ON biblioteca_loan;
+
+            -- Disponibilidad (por sentencia): un UPDATE de copias por préstamo masivo
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy c SET is_available = FALSE
+                    FROM (SELECT DISTINCT copy_id FROM nuevas) p
+                    WHERE c.id = p.copy_id AND c.is_available;
+                ELSE
+                    -- Solo préstamos que pasan de abiertos a devueltos
+                    UPDATE biblioteca_copy c SET is_available = TRUE
+                    FROM (
+                        SELECT DISTINCT nu.copy_id
+                        FROM nuevas nu JOIN viejas v ON v.id = nu.id
+                        WHERE v.returned_at IS NULL AND nu.returned_at IS NOT NULL
+                    ) d
+                    WHERE c.id = d.copy_id AND NOT c.is_available;
+                END IF;
+                IF EXISTS (SELECT 1 FROM nuevas) THEN
+                    PERFORM notify_reportes('prestamos,sucursales');
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Multas (por sentencia): un INSERT por devolución masiva
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            DECLARE
+                n INT;
+            BEGIN
+                INSERT INTO biblioteca_fine(loan_id, amount, created_at, paid)
+                SELECT nu.id, calc_overdue_fine(nu), NOW(), FALSE
+                FROM nuevas nu JOIN viejas v ON v.id = nu.id
+                WHERE v.returned_at IS NULL
+                  AND nu.returned_at IS NOT NULL
+                  AND nu.returned_at::date > nu.due_date
+                ON CONFLICT (loan_id) DO NOTHING;
+                GET DIAGNOSTICS n = ROW_COUNT;
+                IF n > 0 THEN
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_loan_copy_ins AFTER INSERT ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_update_copy_available();
+            CREATE TRIGGER trg_loan_copy_upd AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_update_copy_available();
+            CREATE TRIGGER trg_fine_after_return AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_generate_fine();
+            """,
+            reverse_sql="""
+            DROP TRIGGER IF EXISTS trg_fine_after_return ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_copy_upd ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_copy_ins ON biblioteca_loan;
+
+            CREATE OR REPLACE FUNCTION trg_update_copy_available() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_copy SET is_available = FALSE
+                    WHERE id = NEW.copy_id AND is_available;
+                ELSIF TG_OP = 'UPDATE' AND NEW.returned_at IS NOT NULL THEN
+                    UPDATE biblioteca_copy SET is_available = TRUE
+                    WHERE id = NEW.copy_id AND NOT is_available;
+                END IF;
+                PERFORM notify_reportes('prestamos,sucursales');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM biblioteca_fine WHERE loan_id = NEW.id)
+                THEN RETURN NEW;
+                END IF;
+                IF NEW.returned_at IS NOT NULL AND NEW.returned_at::date > NEW.due_date THEN
+                    INSERT INTO biblioteca_fine(loan_id, amount, created_at, paid)
+                    VALUES(NEW.id, calc_overdue_fine(NEW), NOW(), FALSE);
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_loan_copy
+            AFTER INSERT OR UPDATE ON biblioteca_loan
+            FOR EACH ROW EXECUTE FUNCTION trg_update_copy_available();
+
+            CREATE TRIGGER trg_fine_after_return
+            AFTER UPDATE OF returned_at ON biblioteca_loan
+            FOR EACH ROW WHEN (OLD.returned_at IS NULL AND NEW.returned_at IS NOT NULL)
+            EXECUTE FUNCTION trg_generate_fine();
+            """,
+        ),
+    ]
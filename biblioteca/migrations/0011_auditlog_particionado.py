@@ -0,0 +1,125 @@
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0010_triggers_prestamo_por_sentencia'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='auditlog',
+                    index=django.contrib.postgres.indexes.BrinIndex(
+                        fields=['changed_at'], name='auditlog_changed_brin'),
+                ),
+                migrations.AddIndex(
+                    model_name='auditlog',
+                    index=models.Index(
+                        fields=['table_name', 'record_id'], name='auditlog_registro_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    sql="""
+            -- La tabla actual pasa a ser temporal; su identidad se sustituye
+            -- por una secuencia propia de la tabla particionada.
+            ALTER TABLE biblioteca_auditlog RENAME TO biblioteca_auditlog_sin_particion;
+            ALTER TABLE biblioteca_auditlog_sin_particion ALTER COLUMN id DROP IDENTITY;
+            ALTER TABLE biblioteca_auditlog_sin_particion
+                RENAME CONSTRAINT biblioteca_auditlog_pkey TO biblioteca_auditlog_sin_particion_pkey;
+
+            CREATE SEQUENCE biblioteca_auditlog_id_seq;
+            -- La clave primaria debe incluir la clave de partición
+            CREATE TABLE biblioteca_auditlog (
+                id BIGINT NOT NULL DEFAULT nextval('biblioteca_auditlog_id_seq'),
+                table_name VARCHAR(60) NOT NULL,
+                record_id VARCHAR(50) NOT NULL,
+                op VARCHAR(8) NOT NULL,
+                changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                change_user VARCHAR(150) NOT NULL,
+                PRIMARY KEY (id, changed_at)
+            ) PARTITION BY RANGE (changed_at);
+            ALTER SEQUENCE biblioteca_auditlog_id_seq OWNED BY biblioteca_auditlog.id;
+
+            -- Red de seguridad si todavía no existe la partición del mes
+            CREATE TABLE biblioteca_auditlog_default
+                PARTITION OF biblioteca_auditlog DEFAULT;
+
+            CREATE INDEX auditlog_changed_brin ON biblioteca_auditlog USING brin (changed_at);
+            CREATE INDEX auditlog_registro_idx ON biblioteca_auditlog (table_name, record_id);
+
+            -- Partición mensual biblioteca_auditlog_pAAAAMM (meses en UTC). Si
+            -- la partición por defecto ya recibió filas de ese mes, se mueven.
+            CREATE OR REPLACE FUNCTION auditlog_crear_particion(p_mes DATE)
+            RETURNS TEXT AS $$
+            DECLARE
+                desde TIMESTAMPTZ := date_trunc('month', p_mes)::timestamp AT TIME ZONE 'UTC';
+                hasta TIMESTAMPTZ := (date_trunc('month', p_mes) + INTERVAL '1 month')::timestamp
+                                     AT TIME ZONE 'UTC';
+                nombre TEXT := 'biblioteca_auditlog_p' || to_char(p_mes, 'YYYYMM');
+            BEGIN
+                IF to_regclass(nombre) IS NOT NULL THEN
+                    RETURN nombre;
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE biblioteca_auditlog INCLUDING DEFAULTS)', nombre);
+                EXECUTE format(
+                    'WITH m AS (DELETE FROM biblioteca_auditlog_default
+                                WHERE changed_at >= $1 AND changed_at < $2 RETURNING *)
+                     INSERT INTO %I SELECT * FROM m', nombre)
+                USING desde, hasta;
+                EXECUTE format(
+                    'ALTER TABLE biblioteca_auditlog ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    nombre, desde, hasta);
+                RETURN nombre;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Mes actual y los `p_meses` siguientes
+            CREATE OR REPLACE FUNCTION auditlog_asegurar_particiones(p_meses INT DEFAULT 3)
+            RETURNS SETOF TEXT AS $$
+                SELECT auditlog_crear_particion(
+                    ((NOW() AT TIME ZONE 'UTC')::date + make_interval(months => i))::date)
+                FROM generate_series(0, p_meses) i;
+            $$ LANGUAGE sql;
+
+            SELECT auditlog_crear_particion(m::date) FROM (
+                SELECT DISTINCT date_trunc('month', changed_at AT TIME ZONE 'UTC') AS m
+                FROM biblioteca_auditlog_sin_particion
+            ) t;
+            SELECT auditlog_asegurar_particiones(3);
+
+            INSERT INTO biblioteca_auditlog SELECT * FROM biblioteca_auditlog_sin_particion;
+            SELECT setval('biblioteca_auditlog_id_seq',
+                          COALESCE((SELECT MAX(id) FROM biblioteca_auditlog_sin_particion), 0) + 1,
+                          false);
+            DROP TABLE biblioteca_auditlog_sin_particion;
+            """,
+                    reverse_sql="""
+            CREATE TABLE biblioteca_auditlog_sin_particion (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                table_name VARCHAR(60) NOT NULL,
+                record_id VARCHAR(50) NOT NULL,
+                op VARCHAR(8) NOT NULL,
+                changed_at TIMESTAMPTZ NOT NULL,
+                change_user VARCHAR(150) NOT NULL
+            );
+            INSERT INTO biblioteca_auditlog_sin_particion
+                OVERRIDING SYSTEM VALUE SELECT * FROM biblioteca_auditlog;
+            SELECT setval(pg_get_serial_sequence('biblioteca_auditlog_sin_particion', 'id'),
+                          COALESCE((SELECT MAX(id) FROM biblioteca_auditlog), 0) + 1, false);
+            DROP TABLE biblioteca_auditlog;
+            DROP FUNCTION IF EXISTS auditlog_asegurar_particiones(INT);
+            DROP FUNCTION IF EXISTS auditlog_crear_particion(DATE);
+            ALTER TABLE biblioteca_auditlog_sin_particion RENAME TO biblioteca_auditlog;
+            ALTER TABLE biblioteca_auditlog
+                RENAME CONSTRAINT biblioteca_auditlog_sin_particion_pkey TO biblioteca_auditlog_pkey;
+            ALTER SEQUENCE biblioteca_auditlog_sin_particion_id_seq
+                RENAME TO biblioteca_auditlog_id_seq;
+            """,
+                ),
+            ],
+        ),
+    ]
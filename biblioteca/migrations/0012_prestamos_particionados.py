@@ -0,0 +1,247 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Vistas de reporte que leen préstamos: las actuales leen solo
+# biblioteca_loan; las `_historico` leen también el archivo.
+VISTAS_PRESTAMOS = ['vista_prestamos_usuarios', 'vista_actividad_sucursales']
+
+CALC_OVERDUE_FINE = """
+            CREATE OR REPLACE FUNCTION calc_overdue_fine(p_loan biblioteca_loan)
+            RETURNS numeric AS $$
+            DECLARE
+            overdue_days integer := GREATEST((CURRENT_DATE - p_loan.due_date), 0);
+            BEGIN
+            RETURN overdue_days * 0.50;
+            END;
+            $$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+TRIGGERS_PRESTAMO = """
+            CREATE TRIGGER trg_loan_copy_ins AFTER INSERT ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_update_copy_available();
+            CREATE TRIGGER trg_loan_copy_upd AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_update_copy_available();
+            CREATE TRIGGER trg_fine_after_return AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_generate_fine();
+"""
+
+
+def repuntar_vistas(desde, hasta):
+    """Redefine las vistas de préstamos cambiando la tabla de la que leen."""
+    return "".join(f"""
+            DO $$ BEGIN
+                EXECUTE 'CREATE OR REPLACE VIEW {vista} AS ' || regexp_replace(
+                    pg_get_viewdef('{vista}'::regclass), '\\m{desde}\\M', '{hasta}', 'g');
+            END $$;
+            """ for vista in VISTAS_PRESTAMOS)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0011_auditlog_particionado'),
+    ]
+
+    operations = [
+        # Una FK no puede apuntar a `id` de una tabla particionada (la clave
+        # única debe incluir `loaned_at`): la integridad pasa a triggers.
+        migrations.AlterField(
+            model_name='fine',
+            name='loan',
+            field=models.OneToOneField(
+                db_constraint=False, on_delete=django.db.models.deletion.CASCADE,
+                to='biblioteca.loan'),
+        ),
+        migrations.RunSQL(
+            sql="""
+            ALTER TABLE biblioteca_loan RENAME TO biblioteca_loan_sin_particion;
+            ALTER TABLE biblioteca_loan_sin_particion ALTER COLUMN id DROP IDENTITY;
+            ALTER TABLE biblioteca_loan_sin_particion
+                RENAME CONSTRAINT biblioteca_loan_pkey TO biblioteca_loan_sin_particion_pkey;
+            ALTER INDEX biblioteca_loan_copy_id_e570a473 RENAME TO biblioteca_loan_sin_particion_copy;
+            ALTER INDEX biblioteca_loan_user_id_4297a7d6 RENAME TO biblioteca_loan_sin_particion_user;
+            DROP FUNCTION calc_overdue_fine(biblioteca_loan_sin_particion);
+
+            CREATE SEQUENCE biblioteca_loan_id_seq;
+            CREATE TABLE biblioteca_loan (
+                id BIGINT NOT NULL DEFAULT nextval('biblioteca_loan_id_seq'),
+                loaned_at TIMESTAMPTZ NOT NULL,
+                due_date DATE NOT NULL,
+                returned_at TIMESTAMPTZ,
+                copy_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                CONSTRAINT ck_due_after_loan CHECK (due_date > loaned_at),
+                CONSTRAINT biblioteca_loan_copy_id_e570a473_fk_biblioteca_copy_id
+                    FOREIGN KEY (copy_id) REFERENCES biblioteca_copy(id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT biblioteca_loan_user_id_4297a7d6_fk_library_users_id
+                    FOREIGN KEY (user_id) REFERENCES library_users(id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                PRIMARY KEY (id, loaned_at)
+            ) PARTITION BY RANGE (loaned_at);
+            ALTER SEQUENCE biblioteca_loan_id_seq OWNED BY biblioteca_loan.id;
+
+            CREATE TABLE biblioteca_loan_default PARTITION OF biblioteca_loan DEFAULT;
+
+            CREATE INDEX biblioteca_loan_copy_id_e570a473 ON biblioteca_loan (copy_id);
+            CREATE INDEX biblioteca_loan_user_id_4297a7d6 ON biblioteca_loan (user_id);
+            -- Préstamos abiertos: índice diminuto en las particiones antiguas
+            CREATE INDEX loan_abiertos_user_idx ON biblioteca_loan (user_id)
+                WHERE returned_at IS NULL;
+
+            -- Partición anual biblioteca_loan_pAAAA (años en UTC). Si la
+            -- partición por defecto ya tiene filas de ese año, se mueven.
+            CREATE OR REPLACE FUNCTION prestamos_crear_particion(p_anio INT)
+            RETURNS TEXT AS $$
+            DECLARE
+                desde TIMESTAMPTZ := make_timestamptz(p_anio, 1, 1, 0, 0, 0, 'UTC');
+                hasta TIMESTAMPTZ := make_timestamptz(p_anio + 1, 1, 1, 0, 0, 0, 'UTC');
+                nombre TEXT := 'biblioteca_loan_p' || p_anio;
+            BEGIN
+                IF to_regclass(nombre) IS NOT NULL THEN
+                    RETURN nombre;
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE biblioteca_loan INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    nombre);
+                EXECUTE format(
+                    'WITH m AS (DELETE FROM biblioteca_loan_default
+                                WHERE loaned_at >= $1 AND loaned_at < $2 RETURNING *)
+                     INSERT INTO %I SELECT * FROM m', nombre)
+                USING desde, hasta;
+                EXECUTE format(
+                    'ALTER TABLE biblioteca_loan ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    nombre, desde, hasta);
+                RETURN nombre;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Año actual y los `p_anios` siguientes
+            CREATE OR REPLACE FUNCTION prestamos_asegurar_particiones(p_anios INT DEFAULT 1)
+            RETURNS SETOF TEXT AS $$
+                SELECT prestamos_crear_particion(
+                    extract(year FROM NOW() AT TIME ZONE 'UTC')::int + i)
+                FROM generate_series(0, p_anios) i;
+            $$ LANGUAGE sql;
+
+            -- Archivo frío: solo préstamos cerrados, sin huecos (fillfactor 100),
+            -- escrito en orden de `loaned_at` para que el BRIN sea preciso.
+            CREATE TABLE biblioteca_loan_archivo (
+                id BIGINT PRIMARY KEY,
+                loaned_at TIMESTAMPTZ NOT NULL,
+                due_date DATE NOT NULL,
+                returned_at TIMESTAMPTZ NOT NULL,
+                copy_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL
+            ) WITH (fillfactor = 100);
+            CREATE INDEX loan_archivo_loaned_brin ON biblioteca_loan_archivo
+                USING brin (loaned_at);
+            CREATE INDEX loan_archivo_user_idx ON biblioteca_loan_archivo (user_id);
+
+            CREATE VIEW biblioteca_loan_historial AS
+                SELECT id, loaned_at, due_date, returned_at, copy_id, user_id
+                FROM biblioteca_loan
+                UNION ALL
+                SELECT id, loaned_at, due_date, returned_at, copy_id, user_id
+                FROM biblioteca_loan_archivo;
+
+            -- Integridad multa -> préstamo (activo o archivado), diferida como la FK
+            CREATE OR REPLACE FUNCTION prestamo_existe(p_id BIGINT) RETURNS boolean AS $$
+                SELECT EXISTS (SELECT 1 FROM biblioteca_loan WHERE id = p_id)
+                    OR EXISTS (SELECT 1 FROM biblioteca_loan_archivo WHERE id = p_id);
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION trg_fine_loan_fk() RETURNS trigger AS $$
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_fine' THEN
+                    IF NOT prestamo_existe(NEW.loan_id) THEN
+                        RAISE foreign_key_violation USING MESSAGE = format(
+                            'biblioteca_fine.loan_id=%s no existe en biblioteca_loan', NEW.loan_id);
+                    END IF;
+                ELSIF EXISTS (SELECT 1 FROM biblioteca_fine WHERE loan_id = OLD.id)
+                      AND NOT prestamo_existe(OLD.id) THEN
+                    RAISE foreign_key_violation USING MESSAGE = format(
+                        'el préstamo %s todavía tiene multas', OLD.id);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE CONSTRAINT TRIGGER trg_fine_loan_fk
+            AFTER INSERT OR UPDATE OF loan_id ON biblioteca_fine
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION trg_fine_loan_fk();
+            CREATE CONSTRAINT TRIGGER trg_loan_fine_fk
+            AFTER DELETE ON biblioteca_loan
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION trg_fine_loan_fk();
+            CREATE CONSTRAINT TRIGGER trg_loan_archivo_fine_fk
+            AFTER DELETE ON biblioteca_loan_archivo
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION trg_fine_loan_fk();
+            """ + CALC_OVERDUE_FINE + repuntar_vistas('biblioteca_loan_sin_particion', 'biblioteca_loan') + "".join(f"""
+            DO $$ BEGIN
+                EXECUTE 'CREATE VIEW {vista}_historico AS ' || regexp_replace(
+                    pg_get_viewdef('{vista}'::regclass),
+                    '\\mbiblioteca_loan\\M', 'biblioteca_loan_historial', 'g');
+            END $$;
+            """ for vista in VISTAS_PRESTAMOS) + """
+            -- Datos existentes
+            SELECT prestamos_crear_particion(a) FROM (
+                SELECT DISTINCT extract(year FROM loaned_at AT TIME ZONE 'UTC')::int AS a
+                FROM biblioteca_loan_sin_particion
+            ) t;
+            SELECT prestamos_asegurar_particiones(1);
+            INSERT INTO biblioteca_loan SELECT * FROM biblioteca_loan_sin_particion;
+            -- Comprobar ya las FK diferidas: con eventos pendientes no se puede
+            -- alterar la tabla
+            SET CONSTRAINTS ALL IMMEDIATE;
+            SELECT setval('biblioteca_loan_id_seq',
+                          COALESCE((SELECT MAX(id) FROM biblioteca_loan_sin_particion), 0) + 1,
+                          false);
+            DROP TABLE biblioteca_loan_sin_particion;
+            """ + TRIGGERS_PRESTAMO,
+            reverse_sql="""
+            CREATE TABLE biblioteca_loan_sin_particion (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                loaned_at TIMESTAMPTZ NOT NULL,
+                due_date DATE NOT NULL,
+                returned_at TIMESTAMPTZ,
+                copy_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                CONSTRAINT ck_due_after_loan CHECK (due_date > loaned_at),
+                CONSTRAINT biblioteca_loan_copy_id_e570a473_fk_biblioteca_copy_id
+                    FOREIGN KEY (copy_id) REFERENCES biblioteca_copy(id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT biblioteca_loan_user_id_4297a7d6_fk_library_users_id
+                    FOREIGN KEY (user_id) REFERENCES library_users(id)
+                    DEFERRABLE INITIALLY DEFERRED
+            );
+            INSERT INTO biblioteca_loan_sin_particion OVERRIDING SYSTEM VALUE
+                SELECT * FROM biblioteca_loan_historial;
+            SET CONSTRAINTS ALL IMMEDIATE;
+            SELECT setval(pg_get_serial_sequence('biblioteca_loan_sin_particion', 'id'),
+                          COALESCE((SELECT MAX(id) FROM biblioteca_loan_sin_particion), 0) + 1,
+                          false);
+            """ + "".join(f"""
+            DROP VIEW IF EXISTS {vista}_historico;
+            """ for vista in VISTAS_PRESTAMOS) + repuntar_vistas('biblioteca_loan', 'biblioteca_loan_sin_particion') + """
+            DROP TRIGGER IF EXISTS trg_fine_loan_fk ON biblioteca_fine;
+            DROP FUNCTION IF EXISTS calc_overdue_fine(biblioteca_loan);
+            DROP VIEW IF EXISTS biblioteca_loan_historial;
+            DROP TABLE biblioteca_loan_archivo;
+            DROP TABLE biblioteca_loan;
+            DROP FUNCTION IF EXISTS trg_fine_loan_fk();
+            DROP FUNCTION IF EXISTS prestamo_existe(BIGINT);
+            DROP FUNCTION IF EXISTS prestamos_asegurar_particiones(INT);
+            DROP FUNCTION IF EXISTS prestamos_crear_particion(INT);
+
+            ALTER TABLE biblioteca_loan_sin_particion RENAME TO biblioteca_loan;
+            ALTER TABLE biblioteca_loan
+                RENAME CONSTRAINT biblioteca_loan_sin_particion_pkey TO biblioteca_loan_pkey;
+            ALTER SEQUENCE biblioteca_loan_sin_particion_id_seq RENAME TO biblioteca_loan_id_seq;
+            CREATE INDEX biblioteca_loan_copy_id_e570a473 ON biblioteca_loan (copy_id);
+            CREATE INDEX biblioteca_loan_user_id_4297a7d6 ON biblioteca_loan (user_id);
+            """ + CALC_OVERDUE_FINE + TRIGGERS_PRESTAMO,
+        ),
+    ]
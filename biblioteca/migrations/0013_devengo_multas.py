@@ -0,0 +1,125 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0012_prestamos_particionados'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            -- Tarifa diaria configurable sin tocar código:
+            --   ALTER DATABASE proyecto4 SET biblioteca.multa_diaria = '0.75';
+            CREATE OR REPLACE FUNCTION multa_diaria() RETURNS numeric AS $$
+                SELECT COALESCE(
+                    NULLIF(current_setting('biblioteca.multa_diaria', true), '')::numeric,
+                    0.50);
+            $$ LANGUAGE sql STABLE;
+
+            -- Multa de un préstamo que vence `p_due` contada hasta `p_hasta`.
+            -- STABLE (no IMMUTABLE): depende de la tarifa configurada.
+            CREATE OR REPLACE FUNCTION calc_overdue_fine(p_due DATE, p_hasta DATE)
+            RETURNS numeric AS $$
+                SELECT GREATEST(p_hasta - p_due, 0) * multa_diaria();
+            $$ LANGUAGE sql STABLE;
+
+            -- Hasta la devolución o, si sigue abierto, hasta hoy
+            CREATE OR REPLACE FUNCTION calc_overdue_fine(p_loan biblioteca_loan)
+            RETURNS numeric AS $$
+                SELECT calc_overdue_fine(
+                    p_loan.due_date, COALESCE(p_loan.returned_at::date, CURRENT_DATE));
+            $$ LANGUAGE sql STABLE;
+
+            -- Al devolver, la multa devengada (si la hay) pasa a su importe final
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            DECLARE
+                n INT;
+            BEGIN
+                INSERT INTO biblioteca_fine AS f (loan_id, amount, created_at, paid)
+                SELECT nu.id, calc_overdue_fine(nu.due_date, nu.returned_at::date), NOW(), FALSE
+                FROM nuevas nu JOIN viejas v ON v.id = nu.id
+                WHERE v.returned_at IS NULL
+                  AND nu.returned_at IS NOT NULL
+                  AND nu.returned_at::date > nu.due_date
+                ON CONFLICT (loan_id) DO UPDATE SET amount = EXCLUDED.amount
+                WHERE NOT f.paid AND f.amount IS DISTINCT FROM EXCLUDED.amount;
+                GET DIAGNOSTICS n = ROW_COUNT;
+                IF n > 0 THEN
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Recorrido por id de los préstamos abiertos sin tocar la tabla
+            CREATE INDEX loan_abiertos_id_idx ON biblioteca_loan (id)
+                INCLUDE (due_date) WHERE returned_at IS NULL;
+
+            -- Devengo de un lote: multas de hasta `p_lote` préstamos abiertos
+            -- vencidos a `p_fecha` con id > `p_desde`. Idempotente para una
+            -- misma fecha: solo escribe las multas cuyo importe cambia, y no
+            -- toca las ya pagadas. Devuelve el último id visto (NULL al
+            -- terminar), los préstamos examinados y las multas escritas.
+            CREATE OR REPLACE FUNCTION devengar_multas(
+                p_fecha DATE, p_desde BIGINT DEFAULT 0, p_lote INT DEFAULT 5000,
+                OUT hasta BIGINT, OUT examinados INT, OUT escritas INT
+            ) AS $$
+            BEGIN
+                WITH lote AS (
+                    SELECT l.id, l.due_date FROM biblioteca_loan l
+                    WHERE l.returned_at IS NULL AND l.id > p_desde
+                    ORDER BY l.id
+                    LIMIT p_lote
+                ), escritas AS (
+                    INSERT INTO biblioteca_fine AS f (loan_id, amount, created_at, paid)
+                    SELECT id, calc_overdue_fine(due_date, p_fecha), NOW(), FALSE
+                    FROM lote
+                    WHERE due_date < p_fecha
+                    ON CONFLICT (loan_id) DO UPDATE SET amount = EXCLUDED.amount
+                    WHERE NOT f.paid AND f.amount IS DISTINCT FROM EXCLUDED.amount
+                    RETURNING 1
+                )
+                SELECT MAX(id), COUNT(*), (SELECT COUNT(*) FROM escritas)
+                INTO hasta, examinados, escritas
+                FROM lote;
+                IF escritas > 0 THEN
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+            END;$$ LANGUAGE plpgsql;
+            """,
+            reverse_sql="""
+            DROP FUNCTION IF EXISTS devengar_multas(DATE, BIGINT, INT);
+            DROP INDEX IF EXISTS loan_abiertos_id_idx;
+
+            CREATE OR REPLACE FUNCTION trg_generate_fine() RETURNS trigger AS $$
+            DECLARE
+                n INT;
+            BEGIN
+                INSERT INTO biblioteca_fine(loan_id, amount, created_at, paid)
+                SELECT nu.id, calc_overdue_fine(nu), NOW(), FALSE
+                FROM nuevas nu JOIN viejas v ON v.id = nu.id
+                WHERE v.returned_at IS NULL
+                  AND nu.returned_at IS NOT NULL
+                  AND nu.returned_at::date > nu.due_date
+                ON CONFLICT (loan_id) DO NOTHING;
+                GET DIAGNOSTICS n = ROW_COUNT;
+                IF n > 0 THEN
+                    PERFORM notify_reportes('prestamos');
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION calc_overdue_fine(p_loan biblioteca_loan)
+            RETURNS numeric AS $$
+            DECLARE
+            overdue_days integer := GREATEST((CURRENT_DATE - p_loan.due_date), 0);
+            BEGIN
+            RETURN overdue_days * 0.50;
+            END;
+            $$ LANGUAGE plpgsql IMMUTABLE;
+
+            DROP FUNCTION IF EXISTS calc_overdue_fine(DATE, DATE);
+            DROP FUNCTION IF EXISTS multa_diaria();
+            """,
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0013_devengo_multas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('last_name'), name='text_pattern_ops'),
+                name='author_apellido_prefijo_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('first_name'), name='text_pattern_ops'),
+                name='author_nombre_prefijo_idx',
+            ),
+        ),
+    ]
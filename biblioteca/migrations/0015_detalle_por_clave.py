@@ -0,0 +1,225 @@
+from django.db import migrations
+
+# La fila de una vista de reporte para una sola clave, calculada solo con las
+# filas hijas de esa clave (por sus índices). Con `WHERE clave = X` sobre la
+# vista, el planificador no siempre lleva el filtro dentro de los GROUP BY:
+# las copias de una sucursal o las multas de un usuario se agregaban para
+# todas y después se filtraban.
+#
+# Devuelven el tipo de fila de la vista, así que sus columnas son las mismas;
+# `tests.py` comprueba que los valores también.
+
+REFRESH_CATALOGO = """
+            CREATE OR REPLACE FUNCTION refresh_catalogo_libros(p_isbns VARCHAR[])
+            RETURNS void AS $$
+            BEGIN
+                -- serializa refrescos concurrentes del mismo ISBN
+                PERFORM pg_advisory_xact_lock(hashtext('mv_catalogo_libros'), hashtext(s.isbn))
+                FROM (SELECT DISTINCT i AS isbn FROM unnest(p_isbns) i ORDER BY 1) s;
+
+                DELETE FROM mv_catalogo_libros WHERE isbn = ANY(p_isbns);
+                INSERT INTO mv_catalogo_libros
+                SELECT {origen};
+            END;$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0014_autor_prefijo_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE OR REPLACE FUNCTION catalogo_libro(p_isbn VARCHAR)
+            RETURNS SETOF vista_catalogo_libros AS $$
+                SELECT
+                    b.isbn,
+                    b.title,
+                    CONCAT(a.first_name, ' ', a.last_name),
+                    b.published_year,
+                    b.condition,
+                    b.page_count,
+                    (SELECT STRING_AGG(DISTINCT g.name, ', ')
+                     FROM biblioteca_bookgenre bg
+                     JOIN biblioteca_genre g ON g.id = bg.genre_id
+                     WHERE bg.book_id = b.isbn),
+                    -- Con los mismos LEFT JOIN que la vista: ' ' si no hay coautores
+                    (SELECT STRING_AGG(DISTINCT CONCAT(oa.first_name, ' ', oa.last_name), ', ')
+                     FROM (SELECT b.isbn) libro
+                     LEFT JOIN biblioteca_bookauthor ba ON ba.book_id = libro.isbn
+                     LEFT JOIN biblioteca_author oa
+                            ON oa.id = ba.author_id AND oa.id != b.main_author_id),
+                    b.total_copies::bigint,
+                    b.available_copies::bigint,
+                    r.total,
+                    r.promedio,
+                    b.created_at,
+                    CASE
+                        WHEN b.available_copies > 0
+                        THEN 'Disponible'
+                        ELSE 'No disponible'
+                    END
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON a.id = b.main_author_id
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           ROUND(AVG(
+                               CASE r.rating
+                                   WHEN 'poor' THEN 1
+                                   WHEN 'average' THEN 2
+                                   WHEN 'good' THEN 3
+                                   WHEN 'excellent' THEN 4
+                               END
+                           ), 2) AS promedio
+                    FROM biblioteca_review r
+                    WHERE r.book_id = b.isbn
+                ) r
+                WHERE b.isbn = p_isbn;
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION prestamos_usuario(p_usuario_id BIGINT)
+            RETURNS SETOF vista_prestamos_usuarios AS $$
+                SELECT
+                    u.id,
+                    u.username,
+                    CONCAT(u.first_name, ' ', u.last_name),
+                    u.email,
+                    u.status,
+                    l.total,
+                    l.activos,
+                    l.devueltos,
+                    l.vencidos,
+                    f.total,
+                    f.pendientes,
+                    COALESCE(f.monto_pendiente, 0::numeric),
+                    r.total,
+                    r.activas,
+                    rev.total,
+                    u.date_joined,
+                    CASE
+                        WHEN l.vencidos > 0 THEN 'Con retrasos'
+                        WHEN f.pendientes > 0 THEN 'Con multas'
+                        WHEN l.activos > 0 THEN 'Con préstamos'
+                        ELSE 'Sin actividad'
+                    END
+                FROM library_users u
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL) AS activos,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NOT NULL) AS devueltos,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL
+                                              AND lo.due_date < CURRENT_DATE) AS vencidos
+                    FROM biblioteca_loan lo
+                    WHERE lo.user_id = u.id
+                ) l
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE NOT fi.paid) AS pendientes,
+                           SUM(fi.amount) FILTER (WHERE NOT fi.paid) AS monto_pendiente
+                    FROM biblioteca_loan lo
+                    JOIN biblioteca_fine fi ON fi.loan_id = lo.id
+                    WHERE lo.user_id = u.id
+                ) f
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE re.expires_at > CURRENT_TIMESTAMP) AS activas
+                    FROM biblioteca_reservation re
+                    WHERE re.user_id = u.id
+                ) r
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total
+                    FROM biblioteca_review rv
+                    WHERE rv.user_id = u.id
+                ) rev
+                WHERE u.id = p_usuario_id
+                  AND u.status = 'active';
+            $$ LANGUAGE sql STABLE;
+
+            CREATE OR REPLACE FUNCTION actividad_sucursal(p_sucursal_id BIGINT)
+            RETURNS SETOF vista_actividad_sucursales AS $$
+                SELECT
+                    br.id,
+                    br.name,
+                    br.address,
+                    br.phone,
+                    s.total,
+                    c.total,
+                    c.disponibles,
+                    c.prestadas,
+                    l.total,
+                    l.activos,
+                    l.vencidos,
+                    e.total,
+                    e.futuros,
+                    ea.total,
+                    ROUND(
+                        CASE WHEN c.total > 0
+                             THEN c.prestadas::numeric * 100.0 / c.total::numeric
+                             ELSE 0::numeric
+                        END, 2),
+                    ROUND(
+                        CASE WHEN e.total > 0
+                             THEN ea.total::numeric * 1.0 / e.total::numeric
+                             ELSE 0::numeric
+                        END, 2),
+                    br.created_at,
+                    CASE
+                        WHEN c.prestadas::numeric * 100.0 / NULLIF(c.total, 0)::numeric >= 80
+                        THEN 'Alta ocupación'
+                        WHEN c.prestadas::numeric * 100.0 / NULLIF(c.total, 0)::numeric >= 50
+                        THEN 'Ocupación media'
+                        WHEN c.total > 0 THEN 'Baja ocupación'
+                        ELSE 'Sin actividad'
+                    END
+                FROM biblioteca_branch br
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total
+                    FROM biblioteca_shelf sh
+                    WHERE sh.branch_id = br.id
+                ) s
+                -- Copias y préstamos por los estantes de la sucursal
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE co.is_available) AS disponibles,
+                           COUNT(*) FILTER (WHERE NOT co.is_available) AS prestadas
+                    FROM biblioteca_shelf sh
+                    JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                    WHERE sh.branch_id = br.id
+                ) c
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL) AS activos,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL
+                                              AND lo.due_date < CURRENT_DATE) AS vencidos
+                    FROM biblioteca_shelf sh
+                    JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                    JOIN biblioteca_loan lo ON lo.copy_id = co.id
+                    WHERE sh.branch_id = br.id
+                ) l
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE ev.ends_at > CURRENT_TIMESTAMP) AS futuros
+                    FROM biblioteca_event ev
+                    WHERE ev.branch_id = br.id
+                ) e
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total
+                    FROM biblioteca_event ev
+                    JOIN biblioteca_eventattendance asi ON asi.event_id = ev.id
+                    WHERE ev.branch_id = br.id
+                ) ea
+                WHERE br.id = p_sucursal_id;
+            $$ LANGUAGE sql STABLE;
+            """ + REFRESH_CATALOGO.format(
+                origen="c.* FROM (SELECT DISTINCT i FROM unnest(p_isbns) i) s, "
+                       "LATERAL catalogo_libro(s.i) c"),
+            reverse_sql=REFRESH_CATALOGO.format(
+                origen="* FROM vista_catalogo_libros WHERE isbn = ANY(p_isbns)") + """
+            DROP FUNCTION IF EXISTS actividad_sucursal(BIGINT);
+            DROP FUNCTION IF EXISTS prestamos_usuario(BIGINT);
+            DROP FUNCTION IF EXISTS catalogo_libro(VARCHAR);
+            """,
+        ),
+    ]
@@ -0,0 +1,221 @@
+from django.db import migrations
+
+# Resumen diario de circulación por sucursal y libro. Los reportes de
+# tendencia (préstamos por sucursal y semana, etc.) leen solo esta tabla en
+# vez de recorrer todo el historial de préstamos y multas.
+#
+# Cada préstamo aporta a tres días (en UTC, como las particiones):
+#   - loans_opened: el día de `loaned_at`;
+#   - loans_returned: el día de `returned_at`;
+#   - overdue: el día siguiente a `due_date` (el primero de retraso), si se
+#     devolvió tarde o sigue abierto. Para un préstamo abierto puede ser un
+#     día futuro: pasa a contar en cuanto llega ese día, sin más escrituras.
+# Y cada multa, al día de su `created_at`: fines_issued y su importe (el
+# devengado o el final; `devengar_multas` lo actualiza en el mismo día).
+#
+# La sucursal y el libro salen de la copia del préstamo (su estante). Los
+# triggers aplican la diferencia entre filas nuevas y viejas por sentencia;
+# `manage.py rellenar_circulacion` la recalcula desde el historial (préstamos
+# actuales y archivados). Mover una copia de sucursal no reescribe sus días
+# anteriores: se corrige con ese comando.
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0015_detalle_por_clave'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE circulation_daily (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                day DATE NOT NULL,
+                branch_id BIGINT,  -- NULL: copia sin estante
+                book_id VARCHAR(13) NOT NULL,
+                loans_opened INTEGER NOT NULL DEFAULT 0,
+                loans_returned INTEGER NOT NULL DEFAULT 0,
+                overdue INTEGER NOT NULL DEFAULT 0,
+                fines_issued INTEGER NOT NULL DEFAULT 0,
+                fine_amount NUMERIC(12,2) NOT NULL DEFAULT 0
+            );
+            CREATE UNIQUE INDEX circulation_daily_clave_idx
+                ON circulation_daily (day, branch_id, book_id) NULLS NOT DISTINCT;
+            CREATE INDEX circulation_daily_sucursal_idx ON circulation_daily (branch_id, day);
+            CREATE INDEX circulation_daily_libro_idx ON circulation_daily (book_id, day);
+
+            CREATE OR REPLACE FUNCTION circulacion_dia(p_momento TIMESTAMPTZ)
+            RETURNS DATE AS $$
+                SELECT (p_momento AT TIME ZONE 'UTC')::date;
+            $$ LANGUAGE sql IMMUTABLE;
+
+            -- Aportaciones de un préstamo (con signo) a cada día
+            CREATE OR REPLACE FUNCTION circulacion_eventos_prestamo(
+                p_loaned_at TIMESTAMPTZ, p_due DATE, p_returned_at TIMESTAMPTZ, p_signo INT
+            ) RETURNS TABLE (dia DATE, abiertos INT, devueltos INT, vencidos INT,
+                             multas INT, importe NUMERIC) AS $$
+                SELECT e.* FROM (VALUES
+                    (circulacion_dia(p_loaned_at), p_signo, 0, 0, 0, 0::numeric),
+                    (circulacion_dia(p_returned_at), 0, p_signo, 0, 0, 0),
+                    (CASE WHEN p_returned_at IS NULL
+                            OR circulacion_dia(p_returned_at) > p_due
+                          THEN p_due + 1 END, 0, 0, p_signo, 0, 0)
+                ) e(dia, abiertos, devueltos, vencidos, multas, importe)
+                WHERE e.dia IS NOT NULL;
+            $$ LANGUAGE sql IMMUTABLE;
+
+            -- Suma al resumen la diferencia entre filas de préstamo nuevas y
+            -- viejas. En orden de clave, para que dos sentencias que tocan
+            -- los mismos días no se bloqueen mutuamente.
+            CREATE OR REPLACE FUNCTION circulacion_sumar_prestamos(
+                p_nuevos biblioteca_loan[], p_viejos biblioteca_loan[]
+            ) RETURNS void AS $$
+                INSERT INTO circulation_daily AS cd
+                    (day, branch_id, book_id, loans_opened, loans_returned, overdue)
+                SELECT e.dia, sh.branch_id, co.book_id,
+                       SUM(e.abiertos), SUM(e.devueltos), SUM(e.vencidos)
+                FROM (
+                    SELECT l.*, 1 AS signo FROM unnest(p_nuevos) l
+                    UNION ALL
+                    SELECT l.*, -1 FROM unnest(p_viejos) l
+                ) l
+                CROSS JOIN LATERAL circulacion_eventos_prestamo(
+                    l.loaned_at, l.due_date, l.returned_at, l.signo) e
+                JOIN biblioteca_copy co ON co.id = l.copy_id
+                LEFT JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                GROUP BY 1, 2, 3
+                -- Lo que se compensa (una edición que no cambia fechas) no se escribe
+                HAVING SUM(e.abiertos) <> 0 OR SUM(e.devueltos) <> 0 OR SUM(e.vencidos) <> 0
+                ORDER BY 1, 2, 3
+                ON CONFLICT (day, branch_id, book_id) DO UPDATE SET
+                    loans_opened = cd.loans_opened + EXCLUDED.loans_opened,
+                    loans_returned = cd.loans_returned + EXCLUDED.loans_returned,
+                    overdue = cd.overdue + EXCLUDED.overdue;
+            $$ LANGUAGE sql;
+
+            -- Igual para multas; el préstamo puede estar archivado
+            CREATE OR REPLACE FUNCTION circulacion_sumar_multas(
+                p_nuevas biblioteca_fine[], p_viejas biblioteca_fine[]
+            ) RETURNS void AS $$
+                INSERT INTO circulation_daily AS cd
+                    (day, branch_id, book_id, fines_issued, fine_amount)
+                SELECT circulacion_dia(f.created_at), sh.branch_id, co.book_id,
+                       SUM(f.signo), SUM(f.signo * f.amount)
+                FROM (
+                    SELECT f.*, 1 AS signo FROM unnest(p_nuevas) f
+                    UNION ALL
+                    SELECT f.*, -1 FROM unnest(p_viejas) f
+                ) f
+                JOIN biblioteca_loan_historial l ON l.id = f.loan_id
+                JOIN biblioteca_copy co ON co.id = l.copy_id
+                LEFT JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                GROUP BY 1, 2, 3
+                HAVING SUM(f.signo) <> 0 OR SUM(f.signo * f.amount) <> 0
+                ORDER BY 1, 2, 3
+                ON CONFLICT (day, branch_id, book_id) DO UPDATE SET
+                    fines_issued = cd.fines_issued + EXCLUDED.fines_issued,
+                    fine_amount = cd.fine_amount + EXCLUDED.fine_amount;
+            $$ LANGUAGE sql;
+
+            CREATE OR REPLACE FUNCTION trg_circulacion_prestamos() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM circulacion_sumar_prestamos(
+                        ARRAY(SELECT nu::biblioteca_loan FROM nuevas nu), '{}');
+                ELSIF TG_OP = 'UPDATE' THEN
+                    PERFORM circulacion_sumar_prestamos(
+                        ARRAY(SELECT nu::biblioteca_loan FROM nuevas nu),
+                        ARRAY(SELECT v::biblioteca_loan FROM viejas v));
+                ELSE
+                    PERFORM circulacion_sumar_prestamos(
+                        '{}', ARRAY(SELECT v::biblioteca_loan FROM viejas v));
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION trg_circulacion_multas() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM circulacion_sumar_multas(
+                        ARRAY(SELECT nu::biblioteca_fine FROM nuevas nu), '{}');
+                ELSIF TG_OP = 'UPDATE' THEN
+                    PERFORM circulacion_sumar_multas(
+                        ARRAY(SELECT nu::biblioteca_fine FROM nuevas nu),
+                        ARRAY(SELECT v::biblioteca_fine FROM viejas v));
+                ELSE
+                    PERFORM circulacion_sumar_multas(
+                        '{}', ARRAY(SELECT v::biblioteca_fine FROM viejas v));
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_loan_circulacion_ins AFTER INSERT ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_prestamos();
+            CREATE TRIGGER trg_loan_circulacion_upd AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_prestamos();
+            CREATE TRIGGER trg_loan_circulacion_del AFTER DELETE ON biblioteca_loan
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_prestamos();
+
+            CREATE TRIGGER trg_fine_circulacion_ins AFTER INSERT ON biblioteca_fine
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_multas();
+            CREATE TRIGGER trg_fine_circulacion_upd AFTER UPDATE ON biblioteca_fine
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_multas();
+            CREATE TRIGGER trg_fine_circulacion_del AFTER DELETE ON biblioteca_fine
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_circulacion_multas();
+
+            -- El resumen de los días [p_desde, p_hasta) calculado desde el
+            -- historial (NULL: sin límite). Lo usan `rellenar_circulacion` y
+            -- la carga de `generar_datos`.
+            CREATE OR REPLACE FUNCTION circulacion_historial(p_desde DATE, p_hasta DATE)
+            RETURNS TABLE (day DATE, branch_id BIGINT, book_id VARCHAR,
+                           loans_opened BIGINT, loans_returned BIGINT, overdue BIGINT,
+                           fines_issued BIGINT, fine_amount NUMERIC) AS $$
+                SELECT e.dia, sh.branch_id, co.book_id,
+                       SUM(e.abiertos), SUM(e.devueltos), SUM(e.vencidos),
+                       SUM(e.multas), SUM(e.importe)
+                FROM (
+                    SELECT l.copy_id, e.*
+                    FROM biblioteca_loan_historial l
+                    CROSS JOIN LATERAL circulacion_eventos_prestamo(
+                        l.loaned_at, l.due_date, l.returned_at, 1) e
+                    UNION ALL
+                    SELECT l.copy_id, circulacion_dia(f.created_at), 0, 0, 0, 1, f.amount
+                    FROM biblioteca_fine f
+                    JOIN biblioteca_loan_historial l ON l.id = f.loan_id
+                ) e
+                JOIN biblioteca_copy co ON co.id = e.copy_id
+                LEFT JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                WHERE e.dia >= COALESCE(p_desde, '-infinity'::date)
+                  AND e.dia < COALESCE(p_hasta, 'infinity'::date)
+                GROUP BY 1, 2, 3;
+            $$ LANGUAGE sql STABLE;
+
+            INSERT INTO circulation_daily
+                (day, branch_id, book_id, loans_opened, loans_returned, overdue,
+                 fines_issued, fine_amount)
+            SELECT * FROM circulacion_historial(NULL, NULL);
+            """,
+            reverse_sql="""
+            DROP TRIGGER IF EXISTS trg_fine_circulacion_del ON biblioteca_fine;
+            DROP TRIGGER IF EXISTS trg_fine_circulacion_upd ON biblioteca_fine;
+            DROP TRIGGER IF EXISTS trg_fine_circulacion_ins ON biblioteca_fine;
+            DROP TRIGGER IF EXISTS trg_loan_circulacion_del ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_circulacion_upd ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_circulacion_ins ON biblioteca_loan;
+            DROP FUNCTION IF EXISTS trg_circulacion_multas();
+            DROP FUNCTION IF EXISTS trg_circulacion_prestamos();
+            DROP FUNCTION IF EXISTS circulacion_historial(DATE, DATE);
+            DROP FUNCTION IF EXISTS circulacion_sumar_multas(biblioteca_fine[], biblioteca_fine[]);
+            DROP FUNCTION IF EXISTS circulacion_sumar_prestamos(biblioteca_loan[], biblioteca_loan[]);
+            DROP FUNCTION IF EXISTS circulacion_eventos_prestamo(TIMESTAMPTZ, DATE, TIMESTAMPTZ, INT);
+            DROP FUNCTION IF EXISTS circulacion_dia(TIMESTAMPTZ);
+            DROP TABLE IF EXISTS circulation_daily;
+            """,
+        ),
+    ]
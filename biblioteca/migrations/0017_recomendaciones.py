@@ -0,0 +1,33 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0016_circulacion_diaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recomendacion', serialize=False, to='biblioteca.book')),
+                ('related', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=13), size=None)),
+                ('scores', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunSQL(
+            sql="""
+            -- Hasta qué préstamo (id) está calculado biblioteca_bookrecommendation;
+            -- `calcular_recomendaciones --incremental` parte de aquí. Una sola fila.
+            CREATE TABLE biblioteca_recomendacion_estado (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                ultimo_prestamo BIGINT NOT NULL,
+                calculado_en TIMESTAMPTZ NOT NULL
+            );
+            """,
+            reverse_sql="DROP TABLE IF EXISTS biblioteca_recomendacion_estado;",
+        ),
+    ]
@@ -0,0 +1,411 @@
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.math
+from django.db import migrations, models
+
+# Valoración media y utilidad de las reseñas mantenidas por triggers, en lugar
+# de agregar todas las reseñas y votos en cada consulta del catálogo.
+#
+# - biblioteca_book.rating_sum/rating_count: triggers por sentencia sobre
+#   biblioteca_review; rating_avg es una columna generada a partir de ellas.
+# - biblioteca_review.upvotes/downvotes/helpfulness: triggers por sentencia
+#   sobre biblioteca_reviewvote; helpfulness es la cota inferior del intervalo
+#   de Wilson (95 %) de la proporción de votos útiles, que no premia a una
+#   reseña con un solo voto positivo frente a otra con 40 de 45.
+#
+# Las reseñas llegan a mv_catalogo_libros a través del UPDATE del libro (como
+# las copias desde la 0008), así que sobran sus triggers de catálogo.
+
+VISTA_CATALOGO = """
+CREATE OR REPLACE VIEW vista_catalogo_libros AS
+                SELECT
+                    b.isbn,
+                    b.title,
+                    CONCAT(a.first_name, ' ', a.last_name) as autor_principal,
+                    b.published_year,
+                    b.condition,
+                    b.page_count,
+                    STRING_AGG(DISTINCT g.name, ', ') as generos,
+                    STRING_AGG(DISTINCT CONCAT(oa.first_name, ' ', oa.last_name), ', ') as otros_autores,
+                    b.total_copies::bigint as total_copias,
+                    b.available_copies::bigint as copias_disponibles,
+                    {resenas},
+                    b.created_at,
+                    CASE
+                        WHEN b.available_copies > 0
+                        THEN 'Disponible'
+                        ELSE 'No disponible'
+                    END as estado_disponibilidad
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON b.main_author_id = a.id
+                LEFT JOIN biblioteca_bookauthor ba ON b.isbn = ba.book_id
+                LEFT JOIN biblioteca_author oa ON ba.author_id = oa.id AND oa.id != b.main_author_id
+                LEFT JOIN biblioteca_bookgenre bg ON b.isbn = bg.book_id
+                LEFT JOIN biblioteca_genre g ON bg.genre_id = g.id{unir_resenas}
+                GROUP BY
+                    b.isbn, b.title, a.first_name, a.last_name,
+                    b.published_year, b.condition, b.page_count, b.created_at,
+                    b.total_copies, b.available_copies{agrupar_resenas}
+                ORDER BY b.title;
+"""
+
+CATALOGO_LIBRO = """
+            CREATE OR REPLACE FUNCTION catalogo_libro(p_isbn VARCHAR)
+            RETURNS SETOF vista_catalogo_libros AS $$
+                SELECT
+                    b.isbn,
+                    b.title,
+                    CONCAT(a.first_name, ' ', a.last_name),
+                    b.published_year,
+                    b.condition,
+                    b.page_count,
+                    (SELECT STRING_AGG(DISTINCT g.name, ', ')
+                     FROM biblioteca_bookgenre bg
+                     JOIN biblioteca_genre g ON g.id = bg.genre_id
+                     WHERE bg.book_id = b.isbn),
+                    -- Con los mismos LEFT JOIN que la vista: ' ' si no hay coautores
+                    (SELECT STRING_AGG(DISTINCT CONCAT(oa.first_name, ' ', oa.last_name), ', ')
+                     FROM (SELECT b.isbn) libro
+                     LEFT JOIN biblioteca_bookauthor ba ON ba.book_id = libro.isbn
+                     LEFT JOIN biblioteca_author oa
+                            ON oa.id = ba.author_id AND oa.id != b.main_author_id),
+                    b.total_copies::bigint,
+                    b.available_copies::bigint,
+                    {resenas},
+                    b.created_at,
+                    CASE
+                        WHEN b.available_copies > 0
+                        THEN 'Disponible'
+                        ELSE 'No disponible'
+                    END
+                FROM biblioteca_book b
+                LEFT JOIN biblioteca_author a ON a.id = b.main_author_id{unir_resenas}
+                WHERE b.isbn = p_isbn;
+            $$ LANGUAGE sql STABLE;
+"""
+
+PROMEDIO_RESENAS = """ROUND(AVG(
+                        CASE r.rating
+                            WHEN 'poor' THEN 1
+                            WHEN 'average' THEN 2
+                            WHEN 'good' THEN 3
+                            WHEN 'excellent' THEN 4
+                        END
+                    ), 2)"""
+
+BOOK_GUARD = """
+            CREATE OR REPLACE FUNCTION trg_book_contadores_guard() RETURNS trigger AS $$
+            BEGIN
+                IF pg_trigger_depth() = 1
+                   AND current_setting('biblioteca.reparar_contadores', true)
+                       IS DISTINCT FROM 'on' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        NEW.total_copies := 0;
+                        NEW.available_copies := 0;{insertar}
+                    ELSE
+                        NEW.total_copies := OLD.total_copies;
+                        NEW.available_copies := OLD.available_copies;{actualizar}
+                    END IF;
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            -- Auditoría: un cambio solo de contadores no es una edición del libro
+            CREATE OR REPLACE FUNCTION trg_book_audit() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'UPDATE'
+                   AND ({columnas_new})
+                       IS DISTINCT FROM ({columnas_old})
+                   AND to_jsonb(NEW) - {contadores}::text[]
+                     = to_jsonb(OLD) - {contadores}::text[] THEN
+                    RETURN NEW;
+                END IF;
+                INSERT INTO biblioteca_auditlog(table_name, record_id, op, changed_at, change_user)
+                VALUES('books', COALESCE(NEW.isbn, OLD.isbn), TG_OP, NOW(), current_user);
+                PERFORM notify_reportes('catalogo');
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+"""
+
+
+def book_guard(contadores):
+    nuevas = [c for c in contadores if c not in ("total_copies", "available_copies")]
+    return BOOK_GUARD.format(
+        insertar="".join(f"\n                        NEW.{c} := 0;" for c in nuevas),
+        actualizar="".join(f"\n                        NEW.{c} := OLD.{c};" for c in nuevas),
+        columnas_new=", ".join(f"NEW.{c}" for c in contadores),
+        columnas_old=", ".join(f"OLD.{c}" for c in contadores),
+        contadores="'{" + ",".join(contadores + (("rating_avg",) if nuevas else ())) + "}'",
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0017_recomendaciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_avg',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('rating_sum', models.DecimalField(decimal_places=2, max_digits=12)), '/', django.db.models.functions.comparison.NullIf('rating_count', 0)), 2), output_field=models.DecimalField(decimal_places=2, max_digits=3)),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='upvotes',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='downvotes',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='helpfulness',
+            field=models.FloatField(db_default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('rating_count__gt', 0)), fields=['-rating_avg', '-rating_count', 'isbn'], name='book_mejor_valorado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', '-helpfulness', 'id'], name='review_util_idx'),
+        ),
+        migrations.RunSQL(
+            sql="""
+            CREATE OR REPLACE FUNCTION rating_valor(p_rating rating_scale)
+            RETURNS INT AS $$
+                SELECT CASE p_rating
+                    WHEN 'poor' THEN 1
+                    WHEN 'average' THEN 2
+                    WHEN 'good' THEN 3
+                    WHEN 'excellent' THEN 4
+                END;
+            $$ LANGUAGE sql IMMUTABLE;
+
+            -- Cota inferior del intervalo de Wilson (z = 1,96) de la proporción
+            -- de votos útiles; 0 sin votos
+            CREATE OR REPLACE FUNCTION wilson_inferior(p_utiles BIGINT, p_no_utiles BIGINT)
+            RETURNS DOUBLE PRECISION AS $$
+                SELECT CASE WHEN n = 0 THEN 0 ELSE
+                    (p + z * z / (2 * n) - z * sqrt((p * (1 - p) + z * z / (4 * n)) / n))
+                    / (1 + z * z / n)
+                END
+                FROM (SELECT (p_utiles + p_no_utiles)::float8 AS n,
+                             p_utiles::float8 / NULLIF(p_utiles + p_no_utiles, 0) AS p,
+                             1.959964::float8 AS z) t;
+            $$ LANGUAGE sql IMMUTABLE;
+            """ + book_guard(("total_copies", "available_copies", "rating_sum", "rating_count")) + """
+            -- Igual para los votos de las reseñas: el formulario no los pisa
+            CREATE OR REPLACE FUNCTION trg_review_votos_guard() RETURNS trigger AS $$
+            BEGIN
+                IF pg_trigger_depth() = 1
+                   AND current_setting('biblioteca.reparar_contadores', true)
+                       IS DISTINCT FROM 'on' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        NEW.upvotes := 0;
+                        NEW.downvotes := 0;
+                        NEW.helpfulness := 0;
+                    ELSE
+                        NEW.upvotes := OLD.upvotes;
+                        NEW.downvotes := OLD.downvotes;
+                        NEW.helpfulness := OLD.helpfulness;
+                    END IF;
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_review_votos_guard
+            BEFORE INSERT OR UPDATE ON biblioteca_review
+            FOR EACH ROW EXECUTE FUNCTION trg_review_votos_guard();
+
+            DROP TRIGGER trg_catalogo_review_del ON biblioteca_review;
+            DROP TRIGGER trg_catalogo_review_upd ON biblioteca_review;
+            DROP TRIGGER trg_catalogo_review_ins ON biblioteca_review;
+
+            -- Carga inicial
+            SELECT set_config('biblioteca.reparar_contadores', 'on', true);
+            UPDATE biblioteca_book b
+            SET rating_sum = r.suma, rating_count = r.total
+            FROM (
+                SELECT book_id, SUM(rating_valor(rating)) AS suma, COUNT(*) AS total
+                FROM biblioteca_review GROUP BY book_id
+            ) r
+            WHERE b.isbn = r.book_id;
+            UPDATE biblioteca_review r
+            SET upvotes = v.utiles, downvotes = v.no_utiles,
+                helpfulness = wilson_inferior(v.utiles, v.no_utiles)
+            FROM (
+                SELECT review_id, COUNT(*) FILTER (WHERE is_upvote) AS utiles,
+                       COUNT(*) FILTER (WHERE NOT is_upvote) AS no_utiles
+                FROM biblioteca_reviewvote GROUP BY review_id
+            ) v
+            WHERE r.id = v.review_id;
+            SELECT set_config('biblioteca.reparar_contadores', 'off', true);
+
+            -- Trigger (por sentencia): suma el saldo de cada libro afectado
+            CREATE OR REPLACE FUNCTION trg_review_rating() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_book b
+                    SET rating_sum = b.rating_sum + d.suma,
+                        rating_count = b.rating_count + d.total
+                    FROM (
+                        SELECT book_id, SUM(rating_valor(rating)) AS suma, COUNT(*) AS total
+                        FROM nuevas GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id;
+                ELSIF TG_OP = 'DELETE' THEN
+                    UPDATE biblioteca_book b
+                    SET rating_sum = b.rating_sum - d.suma,
+                        rating_count = b.rating_count - d.total
+                    FROM (
+                        SELECT book_id, SUM(rating_valor(rating)) AS suma, COUNT(*) AS total
+                        FROM viejas GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id;
+                ELSE
+                    UPDATE biblioteca_book b
+                    SET rating_sum = b.rating_sum + d.suma,
+                        rating_count = b.rating_count + d.total
+                    FROM (
+                        SELECT book_id, SUM(valor) AS suma, SUM(total) AS total
+                        FROM (
+                            SELECT book_id, rating_valor(rating) AS valor, 1 AS total
+                            FROM nuevas
+                            UNION ALL
+                            SELECT book_id, -rating_valor(rating), -1 FROM viejas
+                        ) t
+                        GROUP BY book_id
+                    ) d
+                    WHERE b.isbn = d.book_id AND (d.suma <> 0 OR d.total <> 0);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_review_rating_ins AFTER INSERT ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_review_rating();
+            CREATE TRIGGER trg_review_rating_upd AFTER UPDATE ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_review_rating();
+            CREATE TRIGGER trg_review_rating_del AFTER DELETE ON biblioteca_review
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_review_rating();
+
+            -- Trigger (por sentencia): votos y utilidad de cada reseña afectada
+            CREATE OR REPLACE FUNCTION trg_reviewvote_votos() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE biblioteca_review r
+                    SET upvotes = r.upvotes + d.utiles,
+                        downvotes = r.downvotes + d.no_utiles,
+                        helpfulness = wilson_inferior(r.upvotes + d.utiles, r.downvotes + d.no_utiles)
+                    FROM (
+                        SELECT review_id, COUNT(*) FILTER (WHERE is_upvote) AS utiles,
+                               COUNT(*) FILTER (WHERE NOT is_upvote) AS no_utiles
+                        FROM nuevas GROUP BY review_id
+                    ) d
+                    WHERE r.id = d.review_id;
+                ELSIF TG_OP = 'DELETE' THEN
+                    UPDATE biblioteca_review r
+                    SET upvotes = r.upvotes - d.utiles,
+                        downvotes = r.downvotes - d.no_utiles,
+                        helpfulness = wilson_inferior(r.upvotes - d.utiles, r.downvotes - d.no_utiles)
+                    FROM (
+                        SELECT review_id, COUNT(*) FILTER (WHERE is_upvote) AS utiles,
+                               COUNT(*) FILTER (WHERE NOT is_upvote) AS no_utiles
+                        FROM viejas GROUP BY review_id
+                    ) d
+                    WHERE r.id = d.review_id;
+                ELSE
+                    UPDATE biblioteca_review r
+                    SET upvotes = r.upvotes + d.utiles,
+                        downvotes = r.downvotes + d.no_utiles,
+                        helpfulness = wilson_inferior(r.upvotes + d.utiles, r.downvotes + d.no_utiles)
+                    FROM (
+                        SELECT review_id, SUM(utiles) AS utiles, SUM(no_utiles) AS no_utiles
+                        FROM (
+                            SELECT review_id, is_upvote::int AS utiles, (NOT is_upvote)::int AS no_utiles
+                            FROM nuevas
+                            UNION ALL
+                            SELECT review_id, -(is_upvote::int), -((NOT is_upvote)::int) FROM viejas
+                        ) t
+                        GROUP BY review_id
+                    ) d
+                    WHERE r.id = d.review_id AND (d.utiles <> 0 OR d.no_utiles <> 0);
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_reviewvote_votos_ins AFTER INSERT ON biblioteca_reviewvote
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_reviewvote_votos();
+            CREATE TRIGGER trg_reviewvote_votos_upd AFTER UPDATE ON biblioteca_reviewvote
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_reviewvote_votos();
+            CREATE TRIGGER trg_reviewvote_votos_del AFTER DELETE ON biblioteca_reviewvote
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_reviewvote_votos();
+            """
+            # El catálogo lee los contadores en lugar de unir biblioteca_review
+            + VISTA_CATALOGO.format(
+                resenas="b.rating_count::bigint as total_reviews,\n"
+                        "                    b.rating_avg::numeric as rating_promedio",
+                unir_resenas="",
+                agrupar_resenas=",\n                    b.rating_count, b.rating_avg")
+            + CATALOGO_LIBRO.format(
+                resenas="b.rating_count::bigint,\n                    b.rating_avg::numeric",
+                unir_resenas=""),
+            reverse_sql=VISTA_CATALOGO.format(
+                resenas="COUNT(DISTINCT r.id) as total_reviews,\n"
+                        f"                    {PROMEDIO_RESENAS} as rating_promedio",
+                unir_resenas="\n                LEFT JOIN biblioteca_review r ON b.isbn = r.book_id",
+                agrupar_resenas="")
+            + CATALOGO_LIBRO.format(
+                resenas="r.total,\n                    r.promedio",
+                unir_resenas=f"""
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           {PROMEDIO_RESENAS} AS promedio
+                    FROM biblioteca_review r
+                    WHERE r.book_id = b.isbn
+                ) r""")
+            + book_guard(("total_copies", "available_copies")) + """
+            DROP TRIGGER IF EXISTS trg_reviewvote_votos_del ON biblioteca_reviewvote;
+            DROP TRIGGER IF EXISTS trg_reviewvote_votos_upd ON biblioteca_reviewvote;
+            DROP TRIGGER IF EXISTS trg_reviewvote_votos_ins ON biblioteca_reviewvote;
+            DROP FUNCTION IF EXISTS trg_reviewvote_votos();
+            DROP TRIGGER IF EXISTS trg_review_rating_del ON biblioteca_review;
+            DROP TRIGGER IF EXISTS trg_review_rating_upd ON biblioteca_review;
+            DROP TRIGGER IF EXISTS trg_review_rating_ins ON biblioteca_review;
+            DROP FUNCTION IF EXISTS trg_review_rating();
+            DROP TRIGGER IF EXISTS trg_review_votos_guard ON biblioteca_review;
+            DROP FUNCTION IF EXISTS trg_review_votos_guard();
+            DROP FUNCTION IF EXISTS wilson_inferior(BIGINT, BIGINT);
+            DROP FUNCTION IF EXISTS rating_valor(rating_scale);
+
+            CREATE TRIGGER trg_catalogo_review_ins AFTER INSERT ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_review_upd AFTER UPDATE ON biblioteca_review
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            CREATE TRIGGER trg_catalogo_review_del AFTER DELETE ON biblioteca_review
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_catalogo_hijos();
+            """,
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0018_agregados_resenas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            -- trg_update_copy_available solo notifica en INSERT/UPDATE: borrar un
+            -- préstamo (LoanDeleteView) también cambia los préstamos activos de
+            -- los reportes de usuarios y sucursales
+            CREATE TRIGGER trg_biblioteca_loan_notify_del
+            AFTER DELETE ON biblioteca_loan
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_notify_reportes('prestamos,sucursales');
+            """,
+            reverse_sql="DROP TRIGGER IF EXISTS trg_biblioteca_loan_notify_del ON biblioteca_loan;",
+        ),
+    ]
@@ -0,0 +1,20 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0019_notificar_borrado_prestamos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(
+                django.db.models.functions.text.Upper('last_name'),
+                django.db.models.functions.text.Upper('first_name'),
+                models.F('id'),
+                name='author_orden_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,332 @@
+from django.db import migrations, models
+
+# `actividad_sucursal(id)` (0015) agregaba todas las copias de la sucursal y
+# todos sus préstamos: su coste crecía con el fondo y con el historial.
+#
+# - biblioteca_branch.total_copies/total_loans: copias en sus estantes y
+#   préstamos (en biblioteca_loan) de esas copias, mantenidos por triggers
+#   por sentencia sobre biblioteca_copy, biblioteca_loan y biblioteca_shelf.
+# - Lo prestado se cuenta por las copias no disponibles (índice parcial
+#   copy_prestada_idx) y sus préstamos abiertos (loan_abiertos_copy_idx): una
+#   copia con un préstamo abierto no está disponible (trg_update_copy_available).
+#
+# El coste pasa a depender solo de lo que la sucursal tiene prestado ahora.
+# La vista vista_actividad_sucursales no cambia y sigue siendo la referencia
+# (DetallePorFuncionTests).
+
+ACTIVIDAD_SUCURSAL = """
+            CREATE OR REPLACE FUNCTION actividad_sucursal(p_sucursal_id BIGINT)
+            RETURNS SETOF vista_actividad_sucursales AS $$
+                SELECT
+                    br.id,
+                    br.name,
+                    br.address,
+                    br.phone,
+                    s.total,
+                    c.total,
+                    c.disponibles,
+                    c.prestadas,
+                    l.total,
+                    l.activos,
+                    l.vencidos,
+                    e.total,
+                    e.futuros,
+                    ea.total,
+                    ROUND(
+                        CASE WHEN c.total > 0
+                             THEN c.prestadas::numeric * 100.0 / c.total::numeric
+                             ELSE 0::numeric
+                        END, 2),
+                    ROUND(
+                        CASE WHEN e.total > 0
+                             THEN ea.total::numeric * 1.0 / e.total::numeric
+                             ELSE 0::numeric
+                        END, 2),
+                    br.created_at,
+                    CASE
+                        WHEN c.prestadas::numeric * 100.0 / NULLIF(c.total, 0)::numeric >= 80
+                        THEN 'Alta ocupación'
+                        WHEN c.prestadas::numeric * 100.0 / NULLIF(c.total, 0)::numeric >= 50
+                        THEN 'Ocupación media'
+                        WHEN c.total > 0 THEN 'Baja ocupación'
+                        ELSE 'Sin actividad'
+                    END
+                FROM biblioteca_branch br
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total
+                    FROM biblioteca_shelf sh
+                    WHERE sh.branch_id = br.id
+                ) s{copias_y_prestamos}
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE ev.ends_at > CURRENT_TIMESTAMP) AS futuros
+                    FROM biblioteca_event ev
+                    WHERE ev.branch_id = br.id
+                ) e
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total
+                    FROM biblioteca_event ev
+                    JOIN biblioteca_eventattendance asi ON asi.event_id = ev.id
+                    WHERE ev.branch_id = br.id
+                ) ea
+                WHERE br.id = p_sucursal_id;
+            $$ LANGUAGE sql STABLE;
+"""
+
+COPIAS_Y_PRESTAMOS = """
+                -- Copias prestadas de la sucursal y sus préstamos abiertos
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(DISTINCT co.id) AS prestadas,
+                           COUNT(lo.id) AS activos,
+                           COUNT(lo.id) FILTER (WHERE lo.due_date < CURRENT_DATE) AS vencidos
+                    FROM biblioteca_shelf sh
+                    JOIN biblioteca_copy co ON co.shelf_id = sh.id AND NOT co.is_available
+                    LEFT JOIN biblioteca_loan lo
+                           ON lo.copy_id = co.id AND lo.returned_at IS NULL
+                    WHERE sh.branch_id = br.id
+                ) p
+                CROSS JOIN LATERAL (
+                    SELECT br.total_copies::bigint AS total,
+                           br.total_copies::bigint - p.prestadas AS disponibles,
+                           p.prestadas
+                ) c
+                CROSS JOIN LATERAL (
+                    SELECT br.total_loans::bigint AS total, p.activos, p.vencidos
+                ) l"""
+
+COPIAS_Y_PRESTAMOS_0015 = """
+                -- Copias y préstamos por los estantes de la sucursal
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE co.is_available) AS disponibles,
+                           COUNT(*) FILTER (WHERE NOT co.is_available) AS prestadas
+                    FROM biblioteca_shelf sh
+                    JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                    WHERE sh.branch_id = br.id
+                ) c
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL) AS activos,
+                           COUNT(*) FILTER (WHERE lo.returned_at IS NULL
+                                              AND lo.due_date < CURRENT_DATE) AS vencidos
+                    FROM biblioteca_shelf sh
+                    JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                    JOIN biblioteca_loan lo ON lo.copy_id = co.id
+                    WHERE sh.branch_id = br.id
+                ) l"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('biblioteca', '0020_autor_orden_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='total_copies',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='branch',
+            name='total_loans',
+            field=models.PositiveIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(
+                condition=models.Q(('is_available', False)),
+                fields=['shelf'],
+                name='copy_prestada_idx',
+            ),
+        ),
+        migrations.RunSQL(
+            sql="""
+            CREATE INDEX loan_abiertos_copy_idx ON biblioteca_loan (copy_id, due_date)
+                WHERE returned_at IS NULL;
+
+            -- Carga inicial
+            UPDATE biblioteca_branch br
+            SET total_copies = d.copias, total_loans = d.prestamos
+            FROM (
+                SELECT sh.branch_id, COUNT(*) AS copias, COALESCE(SUM(p.total), 0) AS prestamos
+                FROM biblioteca_shelf sh
+                JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                LEFT JOIN (
+                    SELECT copy_id, COUNT(*) AS total FROM biblioteca_loan GROUP BY copy_id
+                ) p ON p.copy_id = co.id
+                GROUP BY sh.branch_id
+            ) d
+            WHERE br.id = d.branch_id;
+
+            -- Copias que entran o salen de los estantes de una sucursal; las que
+            -- cambian de estante se llevan sus préstamos. Al insertar o borrar
+            -- una copia no tiene préstamos (biblioteca_loan la protege).
+            CREATE OR REPLACE FUNCTION sucursal_sumar_copias(
+                p_nuevas biblioteca_copy[], p_viejas biblioteca_copy[]
+            ) RETURNS void AS $$
+                UPDATE biblioteca_branch br
+                SET total_copies = br.total_copies + d.copias,
+                    total_loans = br.total_loans + d.prestamos
+                FROM (
+                    SELECT sh.branch_id, SUM(c.signo) AS copias,
+                           SUM(c.signo * CASE WHEN c.movida THEN
+                               (SELECT COUNT(*) FROM biblioteca_loan lo WHERE lo.copy_id = c.id)
+                           ELSE 0 END) AS prestamos
+                    FROM (
+                        SELECT n.id, n.shelf_id, 1 AS signo,
+                               n.shelf_id IS DISTINCT FROM v.shelf_id AS movida
+                        FROM unnest(p_nuevas) n
+                        LEFT JOIN unnest(p_viejas) v ON v.id = n.id
+                        UNION ALL
+                        SELECT v.id, v.shelf_id, -1,
+                               n.shelf_id IS DISTINCT FROM v.shelf_id
+                        FROM unnest(p_viejas) v
+                        LEFT JOIN unnest(p_nuevas) n ON n.id = v.id
+                    ) c
+                    JOIN biblioteca_shelf sh ON sh.id = c.shelf_id
+                    WHERE c.movida
+                    GROUP BY sh.branch_id
+                ) d
+                WHERE br.id = d.branch_id AND (d.copias <> 0 OR d.prestamos <> 0);
+            $$ LANGUAGE sql;
+
+            CREATE OR REPLACE FUNCTION sucursal_sumar_prestamos(
+                p_nuevos biblioteca_loan[], p_viejos biblioteca_loan[]
+            ) RETURNS void AS $$
+                UPDATE biblioteca_branch br
+                SET total_loans = br.total_loans + d.prestamos
+                FROM (
+                    SELECT sh.branch_id, SUM(l.signo) AS prestamos
+                    FROM (
+                        SELECT l.copy_id, 1 AS signo FROM unnest(p_nuevos) l
+                        UNION ALL
+                        SELECT l.copy_id, -1 FROM unnest(p_viejos) l
+                    ) l
+                    JOIN biblioteca_copy co ON co.id = l.copy_id
+                    JOIN biblioteca_shelf sh ON sh.id = co.shelf_id
+                    GROUP BY sh.branch_id
+                    HAVING SUM(l.signo) <> 0
+                ) d
+                WHERE br.id = d.branch_id;
+            $$ LANGUAGE sql;
+
+            -- Un estante que cambia de sucursal (poco frecuente): se recuentan
+            -- las dos sucursales
+            CREATE OR REPLACE FUNCTION sucursal_recontar(p_sucursales BIGINT[])
+            RETURNS void AS $$
+                UPDATE biblioteca_branch br
+                SET total_copies = (
+                        SELECT COUNT(*) FROM biblioteca_shelf sh
+                        JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                        WHERE sh.branch_id = br.id),
+                    total_loans = (
+                        SELECT COUNT(*) FROM biblioteca_shelf sh
+                        JOIN biblioteca_copy co ON co.shelf_id = sh.id
+                        JOIN biblioteca_loan lo ON lo.copy_id = co.id
+                        WHERE sh.branch_id = br.id)
+                WHERE br.id = ANY(p_sucursales);
+            $$ LANGUAGE sql;
+
+            CREATE OR REPLACE FUNCTION trg_sucursal_contadores() RETURNS trigger AS $$
+            BEGIN
+                IF TG_TABLE_NAME = 'biblioteca_copy' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM sucursal_sumar_copias(
+                            ARRAY(SELECT nu::biblioteca_copy FROM nuevas nu), '{}');
+                    ELSIF TG_OP = 'UPDATE' THEN
+                        PERFORM sucursal_sumar_copias(
+                            ARRAY(SELECT nu::biblioteca_copy FROM nuevas nu),
+                            ARRAY(SELECT v::biblioteca_copy FROM viejas v));
+                    ELSE
+                        PERFORM sucursal_sumar_copias(
+                            '{}', ARRAY(SELECT v::biblioteca_copy FROM viejas v));
+                    END IF;
+                ELSIF TG_TABLE_NAME = 'biblioteca_loan' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM sucursal_sumar_prestamos(
+                            ARRAY(SELECT nu::biblioteca_loan FROM nuevas nu), '{}');
+                    ELSIF TG_OP = 'UPDATE' THEN
+                        -- Solo cuentan los que cambian de copia (no las devoluciones)
+                        PERFORM sucursal_sumar_prestamos(
+                            ARRAY(SELECT nu::biblioteca_loan FROM nuevas nu
+                                  LEFT JOIN viejas v ON v.id = nu.id
+                                  WHERE nu.copy_id IS DISTINCT FROM v.copy_id),
+                            ARRAY(SELECT v::biblioteca_loan FROM viejas v
+                                  LEFT JOIN nuevas nu ON nu.id = v.id
+                                  WHERE nu.copy_id IS DISTINCT FROM v.copy_id));
+                    ELSE
+                        PERFORM sucursal_sumar_prestamos(
+                            '{}', ARRAY(SELECT v::biblioteca_loan FROM viejas v));
+                    END IF;
+                ELSE
+                    PERFORM sucursal_recontar(ARRAY(
+                        SELECT unnest(ARRAY[v.branch_id, nu.branch_id])
+                        FROM nuevas nu JOIN viejas v ON v.id = nu.id
+                        WHERE nu.branch_id <> v.branch_id));
+                END IF;
+                RETURN NULL;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_copy_sucursal_ins AFTER INSERT ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_copy_sucursal_upd AFTER UPDATE ON biblioteca_copy
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_copy_sucursal_del AFTER DELETE ON biblioteca_copy
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_loan_sucursal_ins AFTER INSERT ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_loan_sucursal_upd AFTER UPDATE ON biblioteca_loan
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_loan_sucursal_del AFTER DELETE ON biblioteca_loan
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+            CREATE TRIGGER trg_shelf_sucursal_upd AFTER UPDATE ON biblioteca_shelf
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION trg_sucursal_contadores();
+
+            -- Como los del libro (0008): solo los cambian los triggers, un
+            -- UPDATE del formulario con valores viejos no los pisa
+            CREATE OR REPLACE FUNCTION trg_branch_contadores_guard() RETURNS trigger AS $$
+            BEGIN
+                IF pg_trigger_depth() = 1
+                   AND current_setting('biblioteca.reparar_contadores', true)
+                       IS DISTINCT FROM 'on' THEN
+                    IF TG_OP = 'INSERT' THEN
+                        NEW.total_copies := 0;
+                        NEW.total_loans := 0;
+                    ELSE
+                        NEW.total_copies := OLD.total_copies;
+                        NEW.total_loans := OLD.total_loans;
+                    END IF;
+                END IF;
+                RETURN NEW;
+            END;$$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER trg_branch_contadores_guard
+            BEFORE INSERT OR UPDATE ON biblioteca_branch
+            FOR EACH ROW EXECUTE FUNCTION trg_branch_contadores_guard();
+            """ + ACTIVIDAD_SUCURSAL.format(copias_y_prestamos=COPIAS_Y_PRESTAMOS),
+            reverse_sql=ACTIVIDAD_SUCURSAL.format(copias_y_prestamos=COPIAS_Y_PRESTAMOS_0015) + """
+            DROP TRIGGER IF EXISTS trg_branch_contadores_guard ON biblioteca_branch;
+            DROP FUNCTION IF EXISTS trg_branch_contadores_guard();
+            DROP TRIGGER IF EXISTS trg_shelf_sucursal_upd ON biblioteca_shelf;
+            DROP TRIGGER IF EXISTS trg_loan_sucursal_del ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_sucursal_upd ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_loan_sucursal_ins ON biblioteca_loan;
+            DROP TRIGGER IF EXISTS trg_copy_sucursal_del ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_copy_sucursal_upd ON biblioteca_copy;
+            DROP TRIGGER IF EXISTS trg_copy_sucursal_ins ON biblioteca_copy;
+            DROP FUNCTION IF EXISTS trg_sucursal_contadores();
+            DROP FUNCTION IF EXISTS sucursal_recontar(BIGINT[]);
+            DROP FUNCTION IF EXISTS sucursal_sumar_prestamos(biblioteca_loan[], biblioteca_loan[]);
+            DROP FUNCTION IF EXISTS sucursal_sumar_copias(biblioteca_copy[], biblioteca_copy[]);
+            DROP INDEX IF EXISTS loan_abiertos_copy_idx;
+            """,
+        ),
+    ]
@@ -1,6 +1,10 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (
     MinValueValidator,
     MaxValueValidator,
@@ -8,7 +12,9 @@ from django.core.validators import (
     EmailValidator,
     ValidationError,
 )
+from django.db.models.functions import Cast, NullIf, Round, Upper
 from django.utils import timezone
+from django.conf import settings
 
 ############################
 #  Personalised PG types   #
@@ -25,54 +31,65 @@ class BookConditionField(models.Field):
     def db_type(self, connection):
         return "book_condition"
 
-    def from_db_value(self, value, expression, connection):
-        return value
+    # Sin from_db_value: el driver ya entrega el ENUM como str y así Django no
+    # añade un conversor por fila.
+
+from . import adapters
+from .adapters import Money
 
-    def get_prep_value(self, value):
-        return value
 
-from decimal import Decimal
-import re
 class MoneyField(models.Field):
-    """Mapea el tipo compuesto `money (amount numeric, currency char(3))`."""
+    """Mapea la columna `money` como `Money(amount: Decimal, currency)`.
+
+    `money` resuelve a `pg_catalog.money`; el driver la convierte al leer
+    (`biblioteca/adapters.py`), así que no hay conversión por fila. Se
+    escribe la cantidad como texto, que PostgreSQL convierte a `money`.
+    """
 
-    description = "Composite money"
+    description = "PostgreSQL money"
 
     def db_type(self, connection):
         return "money"
 
-    def from_db_value(self, value, expression, connection):
-        if value is None:
-            return None
-        #print(type(value), value)
-        if isinstance(value, (list, tuple)) and len(value) == 2:
-            amount, currency = value
-        if isinstance(value, str) and not ("," in value and "(" in value):
-            # Extraemos número (quitamos símbolo y comas de miles)
-            amount_text = re.sub(r"[^\d\.\-]", "", value)
-            amount = Decimal(amount_text)
-            # Puedes ajustar esto si manejas varias monedas
-            return {"amount": amount, "currency": "USD"}
-        else:
-            text = str(value).strip("(){} ")
-            amount, currency = text.split(",")
-        return {"amount": amount, "currency": currency}
+    def get_db_converters(self, connection):
+        convertidores = super().get_db_converters(connection)
+        if not adapters.money_registrado():
+            convertidores.append(self.desde_texto)
+        return convertidores
+
+    def desde_texto(self, value, expression, connection):
+        if value is None or isinstance(value, Money):
+            return value
+        return adapters.money_desde_texto(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Money):
+            return value
+        if isinstance(value, dict):
+            return Money(Decimal(str(value["amount"])),
+                         value.get("currency") or adapters.moneda_por_defecto())
+        if isinstance(value, (Decimal, int, float)):
+            return Money(Decimal(str(value)), adapters.moneda_por_defecto())
+        try:
+            return adapters.money_desde_texto(str(value))
+        except ArithmeticError:
+            raise ValidationError(f"'{value}' no es un importe válido.", code="invalid")
 
     def get_prep_value(self, value):
+        value = self.to_python(super().get_prep_value(value))
         if value is None:
             return None
-        # Espera un dict {"amount": ..., "currency": ...}
-        return f"({value['amount']},{value['currency']})"
+        return format(value.amount, "f")
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return "" if value is None else str(self.to_python(value))
 
 class RatingScaleField(models.Field):
     """Mapea el ENUM PostgreSQL `rating_scale`."""
     description = "PostgreSQL ENUM rating_scale"
     def db_type(self, connection):
         return "rating_scale"
-    def from_db_value(self, value, expression, connection):
-        return value
-    def get_prep_value(self, value):
-        return value
 
 ############################
 #        Usuarios          #
@@ -175,6 +192,10 @@ class Branch(models.Model):
     address = models.CharField(max_length=255)
     phone = models.CharField(max_length=25, validators=[RegexValidator(r"^\+?[0-9\- ]+$")])
     created_at = models.DateTimeField(auto_now_add=True)
+    # Copias en sus estantes y préstamos de esas copias, mantenidos por triggers
+    # (migración 0021); verificar/reparar con `manage.py reparar_contadores`.
+    total_copies = models.PositiveIntegerField(db_default=0, editable=False)
+    total_loans = models.PositiveIntegerField(db_default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -207,6 +228,16 @@ class Author(models.Model):
     class Meta:
         unique_together = ("first_name", "last_name", "birth_year")
         ordering = ["last_name", "first_name"]
+        indexes = [
+            # autocomplete.py: prefijo sin distinguir mayúsculas (`istartswith`)
+            models.Index(OpClass(Upper("last_name"), name="text_pattern_ops"),
+                         name="author_apellido_prefijo_idx"),
+            models.Index(OpClass(Upper("first_name"), name="text_pattern_ops"),
+                         name="author_nombre_prefijo_idx"),
+            # Orden de autocomplete.py: la primera página sin término sale del índice
+            models.Index(Upper("last_name"), Upper("first_name"), models.F("id"),
+                         name="author_orden_idx"),
+        ]
 
     def __str__(self):
         return f"{self.last_name}, {self.first_name}"
@@ -239,16 +270,68 @@ class Book(models.Model):
     condition = BookConditionField(default="good")  # enum personalizado
     page_count = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Contadores mantenidos por triggers sobre biblioteca_copy (migración 0008);
+    # verificar/reparar con `manage.py reparar_contadores`.
+    total_copies = models.PositiveIntegerField(db_default=0, editable=False)
+    available_copies = models.PositiveIntegerField(db_default=0, editable=False)
+    # Suma (poor=1 … excellent=4) y número de reseñas, mantenidos por triggers
+    # sobre biblioteca_review (migración 0018)
+    rating_sum = models.PositiveIntegerField(db_default=0, editable=False)
+    rating_count = models.PositiveIntegerField(db_default=0, editable=False)
+    rating_avg = models.GeneratedField(
+        expression=Round(
+            Cast("rating_sum", models.DecimalField(max_digits=12, decimal_places=2))
+            / NullIf("rating_count", 0),
+            2,
+        ),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+        db_persist=True,
+    )
 
     class Meta:
-        indexes = [models.Index(fields=["title"])]
+        indexes = [
+            models.Index(fields=["title"]),
+            # Mejor valorados (`/catalogo/mejor-valorados/`)
+            models.Index(
+                fields=["-rating_avg", "-rating_count", "isbn"],
+                condition=models.Q(rating_count__gt=0),
+                name="book_mejor_valorado_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
     @property
-    def total_available(self):  # atributo derivado
-        return self.copies.filter(is_available=True).count()
+    def total_available(self):  # atributo derivado (contador)
+        return self.available_copies
+
+class BookSearch(models.Model):
+    """Documento de búsqueda (título, autores y géneros) de cada libro.
+
+    Lo mantienen los triggers de la migración 0007; Django solo lo lee.
+    """
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, primary_key=True, related_name="search"
+    )
+    search_vector = SearchVectorField(null=True)
+
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"], name="booksearch_vector_gin")]
+
+class BookRecommendation(models.Model):
+    """Los libros más prestados junto con `book` (mismos lectores), de mayor
+    a menor similitud: `related[i]` con puntuación `scores[i]`.
+
+    Los calcula fuera de línea `manage.py calcular_recomendaciones`; se leen
+    con una búsqueda por clave primaria.
+    """
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, primary_key=True, related_name="recomendacion"
+    )
+    related = ArrayField(models.CharField(max_length=13))
+    scores = ArrayField(models.FloatField())
+    computed_at = models.DateTimeField()
 
 class BookAuthor(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -270,10 +353,22 @@ class Copy(models.Model):
     inventory_code = models.CharField(max_length=30, unique=True)
     is_available = models.BooleanField(default=True)
     acquired_at = models.DateField(default=timezone.now)
-    price = MoneyField()  # composite type
+    price = MoneyField()
 
     class Meta:
         ordering = ["inventory_code"]
+        indexes = [
+            # checkout.claim_copy: primera copia disponible de un título
+            models.Index(
+                fields=["book", "id"], condition=models.Q(is_available=True),
+                name="copy_disponible_idx",
+            ),
+            # actividad_sucursal: copias prestadas de cada estante
+            models.Index(
+                fields=["shelf"], condition=models.Q(is_available=False),
+                name="copy_prestada_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.inventory_code
@@ -283,6 +378,9 @@ class Copy(models.Model):
 ############################
 
 class Loan(models.Model):
+    """Préstamo actual. `biblioteca_loan` está particionada por año de
+    `loaned_at` (clave primaria `(id, loaned_at)` en la base); los años cerrados
+    se mueven a `LoanArchive`."""
     copy = models.ForeignKey(Copy, on_delete=models.PROTECT)
     user = models.ForeignKey(LibraryUser, on_delete=models.PROTECT)
     loaned_at = models.DateTimeField(auto_now_add=True)
@@ -305,6 +403,23 @@ class Loan(models.Model):
             if self.due_date <= timezone.now().date():
                 raise ValidationError("La fecha de devolución debe ser posterior a la fecha del préstamo.")
 
+class LoanArchive(models.Model):
+    """Préstamos cerrados de años archivados (`manage.py archivar_prestamos`).
+
+    Tabla fría de solo lectura fuera de `biblioteca_loan`; la vista
+    `biblioteca_loan_historial` une ambas.
+    """
+    copy = models.ForeignKey(Copy, on_delete=models.DO_NOTHING, db_constraint=False)
+    user = models.ForeignKey(LibraryUser, on_delete=models.DO_NOTHING, db_constraint=False)
+    loaned_at = models.DateTimeField()
+    due_date = models.DateField()
+    returned_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = "biblioteca_loan_archivo"
+        ordering = ["-loaned_at"]
+
 class Reservation(models.Model):
     copy = models.ForeignKey(Copy, on_delete=models.PROTECT)
     user = models.ForeignKey(LibraryUser, on_delete=models.PROTECT)
@@ -315,11 +430,33 @@ class Reservation(models.Model):
         unique_together = ("copy", "user")
 
 class Fine(models.Model):
-    loan = models.OneToOneField(Loan, on_delete=models.CASCADE)
+    # Sin FK en la base: biblioteca_loan está particionada; la integridad
+    # (contra préstamos actuales o archivados) la comprueban triggers diferidos.
+    loan = models.OneToOneField(Loan, on_delete=models.CASCADE, db_constraint=False)
     amount = models.DecimalField(max_digits=8, decimal_places=2, validators=[MinValueValidator(0.01)])
     created_at = models.DateTimeField(auto_now_add=True)
     paid = models.BooleanField(default=False)
 
+class CirculationDaily(models.Model):
+    """Resumen de circulación por día (UTC), sucursal y libro.
+
+    Lo mantienen triggers sobre `biblioteca_loan` y `biblioteca_fine`
+    (migración 0016) y se recalcula con `manage.py rellenar_circulacion`.
+    `overdue` cuenta los préstamos cuyo primer día de retraso es `day`.
+    """
+    day = models.DateField()
+    branch = models.ForeignKey(Branch, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False)
+    loans_opened = models.IntegerField(default=0)
+    loans_returned = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+    fines_issued = models.IntegerField(default=0)
+    fine_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        managed = False
+        db_table = "circulation_daily"
+
 ############################
 #      Pagos & Métodos     #
 ############################
@@ -371,9 +508,16 @@ class Review(models.Model):
     rating = RatingScaleField(default='average')
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Votos de ReviewVote y cota inferior de Wilson (95 %) de la proporción de
+    # votos útiles, mantenidos por triggers (migración 0018)
+    upvotes = models.PositiveIntegerField(db_default=0, editable=False)
+    downvotes = models.PositiveIntegerField(db_default=0, editable=False)
+    helpfulness = models.FloatField(db_default=0, editable=False)
 
     class Meta:
         unique_together = ("book", "user")
+        # Reseñas más útiles de un libro (`/catalogo/<isbn>/resenas/`)
+        indexes = [models.Index(fields=["book", "-helpfulness", "id"], name="review_util_idx")]
 
 class ReviewVote(models.Model):
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name="votes")
@@ -388,17 +532,34 @@ class ReviewVote(models.Model):
 ############################
 
 class AuditLog(models.Model):
+    """Auditoría de cambios, particionada por mes en `changed_at`.
+
+    En la base la clave primaria es `(id, changed_at)` (migración 0011);
+    `id` sigue siendo único. Particiones y retención:
+    `manage.py particiones_auditlog`.
+    """
     table_name = models.CharField(max_length=60)
     record_id = models.CharField(max_length=50)
     op = models.CharField(max_length=8)
     changed_at = models.DateTimeField(auto_now_add=True)
     change_user = models.CharField(max_length=150)
 
+    class Meta:
+        indexes = [
+            BrinIndex(fields=["changed_at"], name="auditlog_changed_brin"),
+            models.Index(fields=["table_name", "record_id"], name="auditlog_registro_idx"),
+        ]
+
 ############################
 #          Vistas          #
 ############################
 class CatalogoLibros(models.Model):
-    """Vista para el catálogo completo de libros"""
+    """Vista para el catálogo completo de libros.
+
+    Con ``settings.CATALOGO_MATERIALIZADO`` activo lee de la tabla
+    ``mv_catalogo_libros`` (refrescada por ISBN desde triggers); si no,
+    de la vista ``vista_catalogo_libros`` calculada en vivo.
+    """
     isbn = models.CharField(max_length=13, primary_key=True)
     title = models.CharField(max_length=255)
     autor_principal = models.CharField(max_length=161)
@@ -416,13 +577,17 @@ class CatalogoLibros(models.Model):
 
     class Meta:
         managed = False  # Django no manejará esta tabla
-        db_table = 'vista_catalogo_libros'
+        db_table = (
+            'mv_catalogo_libros'
+            if getattr(settings, 'CATALOGO_MATERIALIZADO', True)
+            else 'vista_catalogo_libros'
+        )
         ordering = ['title']
 
     def __str__(self):
         return self.title
 
-class PrestamosUsuarios(models.Model):
+class PrestamosUsuariosBase(models.Model):
     """Vista para el estado de préstamos por usuario"""
     usuario_id = models.BigIntegerField(primary_key=True)
     username = models.CharField(max_length=150)
@@ -443,14 +608,25 @@ class PrestamosUsuarios(models.Model):
     estado_prestamos = models.CharField(max_length=20)
 
     class Meta:
-        managed = False
-        db_table = 'vista_prestamos_usuarios'
+        abstract = True
         ordering = ['username']
 
     def __str__(self):
         return self.username
 
-class ActividadSucursales(models.Model):
+class PrestamosUsuarios(PrestamosUsuariosBase):
+    """Préstamos actuales (sin el archivo)"""
+    class Meta(PrestamosUsuariosBase.Meta):
+        managed = False
+        db_table = 'vista_prestamos_usuarios'
+
+class PrestamosUsuariosHistorico(PrestamosUsuariosBase):
+    """Igual que PrestamosUsuarios, incluyendo los préstamos archivados"""
+    class Meta(PrestamosUsuariosBase.Meta):
+        managed = False
+        db_table = 'vista_prestamos_usuarios_historico'
+
+class ActividadSucursalesBase(models.Model):
     """Vista para la actividad de las sucursales"""
     sucursal_id = models.BigIntegerField(primary_key=True)
     nombre_sucursal = models.CharField(max_length=120)
@@ -472,9 +648,20 @@ class ActividadSucursales(models.Model):
     nivel_actividad = models.CharField(max_length=20)
 
     class Meta:
-        managed = False
-        db_table = 'vista_actividad_sucursales'
+        abstract = True
         ordering = ['nombre_sucursal']
 
     def __str__(self):
-        return self.nombre_sucursal
\ No newline at end of file
+        return self.nombre_sucursal
+
+class ActividadSucursales(ActividadSucursalesBase):
+    """Préstamos actuales (sin el archivo)"""
+    class Meta(ActividadSucursalesBase.Meta):
+        managed = False
+        db_table = 'vista_actividad_sucursales'
+
+class ActividadSucursalesHistorico(ActividadSucursalesBase):
+    """Igual que ActividadSucursales, incluyendo los préstamos archivados"""
+    class Meta(ActividadSucursalesBase.Meta):
+        managed = False
+        db_table = 'vista_actividad_sucursales_historico'
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""Paginación por clave (keyset) para listados y reportes.
+
+En lugar de `OFFSET` + `COUNT(*)` cada página se pide como "las siguientes N
+filas después de (título, isbn)", de modo que la página 2.000 cuesta lo mismo
+que la primera. El total, cuando se muestra, puede ser exacto o estimado a
+partir de las estadísticas del planificador.
+"""
+import base64
+import json
+from functools import cached_property
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise Http404("Cursor de paginación inválido.")
+    if not isinstance(values, list) or len(values) != size:
+        raise Http404("Cursor de paginación inválido.")
+    return values
+
+
+def keyset_filter(fields, values, reverse=False):
+    """`(f1, f2, ...) > (v1, v2, ...)` expresado como Q.
+
+    Se añade `f1 >= v1` (o `<=`) para que el índice sobre la primera clave
+    acote el rango aunque el resto sea un OR.
+    """
+    op = "lt" if reverse else "gt"
+    cond = Q()
+    for i, field in enumerate(fields):
+        eq = {fields[j]: values[j] for j in range(i)}
+        cond |= Q(**eq, **{f"{field}__{op}": values[i]})
+    first = {f"{fields[0]}__{op}e": values[0]}
+    return Q(**first) & cond
+
+
+def estimated_count(queryset):
+    """Filas que el planificador espera para `queryset` (EXPLAIN, sin ejecutarla)."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as c:
+        c.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = c.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class KeysetPage:
+    """Página compatible con lo que las plantillas usan de `page_obj`."""
+
+    def __init__(self, object_list, fields, queryset, has_next, has_previous,
+                 count_mode, count=None):
+        self.object_list = object_list
+        self.fields = fields
+        self.queryset = queryset
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.count_mode = count_mode
+        self.count_known = count is not None
+        if self.count_known:
+            self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def _cursor(self, obj):
+        # Objetos o diccionarios (`values()` de un reporte agregado)
+        if isinstance(obj, dict):
+            return encode_cursor(obj[f] for f in self.fields)
+        return encode_cursor(getattr(obj, f) for f in self.fields)
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.object_list[-1]) if self.object_list else ""
+
+    @property
+    def previous_cursor(self):
+        return self._cursor(self.object_list[0]) if self.object_list else ""
+
+    @property
+    def count_estimated(self):
+        return self.count_mode == "estimado" and not self.count_known
+
+    @cached_property
+    def count(self):
+        """Total de filas; se calcula solo si la plantilla lo pide."""
+        if self.count_estimated:
+            return estimated_count(self.queryset)
+        return self.queryset.count()
+
+
+class KeysetPaginationMixin:
+    """Sustituye la paginación por `?page=` de `ListView` por `?after=`/`?before=`.
+
+    `keyset_fields` debe terminar en una columna única (la PK) para que el
+    orden sea total.
+    """
+    keyset_fields = ()
+    count_mode = None  # "exacto" | "estimado"; por defecto settings.REPORTES_CONTEO
+
+    def get_count_mode(self):
+        return self.count_mode or getattr(settings, "REPORTES_CONTEO", "exacto")
+
+    def get_keyset_cursor(self):
+        """Devuelve `(valores, reverse)` según `?after=`/`?before=`."""
+        params = self.request.GET
+        size = len(self.keyset_fields)
+        if params.get("before"):
+            return decode_cursor(params["before"], size), True
+        if params.get("after"):
+            return decode_cursor(params["after"], size), False
+        return None, False
+
+    def build_page(self, rows, queryset, page_size, values, reverse, count=None):
+        """Arma la página a partir de hasta `page_size + 1` filas ya ordenadas
+        en el sentido del cursor."""
+        if reverse:
+            has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next = True
+        else:
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_previous = values is not None
+        return KeysetPage(
+            rows, list(self.keyset_fields), queryset, has_next, has_previous,
+            self.get_count_mode(), count,
+        )
+
+    def keyset_queryset(self, queryset, page_size, values, reverse):
+        """Hasta `page_size + 1` filas tras el cursor, en su sentido."""
+        fields = list(self.keyset_fields)
+        qs = queryset
+        if values is not None:
+            qs = qs.filter(keyset_filter(fields, values, reverse=reverse))
+        order = [f"-{f}" for f in fields] if reverse else fields
+        return qs.order_by(*order)[:page_size + 1]
+
+    def paginate_queryset(self, queryset, page_size):
+        values, reverse = self.get_keyset_cursor()
+        rows = list(self.keyset_queryset(queryset, page_size, values, reverse))
+
+        page = self.build_page(rows, queryset, page_size, values, reverse)
+        return (None, page, page.object_list, page.has_other_pages())
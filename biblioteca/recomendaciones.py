@@ -0,0 +1,23 @@
+"""«Los lectores también pidieron»: lectura de `BookRecommendation`.
+
+Las recomendaciones se calculan fuera de línea (`manage.py
+calcular_recomendaciones`); aquí solo se lee la fila del libro por su clave
+primaria y se despliegan sus arrays con los títulos, en una consulta.
+"""
+from .models import Book
+
+SQL = """
+    SELECT b.isbn, b.title, r.score
+    FROM biblioteca_bookrecommendation rec
+    CROSS JOIN LATERAL unnest(rec.related, rec.scores) WITH ORDINALITY AS r(isbn, score, pos)
+    JOIN biblioteca_book b ON b.isbn = r.isbn
+    WHERE rec.book_id = %s
+    ORDER BY r.pos
+    LIMIT %s
+"""
+
+
+def tambien_prestados(isbn, limite=10):
+    """Libros (`isbn`, `title` y `score`) prestados junto con `isbn`, de más a
+    menos parecido. Vacío si no hay recomendaciones calculadas."""
+    return list(Book.objects.raw(SQL, [isbn, limite]))
@@ -0,0 +1,131 @@
+"""Caché de las respuestas de reporte con invalidación por familia.
+
+Cada respuesta se guarda bajo `reportes:<familia>:<generación>:<querystring>`.
+Los triggers de la base de datos emiten `pg_notify('reportes_cambios', ...)`
+con las familias afectadas y `manage.py escuchar_reportes` incrementa la
+generación de esas familias, con lo que sus entradas dejan de usarse (y
+caducan solas) sin tocar las de las demás.
+
+Las generaciones viven en otra caché (`settings.REPORTES_GENERACIONES_CACHE`)
+que no se llena: en la de páginas el borrado de entradas sobrantes podría
+llevárselas y devolver la familia a una generación ya usada.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from . import routers
+
+CHANNEL = "reportes_cambios"
+FAMILIAS = ("catalogo", "prestamos", "sucursales")
+
+# Parámetros que no cambian el contenido de la página
+IGNORADOS = {"csrfmiddlewaretoken"}
+
+
+def get_cache():
+    return caches[getattr(settings, "REPORTES_CACHE", "default")]
+
+
+def get_generaciones_cache():
+    return caches[getattr(settings, "REPORTES_GENERACIONES_CACHE", "default")]
+
+
+def _gen_key(familia):
+    return f"reportes:gen:{familia}"
+
+
+def generation(familia):
+    return get_generaciones_cache().get(_gen_key(familia), 0)
+
+
+def normalize_querystring(params):
+    """Querystring canónico: claves ordenadas y sin valores vacíos."""
+    items = sorted(
+        (k, v)
+        for k in params
+        if k not in IGNORADOS
+        for v in params.getlist(k)
+        if v != ""
+    )
+    return urlencode(items)
+
+
+def report_cache_key(familia, params):
+    qs = normalize_querystring(params)
+    digest = hashlib.sha1(qs.encode()).hexdigest()
+    return f"reportes:{familia}:{generation(familia)}:{digest}"
+
+
+def cache_timeout():
+    """Segundos que se guarda la página recién generada.
+
+    Si se leyó de la réplica puede ir hasta `REPLICA_RETRASO_MAX` segundos por
+    detrás de la invalidación que provocó el fallo: se guarda solo ese tiempo
+    para que no sobreviva a la siguiente página ya al día.
+    """
+    timeout = getattr(settings, "REPORTES_CACHE_TIMEOUT", 300)
+    estado = routers.estado_actual()
+    if estado is not None and estado.replica:
+        timeout = min(timeout, getattr(settings, "REPLICA_RETRASO_MAX", 10))
+    return timeout
+
+
+def invalidate(familias):
+    """Pasa a la siguiente generación las familias indicadas."""
+    cache = get_generaciones_cache()
+    for familia in familias:
+        if familia not in FAMILIAS:
+            continue
+        key = _gen_key(familia)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+class ReportCacheMixin:
+    """Sirve las páginas de reporte (HTML con sus gráficos) desde la caché.
+
+    La exportación CSV no se cachea: va en streaming.
+    """
+    cache_family = None
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("export") == "csv":
+            return super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = report_cache_key(self.cache_family, request.GET)
+        response = cache.get(key)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if hasattr(response, "render"):
+                response.render()
+            if response.status_code == 200:
+                cache.set(key, response, cache_timeout())
+        return response
+
+
+class AsyncReportCacheMixin:
+    """`ReportCacheMixin` para vistas asíncronas (`async def get`)."""
+    cache_family = None
+
+    async def get(self, request, *args, **kwargs):
+        if request.GET.get("export") == "csv":
+            return await super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        # La generación se lee de la caché (en la base): fuera del bucle
+        key = await sync_to_async(report_cache_key)(self.cache_family, request.GET)
+        response = await cache.aget(key)
+        if response is None:
+            response = await super().get(request, *args, **kwargs)
+            if hasattr(response, "render"):
+                await sync_to_async(response.render)()
+            if response.status_code == 200:
+                await cache.aset(key, response, cache_timeout())
+        return response
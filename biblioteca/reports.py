@@ -0,0 +1,105 @@
+"""Página, total y series de gráficos de un reporte en una sola consulta.
+
+La vista filtrada se materializa una vez en un CTE; sobre él se calculan
+todas las series con `GROUPING SETS` (el conjunto vacío da el total) y la
+página por cursor. Antes cada carga evaluaba la vista agregada 4 o 5 veces.
+"""
+import json
+
+from django.db import connections
+
+from .pagination import KeysetPaginationMixin
+
+
+class SinglePassReportMixin(KeysetPaginationMixin):
+    """`chart_series` mapea nombre de serie -> expresión SQL sobre las columnas
+    de la vista. Tras paginar, `self.chart_data[nombre]` es una lista de
+    `(clave, total)` en el orden de la clave.
+    """
+    chart_series = {}
+
+    def series_select(self, source):
+        """SELECT de una fila `series` (JSON) con todas las series y el total
+        sobre la relación `source`."""
+        exprs = list(self.chart_series.values())
+        keys = [f"k{i}" for i in range(len(exprs))]
+        grouping = ", ".join(exprs)
+        select_keys = ", ".join(f"{e} AS {k}" for e, k in zip(exprs, keys))
+        sets = ", ".join(f"({e})" for e in exprs)
+        return f"""
+                SELECT json_agg(json_build_array(g, {', '.join(keys)}, n)
+                                ORDER BY g, {', '.join(keys)}) AS series
+                FROM (
+                    SELECT GROUPING({grouping}) AS g, {select_keys}, COUNT(*) AS n
+                    FROM {source}
+                    GROUP BY GROUPING SETS ({sets}, ())
+                ) s"""
+
+    def series_sql(self, queryset):
+        """Solo las series, sin la página (para lanzarlas en otra conexión)."""
+        base_sql, params = queryset.order_by().query.sql_with_params()
+        return f"WITH f AS ({base_sql}) {self.series_select('f')}", params
+
+    def read_series(self, queryset):
+        sql, params = self.series_sql(queryset)
+        with connections[queryset.db].cursor() as c:
+            c.execute(sql, params)
+            return c.fetchone()[0]
+
+    def single_pass_sql(self, queryset, page_size, values, reverse):
+        meta = queryset.model._meta
+        qn = connections[queryset.db].ops.quote_name
+        cols = [qn(meta.get_field(f).column) for f in self.keyset_fields]
+        base_sql, params = queryset.order_by().query.sql_with_params()
+        params = list(params)
+
+        where = ""
+        if values is not None:
+            op = "<" if reverse else ">"
+            marks = ", ".join(["%s"] * len(cols))
+            where = f"WHERE ({', '.join(cols)}) {op} ({marks})"
+            params += values
+        direction = "DESC" if reverse else "ASC"
+        order = ", ".join(f"{c} {direction}" for c in cols)
+        order_p = ", ".join(f"p.{c} {direction}" for c in cols)
+        params.append(page_size + 1)
+
+        sql = f"""
+            WITH f AS MATERIALIZED ({base_sql}),
+            agg AS ({self.series_select("f")}
+            ),
+            p AS (SELECT * FROM f {where} ORDER BY {order} LIMIT %s)
+            SELECT p.*, agg.series AS chart_series_json
+            FROM agg LEFT JOIN p ON true
+            ORDER BY {order_p}
+        """
+        return sql, params
+
+    def parse_series(self, raw):
+        if isinstance(raw, str):
+            raw = json.loads(raw)
+        names = list(self.chart_series)
+        full = (1 << len(names)) - 1
+        # GROUPING() pone a 1 el bit de cada expresión que NO agrupa el conjunto
+        bit_of = {full ^ (1 << (len(names) - 1 - i)): i for i in range(len(names))}
+        series = {name: [] for name in names}
+        total = 0
+        for g, *claves, n in raw or []:
+            if g == full:
+                total = n
+            else:
+                i = bit_of[g]
+                series[names[i]].append((claves[i], n))
+        return series, total
+
+    def paginate_queryset(self, queryset, page_size):
+        values, reverse = self.get_keyset_cursor()
+        sql, params = self.single_pass_sql(queryset, page_size, values, reverse)
+        rows = list(queryset.model.objects.raw(sql, params).using(queryset.db))
+
+        raw_series = rows[0].chart_series_json if rows else None
+        self.chart_data, total = self.parse_series(raw_series)
+        rows = [r for r in rows if r.pk is not None]
+
+        page = self.build_page(rows, queryset, page_size, values, reverse, count=total)
+        return (None, page, page.object_list, page.has_other_pages())
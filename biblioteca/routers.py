@@ -0,0 +1,153 @@
+"""Lecturas de reportes en una réplica.
+
+`ReplicaRouter` manda a la réplica (`REPLICA_ALIAS`, si existe en
+`DATABASES`) las lecturas de:
+
+- los modelos no gestionados (las vistas de reporte, `mv_catalogo_libros`,
+  el archivo de préstamos), también desde los changelists del admin;
+- cualquier modelo de `biblioteca` en los GET de las vistas con
+  `usar_replica = True` (los reportes).
+
+Solo dentro de una petición (`ReplicaLecturaMiddleware` fija el estado):
+comandos y shell leen siempre de la primaria. Van a la primaria además:
+
+- las peticiones que no son GET/HEAD/OPTIONS;
+- durante `REPLICA_FIJAR_PRIMARIA` segundos tras una escritura, el navegador
+  que la hizo (cookie), para que vea sus propios cambios;
+- las lecturas de una petición posteriores a una escritura;
+- todo, si la réplica no responde o su retraso supera `REPLICA_RETRASO_MAX`
+  segundos. Se comprueba como mucho cada `REPLICA_COMPROBAR_CADA` segundos
+  por proceso, y nunca desde el bucle de eventos (vistas asíncronas): ahí se
+  usa el último estado conocido.
+
+`EstadoPeticion.replica` queda marcado si alguna lectura fue a la réplica: la
+caché de reportes guarda esas páginas como mucho `REPLICA_RETRASO_MAX`
+segundos, porque pueden ser anteriores a la última invalidación.
+
+Los modelos de otras aplicaciones (sesiones, usuarios del admin, la caché de
+reportes en base de datos) no pasan nunca por la réplica: una sesión recién
+creada o una generación de caché recién invalidada podrían no haber llegado.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+COOKIE = "usar_primaria"
+
+_estado = contextvars.ContextVar("replica_estado", default=None)
+# alias -> (instante de la comprobación, disponible)
+_salud = {}
+
+
+@dataclass
+class EstadoPeticion:
+    primaria: bool = False   # la petición no lee de la réplica
+    reporte: bool = False    # vista con `usar_replica`
+    escrito: bool = False    # ha escrito en algún modelo de la aplicación
+    replica: bool = False    # alguna lectura ha ido a la réplica
+
+
+def activar(estado):
+    return _estado.set(estado)
+
+
+def desactivar(token):
+    _estado.reset(token)
+
+
+def estado_actual():
+    return _estado.get()
+
+
+def replica_alias():
+    alias = getattr(settings, "REPLICA_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+def retraso(alias):
+    """Segundos de retraso de la réplica; 0 si está al día o si no es una
+    réplica en recuperación, None si no se puede saber."""
+    with connections[alias].cursor() as c:
+        c.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery()
+                  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+            END
+        """)
+        return c.fetchone()[0]
+
+
+def _en_bucle_de_eventos():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def replica_disponible(alias):
+    ahora = time.monotonic()
+    comprobado, disponible = _salud.get(alias, (None, False))
+    if comprobado is not None and ahora - comprobado < getattr(settings, "REPLICA_COMPROBAR_CADA", 5):
+        return disponible
+    if _en_bucle_de_eventos():
+        return disponible
+    try:
+        segundos = retraso(alias)
+        disponible = segundos is not None and segundos <= getattr(settings, "REPLICA_RETRASO_MAX", 10)
+        if not disponible:
+            logger.warning("Réplica %s retrasada (%s s): se lee de la primaria", alias, segundos)
+    except DatabaseError as e:
+        connections[alias].close()
+        disponible = False
+        logger.warning("Réplica %s no disponible: %s", alias, e)
+    _salud[alias] = (ahora, disponible)
+    return disponible
+
+
+def _de_la_aplicacion(model):
+    return model._meta.app_label == "biblioteca"
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        alias = replica_alias()
+        if estado is None or alias is None or estado.primaria or estado.escrito:
+            return None
+        if not _de_la_aplicacion(model):
+            return None
+        if not (estado.reporte or not model._meta.managed):
+            return None
+        if not replica_disponible(alias):
+            return DEFAULT_DB_ALIAS
+        estado.replica = True
+        return alias
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None and _de_la_aplicacion(model):
+            estado.escrito = True
+        # Explícito: con None se usaría la base de la instancia, que puede
+        # haberse leído de la réplica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        bases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in bases and obj2._state.db in bases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica es una copia física de la primaria
+        if db == replica_alias():
+            return False
+        return None
@@ -0,0 +1,103 @@
+"""Búsqueda en el catálogo apoyada en índices.
+
+- Texto completo: `biblioteca_booksearch.search_vector` (título A, autores B,
+  géneros C), mantenido por triggers y con índice GIN.
+- Difusa: similitud de trigramas (`pg_trgm`) sobre el título, para erratas.
+- ISBN: prefijo con el índice `varchar_pattern_ops`.
+
+Las tres consultas devuelven solo ISBN + puntuación; las filas del catálogo se
+traen después en un único `in_bulk`.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
+from .models import Book, BookSearch, CatalogoLibros
+
+CONFIG = "simple"
+SIMILITUD_MINIMA = 0.3  # igual que pg_trgm.similarity_threshold por defecto
+ISBN_RE = re.compile(r"^[0-9Xx-]+$")
+
+
+def es_prefijo_isbn(texto):
+    return bool(ISBN_RE.match(texto)) and any(ch.isdigit() for ch in texto)
+
+
+def search_query(texto):
+    return SearchQuery(texto, config=CONFIG, search_type="websearch")
+
+
+def ranked_isbns(texto, limite=20):
+    """Lista `[(isbn, puntuación, origen), ...]` ordenada por relevancia."""
+    texto = (texto or "").strip()
+    if not texto:
+        return []
+
+    vistos = {}
+    if es_prefijo_isbn(texto):
+        for isbn in (Book.objects
+                     .filter(isbn__startswith=texto.replace("-", ""))
+                     .order_by("isbn")
+                     .values_list("isbn", flat=True)[:limite]):
+            vistos[isbn] = (isbn, 1.0, "isbn")
+
+    query = search_query(texto)
+    texto_completo = (
+        BookSearch.objects
+        .filter(search_vector=query)
+        .annotate(rank=SearchRank(F("search_vector"), query))
+        .order_by("-rank", "book_id")
+        .values_list("book_id", "rank")[:limite]
+    )
+    for isbn, rank in texto_completo:
+        vistos.setdefault(isbn, (isbn, rank, "texto"))
+
+    # Solo se recurre a trigramas si el texto completo no alcanza
+    if len(vistos) < limite:
+        difusa = (
+            Book.objects
+            .filter(title__trigram_similar=texto)
+            .annotate(sim=TrigramSimilarity("title", texto))
+            .filter(sim__gte=SIMILITUD_MINIMA)
+            .order_by("-sim", "isbn")
+            .values_list("isbn", "sim")[:limite]
+        )
+        for isbn, sim in difusa:
+            vistos.setdefault(isbn, (isbn, sim, "similitud"))
+
+    orden = {"isbn": 0, "texto": 1, "similitud": 2}
+    resultados = sorted(vistos.values(), key=lambda r: (orden[r[2]], -r[1], r[0]))
+    return resultados[:limite]
+
+
+def filtro_indexado(texto):
+    """`Q` sobre el ISBN con las mismas tres búsquedas, sin límite ni orden.
+
+    Para combinar con otros filtros (el admin) en una sola consulta: cada rama
+    es un subselect servido por su índice.
+    """
+    texto = (texto or "").strip()
+    query = search_query(texto)
+    filtro = (Q(pk__in=BookSearch.objects.filter(search_vector=query).values("book_id"))
+              | Q(pk__in=Book.objects.filter(title__trigram_similar=texto).values("isbn")))
+    if es_prefijo_isbn(texto):
+        filtro |= Q(pk__in=Book.objects
+                    .filter(isbn__startswith=texto.replace("-", ""))
+                    .values("isbn"))
+    return filtro
+
+
+def buscar_catalogo(texto, limite=20):
+    """Filas de `CatalogoLibros` para `texto`, con `rank` y `origen` añadidos."""
+    ranking = ranked_isbns(texto, limite)
+    filas = CatalogoLibros.objects.in_bulk([isbn for isbn, _, _ in ranking])
+    libros = []
+    for isbn, puntuacion, origen in ranking:
+        libro = filas.get(isbn)
+        if libro is None:
+            continue
+        libro.rank = float(puntuacion)
+        libro.origen = origen
+        libros.append(libro)
+    return libros
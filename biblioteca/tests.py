@@ -1,3 +1,831 @@
-from django.test import TestCase
+"""Presupuestos de consultas: cada vista de `views.py` y cada changelist del
+admin tiene un máximo de consultas SQL y de filas leídas, comprobado con dos
+tamaños de datos. Una página cuyo número de consultas crece con las filas
+(un N+1) falla en el tamaño grande aunque pase en el pequeño.
 
-# Create your tests here.
+Las filas son las que devuelven las sentencias (`cursor.rowcount`), con los
+cursores de servidor desactivados para que `iterator()` (exportaciones CSV,
+`<select>` de los formularios) lea todo en una sentencia y cuente.
+"""
+import importlib.util
+import io
+import math
+import random
+import select
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Author, Book, BookAuthor, BookGenre, BookRecommendation, Branch, CatalogoLibros, CirculationDaily,
+    Copy, Event, EventAttendance, Fine, Genre, LibraryUser, Loan, Reservation, Review, ReviewVote,
+    Shelf,
+)
+from . import routers
+from .admin import ReviewInline
+from .report_cache import CHANNEL, cache_timeout, generation, get_cache, invalidate
+from .views import TendenciaCirculacionReportView, condiciones_libro
+
+
+def poblar(n):
+    """Datos de prueba de tamaño proporcional a `n`: `10 * n` libros con `n`
+    copias y `n` reseñas cada uno, y un lector (`lector0`) con `4 * n`
+    préstamos, de los que la mitad vencidos o devueltos con multa."""
+    ahora = timezone.now()
+    sucursales = Branch.objects.bulk_create(
+        Branch(name=f"Sucursal {i}", address=f"Calle {i}", phone="+502 2222-000{i}")
+        for i in range(2))
+    estantes = Shelf.objects.bulk_create(
+        Shelf(branch=b, code=f"E{j}") for b in sucursales for j in range(2))
+    autores = Author.objects.bulk_create(
+        Author(first_name=f"Nombre{i}", last_name=f"Apellido{i}", birth_year=1950 + i)
+        for i in range(3 * n))
+    generos = Genre.objects.bulk_create(Genre(name=f"Género {i}") for i in range(3))
+    usuarios = LibraryUser.objects.bulk_create(
+        LibraryUser(username=f"lector{i}", email=f"lector{i}@example.com", password="!")
+        for i in range(5 * n + 1))
+
+    libros = Book.objects.bulk_create(
+        Book(isbn=f"978{i:010d}", title=f"Libro {i}", main_author=autores[i % len(autores)],
+             published_year=1990 + i % 30, languages=["es"], page_count=100 + i)
+        for i in range(10 * n))
+    BookAuthor.objects.bulk_create(
+        BookAuthor(book=libro, author=autores[(i + 1) % len(autores)])
+        for i, libro in enumerate(libros))
+    BookGenre.objects.bulk_create(
+        BookGenre(book=libro, genre=generos[i % len(generos)])
+        for i, libro in enumerate(libros))
+    copias = Copy.objects.bulk_create(
+        Copy(book=libro, shelf=estantes[(i + j) % len(estantes)],
+             inventory_code=f"C{i:05d}-{j}", price=Decimal("25.00"))
+        for i, libro in enumerate(libros) for j in range(n))
+    resenias = Review.objects.bulk_create(
+        Review(book=libro, user=usuarios[1 + j], rating="good", comment="Bien.")
+        for libro in libros for j in range(n))
+    ReviewVote.objects.bulk_create(
+        ReviewVote(review=r, user=usuarios[0], is_upvote=True) for r in resenias)
+
+    lector = usuarios[0]
+    prestamos = [
+        Loan.objects.create(copy=copias[k], user=lector, due_date=ahora.date() + timedelta(days=14))
+        for k in range(4 * n)
+    ]
+    # La mitad: préstamos de hace un mes; de ellos, uno de cada dos devuelto
+    # tarde (el trigger genera la multa) y el resto abierto y vencido
+    antiguos = [p.id for p in prestamos[: 2 * n]]
+    Loan.objects.filter(id__in=antiguos).update(
+        loaned_at=ahora - timedelta(days=30), due_date=(ahora - timedelta(days=16)).date())
+    Loan.objects.filter(id__in=antiguos[::2]).update(returned_at=ahora - timedelta(days=2))
+
+    Reservation.objects.bulk_create(
+        Reservation(copy=copias[-1 - k], user=usuarios[1 + k], expires_at=ahora + timedelta(days=3))
+        for k in range(n))
+    eventos = Event.objects.bulk_create(
+        Event(branch=b, title=f"Evento {k}", description="-", capacity=30,
+              starts_at=ahora + timedelta(days=k - n), ends_at=ahora + timedelta(days=k - n, hours=2))
+        for b in sucursales for k in range(2 * n))
+    EventAttendance.objects.bulk_create(
+        EventAttendance(event=e, user=u) for e in eventos for u in usuarios[: n + 1])
+
+    return {
+        "lector": lector, "libro": libros[0], "sucursal": sucursales[0],
+        "prestamo": prestamos[-1], "copia_libre": copias[-1 - n], "autor": autores[0],
+        "resenia": resenias[0],
+    }
+
+
+def medir(funcion):
+    """`(respuesta, consultas, filas)` de `funcion()`, con el cuerpo ya leído."""
+    filas = []
+
+    def registrar(execute, sql, params, many, context):
+        resultado = execute(sql, params, many, context)
+        cursor = context["cursor"]
+        # Solo las sentencias que devuelven filas (SELECT, RETURNING)
+        filas.append(max(cursor.rowcount, 0) if cursor.description else 0)
+        return resultado
+
+    with connection.execute_wrapper(registrar):
+        respuesta = funcion()
+        if respuesta.streaming:
+            b"".join(respuesta.streaming_content)
+        else:
+            respuesta.content
+    return respuesta, len(filas), sum(filas)
+
+
+# (nombre, método, url(datos), cuerpo(datos), máx. consultas, máx. filas)
+VISTAS = [
+    ("catalogo-list", "get", lambda d: reverse("catalogo-list"), None, 1, 51),
+    ("catalogo-buscar", "get", lambda d: reverse("catalogo-buscar") + "?q=libro", None, 3, 40),
+    ("catalogo-detail", "get", lambda d: reverse("catalogo-detail", args=[d["libro"].isbn]), None, 2, 1),
+    ("catalogo-recomendaciones", "get",
+     lambda d: reverse("catalogo-recomendaciones", args=[d["libro"].isbn]), None, 1, 0),
+    ("catalogo-mejor-valorados", "get", lambda d: reverse("catalogo-mejor-valorados"), None, 1, 20),
+    ("catalogo-resenas", "get", lambda d: reverse("catalogo-resenas", args=[d["libro"].isbn]),
+     None, 1, 10),
+    ("book-add form", "get", lambda d: reverse("book-add"), None, 0, 0),
+    ("book-edit form", "get", lambda d: reverse("book-edit", args=[d["libro"].isbn]), None, 2, 2),
+    ("book-delete form", "get", lambda d: reverse("book-delete", args=[d["libro"].isbn]), None, 1, 1),
+    ("prestamos-list", "get", lambda d: reverse("prestamos-list"), None, 1, 31),
+    ("prestamos-detail", "get", lambda d: reverse("prestamos-detail", args=[d["lector"].id]),
+     None, 2, 25),
+    ("prestamos-detail historial", "get",
+     lambda d: reverse("prestamos-detail", args=[d["lector"].id]) + "?historial=1", None, 3, 25),
+    ("loan-add form", "get", lambda d: reverse("loan-add"), None, 0, 0),
+    ("loan-edit form", "get", lambda d: reverse("loan-edit", args=[d["prestamo"].id]), None, 3, 3),
+    ("loan-delete form", "get", lambda d: reverse("loan-delete", args=[d["prestamo"].id]), None, 1, 1),
+    ("sucursales-list", "get", lambda d: reverse("sucursales-list"), None, 1, 2),
+    ("sucursal-detail", "get", lambda d: reverse("sucursal-detail", args=[d["sucursal"].id]), None, 1, 1),
+    ("branch-add form", "get", lambda d: reverse("branch-add"), None, 0, 0),
+    ("branch-edit form", "get", lambda d: reverse("branch-edit", args=[d["sucursal"].id]), None, 1, 1),
+    ("branch-delete form", "get", lambda d: reverse("branch-delete", args=[d["sucursal"].id]), None, 1, 1),
+    ("catalogo-report", "get", lambda d: reverse("catalogo-report"), None, 1, 51),
+    ("catalogo-report filtros", "get",
+     lambda d: reverse("catalogo-report") + "?year_min=1995&condition=good", None, 1, 51),
+    ("catalogo-report csv", "get", lambda d: reverse("catalogo-report") + "?export=csv", None, 1, 60),
+    ("prestamos-report", "get", lambda d: reverse("prestamos-report"), None, 1, 31),
+    ("prestamos-report historial", "get",
+     lambda d: reverse("prestamos-report") + "?historial=1", None, 1, 31),
+    ("prestamos-report csv", "get", lambda d: reverse("prestamos-report") + "?export=csv", None, 1, 31),
+    ("sucursales-report", "get", lambda d: reverse("sucursales-report"), None, 1, 2),
+    ("sucursales-report csv", "get",
+     lambda d: reverse("sucursales-report") + "?export=csv", None, 1, 2),
+    ("circulacion-report", "get", lambda d: reverse("circulacion-report"), None, 2, 8),
+    ("circulacion-report csv", "get",
+     lambda d: reverse("circulacion-report") + "?export=csv&granularidad=dia", None, 1, 8),
+    ("catalogo-report-async", "get", lambda d: reverse("catalogo-report-async"), None, 2, 52),
+    ("prestamos-report-async", "get", lambda d: reverse("prestamos-report-async"), None, 2, 32),
+    ("sucursales-report-async", "get", lambda d: reverse("sucursales-report-async"), None, 2, 3),
+    ("catalogo-list-async", "get", lambda d: reverse("catalogo-list-async"), None, 1, 51),
+    ("prestamos-list-async", "get", lambda d: reverse("prestamos-list-async"), None, 1, 31),
+    ("sucursales-list-async", "get", lambda d: reverse("sucursales-list-async"), None, 1, 2),
+    ("autocompletar-copias", "get", lambda d: reverse("autocompletar-copias") + "?term=C0", None, 1, 21),
+    ("autocompletar-copias pagina", "get",
+     lambda d: reverse("autocompletar-copias") + "?term=C0&page=2", None, 2, 21),
+    ("autocompletar-usuarios", "get",
+     lambda d: reverse("autocompletar-usuarios") + "?term=lector1", None, 2, 21),
+    ("autocompletar-usuarios correo", "get",
+     lambda d: reverse("autocompletar-usuarios") + "?term=lector1@", None, 2, 1),
+    ("autocompletar-autores", "get",
+     lambda d: reverse("autocompletar-autores") + "?term=apellido", None, 2, 21),
+    ("autocompletar-autores nombre", "get",
+     lambda d: reverse("autocompletar-autores") + "?term=nombre1", None, 2, 21),
+    ("book-edit", "post", lambda d: reverse("book-edit", args=[d["libro"].isbn]),
+     lambda d: {"title": "Otro título", "published_year": 2001, "languages": "es",
+                "condition": "good", "page_count": 120, "main_author": d["autor"].id}, 4, 3),
+    ("loan-add", "post", lambda d: reverse("loan-add"),
+     lambda d: {"due_date": (timezone.now() + timedelta(days=14)).date().isoformat(),
+                "copy": d["copia_libre"].id, "user": d["lector"].id}, 8, 6),
+    ("loan-checkout", "post", lambda d: reverse("loan-checkout"),
+     lambda d: {"isbn": d["copia_libre"].book_id, "user": d["lector"].id}, 5, 3),
+    ("loan-bulk-return", "post", lambda d: reverse("loan-bulk-return"),
+     lambda d: {"loans": [d["prestamo"].id]}, 4, 2),
+    ("branch-edit", "post", lambda d: reverse("branch-edit", args=[d["sucursal"].id]),
+     lambda d: {"name": "Sucursal central", "address": "Calle 1", "phone": "+502 2222-0001"}, 3, 1),
+]
+
+# (nombre, url(datos), máx. consultas, máx. filas)
+ADMIN = [
+    ("catalogo changelist", lambda d: reverse("admin:biblioteca_catalogolibros_changelist"), 6, 65),
+    ("prestamos changelist", lambda d: reverse("admin:biblioteca_prestamosusuarios_changelist"), 6, 37),
+    ("sucursales changelist", lambda d: reverse("admin:biblioteca_actividadsucursales_changelist"),
+     6, 8),
+    ("book changelist", lambda d: reverse("admin:biblioteca_book_changelist"), 7, 95),
+    ("book changelist búsqueda", lambda d: reverse("admin:biblioteca_book_changelist") + "?q=ibro",
+     7, 95),
+    ("loan changelist", lambda d: reverse("admin:biblioteca_loan_changelist"), 5, 28),
+    ("branch changelist", lambda d: reverse("admin:biblioteca_branch_changelist"), 5, 6),
+    ("book change", lambda d: reverse("admin:biblioteca_book_change", args=[d["libro"].isbn]), 12, 27),
+    ("review changelist", lambda d: reverse("admin:biblioteca_review_changelist"), 6, 105),
+    ("review change", lambda d: reverse("admin:biblioteca_review_change", args=[d["resenia"].id]),
+     6, 6),
+    ("loan add", lambda d: reverse("admin:biblioteca_loan_add"), 3, 3),
+    ("loan change", lambda d: reverse("admin:biblioteca_loan_change", args=[d["prestamo"].id]), 5, 5),
+]
+
+
+# Sin instrumentación, réplica ni caché de reportes: se mide la vista
+sin_cache = override_settings(
+    SQL_MUESTREO=0,
+    REPLICA_ALIAS=None,
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "sin_cache": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    },
+    REPORTES_CACHE="sin_cache",
+    REPORTES_GENERACIONES_CACHE="sin_cache",
+)
+
+
+class PresupuestoConsultasMixin:
+    """Las pruebas; las subclases fijan el tamaño `n` de `poblar`."""
+    n = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(cls.n)
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        # Caché por proceso: solo la primera petición consulta el enum
+        condiciones_libro()
+
+    def setUp(self):
+        cursores = mock.patch.dict(connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True)
+        cursores.start()
+        self.addCleanup(cursores.stop)
+
+    def comprobar(self, nombre, funcion, max_consultas, max_filas):
+        respuesta, consultas, filas = medir(funcion)
+        self.assertLess(respuesta.status_code, 400, nombre)
+        self.assertLessEqual(consultas, max_consultas, f"{nombre}: consultas")
+        self.assertLessEqual(filas, max_filas, f"{nombre}: filas")
+
+    def test_vistas(self):
+        for nombre, metodo, url, cuerpo, max_consultas, max_filas in VISTAS:
+            with self.subTest(nombre), transaction.atomic():
+                datos = cuerpo(self.datos) if cuerpo else None
+                self.comprobar(
+                    nombre, lambda: getattr(self.client, metodo)(url(self.datos), datos),
+                    max_consultas, max_filas)
+                transaction.set_rollback(True)
+
+    def test_admin(self):
+        self.client.force_login(self.admin)
+        for nombre, url, max_consultas, max_filas in ADMIN:
+            with self.subTest(nombre):
+                self.comprobar(nombre, lambda: self.client.get(url(self.datos)),
+                               max_consultas, max_filas)
+
+
+@sin_cache
+class PresupuestoConsultasPequenioTests(PresupuestoConsultasMixin, TestCase):
+    n = 1
+
+
+@sin_cache
+class PresupuestoConsultasGrandeTests(PresupuestoConsultasMixin, TestCase):
+    n = 6
+
+
+@sin_cache
+class DetallePorFuncionTests(TestCase):
+    """Las funciones de la migración 0015 devuelven, para cada clave, la misma
+    fila que su vista filtrada por esa clave (y ninguna si la vista no la
+    tiene)."""
+    # (tabla, su clave, vista, clave en la vista, función)
+    CASOS = [
+        ("biblioteca_book", "isbn", "vista_catalogo_libros", "isbn", "catalogo_libro"),
+        ("library_users", "id", "vista_prestamos_usuarios", "usuario_id", "prestamos_usuario"),
+        ("biblioteca_branch", "id", "vista_actividad_sucursales", "sucursal_id", "actividad_sucursal"),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(2)
+        autor = cls.datos["autor"]
+        # Casos límite: sin hijos, autor principal repetido como coautor,
+        # usuario suspendido (fuera de la vista)
+        Book.objects.create(isbn="9789999999999", title="Sin nada", main_author=autor,
+                            published_year=2000, languages=["es"], page_count=10)
+        BookAuthor.objects.create(book=cls.datos["libro"], author=cls.datos["libro"].main_author)
+        Branch.objects.create(name="Sucursal vacía", address="-", phone="+502 2222-0009")
+        LibraryUser.objects.create(username="suspendido", email="suspendido@example.com",
+                                   password="!", status="suspended")
+
+    def filas(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def test_misma_fila_que_la_vista(self):
+        for tabla, pk, vista, clave, funcion in self.CASOS:
+            claves = [fila[0] for fila in self.filas(f"SELECT {pk} FROM {tabla}", [])]
+            claves.append("0" if pk == "isbn" else 0)  # inexistente
+            for valor in claves:
+                with self.subTest(funcion, clave=valor):
+                    self.assertEqual(
+                        self.filas(f"SELECT * FROM {funcion}(%s)", [valor]),
+                        self.filas(f"SELECT * FROM {vista} WHERE {clave} = %s", [valor]),
+                    )
+
+    @override_settings(CATALOGO_MATERIALIZADO=False)
+    def test_vistas_de_detalle(self):
+        libro, lector, sucursal = self.datos["libro"], self.datos["lector"], self.datos["sucursal"]
+        casos = [
+            ("catalogo-detail", libro.isbn, "libro", "title", libro.title),
+            ("prestamos-detail", lector.id, "usuario", "username", lector.username),
+            ("sucursal-detail", sucursal.id, "sucursal", "nombre_sucursal", sucursal.name),
+        ]
+        for nombre, clave, contexto, campo, valor in casos:
+            with self.subTest(nombre):
+                respuesta = self.client.get(reverse(nombre, args=[clave]))
+                self.assertEqual(getattr(respuesta.context[contexto], campo), valor)
+        suspendido = LibraryUser.objects.get(username="suspendido")
+        self.assertEqual(self.client.get(reverse("prestamos-detail", args=[suspendido.id])).status_code, 404)
+
+
+@sin_cache
+class CirculacionDiariaTests(TestCase):
+    """Lo que dejan los triggers en `circulation_daily` es lo que calcula
+    `circulacion_historial` desde cero, y el reporte de tendencia lo suma."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(2)
+
+    def diferencias(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT COUNT(*) FROM (
+                    (SELECT day, branch_id, book_id, loans_opened, loans_returned, overdue,
+                            fines_issued, fine_amount
+                     FROM circulation_daily
+                     WHERE (loans_opened, loans_returned, overdue, fines_issued, fine_amount)
+                           <> (0, 0, 0, 0, 0)
+                     EXCEPT ALL SELECT * FROM circulacion_historial(NULL, NULL))
+                    UNION ALL
+                    (SELECT * FROM circulacion_historial(NULL, NULL)
+                     EXCEPT ALL
+                     SELECT day, branch_id, book_id, loans_opened, loans_returned, overdue,
+                            fines_issued, fine_amount
+                     FROM circulation_daily)
+                ) d""")
+            return cursor.fetchone()[0]
+
+    def test_triggers_igual_que_historial(self):
+        self.assertTrue(CirculationDaily.objects.exists())
+        self.assertEqual(self.diferencias(), 0)
+
+        ahora = timezone.now()
+        abiertos = Loan.objects.filter(returned_at__isnull=True)
+        # Devolución tarde (multa del trigger), devengo, pago, edición de
+        # fechas y borrado
+        vencido = abiertos.filter(due_date__lt=ahora.date()).first()
+        Loan.objects.filter(pk=vencido.pk).update(returned_at=ahora)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM devengar_multas(%s)", [ahora.date()])
+        Fine.objects.filter(loan_id=vencido.pk).update(paid=True)
+        Loan.objects.filter(pk=self.datos["prestamo"].pk).update(
+            due_date=ahora.date() + timedelta(days=30))
+        Fine.objects.exclude(loan_id=vencido.pk).first().delete()
+        Loan.objects.create(copy=self.datos["copia_libre"], user=self.datos["lector"],
+                            due_date=ahora.date() + timedelta(days=7))
+        self.assertEqual(self.diferencias(), 0)
+
+    def test_reporte_suma_el_resumen(self):
+        respuesta = self.client.get(reverse("circulacion-report"), {
+            "desde": "2000-01-01", "hasta": "2100-12-31", "granularidad": "mes"})
+        filas = respuesta.context["filas"]
+        totales = CirculationDaily.objects.aggregate(
+            prestamos=Sum("loans_opened"), multas=Sum("fines_issued"))
+        self.assertEqual(sum(f["prestamos"] for f in filas), totales["prestamos"])
+        self.assertEqual(sum(f["multas"] for f in filas), totales["multas"])
+        self.assertEqual(totales["prestamos"], Loan.objects.count())
+        self.assertEqual(totales["multas"], Fine.objects.count())
+
+        sucursal = self.datos["sucursal"]
+        respuesta = self.client.get(reverse("circulacion-report"), {
+            "desde": "2000-01-01", "hasta": "2100-12-31", "sucursal": sucursal.id})
+        self.assertEqual({f["branch_id"] for f in respuesta.context["filas"]}, {sucursal.id})
+
+    def test_sin_dias_futuros(self):
+        # Los préstamos abiertos que vencen más adelante ya tienen su día de
+        # retraso en el resumen, pero el reporte no pasa de hoy
+        hoy = timezone.now().date()
+        self.assertTrue(CirculationDaily.objects.filter(day__gt=hoy, overdue__gt=0).exists())
+        respuesta = self.client.get(reverse("circulacion-report"), {
+            "desde": "2000-01-01", "hasta": "2100-12-31", "granularidad": "mes"})
+        self.assertEqual(respuesta.context["hasta"], hoy)
+        vencidos = CirculationDaily.objects.filter(day__lte=hoy).aggregate(n=Sum("overdue"))["n"]
+        self.assertEqual(sum(f["vencidos"] for f in respuesta.context["filas"]), vencidos)
+
+    def test_paginas_y_csv(self):
+        parametros = {"desde": "2000-01-01", "granularidad": "dia"}
+        lineas = b"".join(self.client.get(
+            reverse("circulacion-report"), {**parametros, "export": "csv"}).streaming_content)
+        total = len(lineas.decode().splitlines()) - 1
+
+        filas, pagina = [], {}
+        with mock.patch.object(TendenciaCirculacionReportView, "paginate_by", 5):
+            while True:
+                contexto = self.client.get(
+                    reverse("circulacion-report"), {**parametros, **pagina}).context
+                self.assertLessEqual(len(contexto["filas"]), 5)
+                filas += contexto["filas"]
+                if not contexto["page_obj"].has_next():
+                    break
+                pagina = {"after": contexto["page_obj"].next_cursor}
+        self.assertGreater(total, 5)
+        self.assertEqual(len(filas), total)
+        claves = [(f["sucursal_orden"], f["periodo"]) for f in filas]
+        self.assertEqual(claves, sorted(set(claves)))
+
+
+@skipUnless(importlib.util.find_spec("scipy"), "calcular_recomendaciones requiere numpy y scipy")
+@sin_cache
+class RecomendacionesTests(TestCase):
+    """`calcular_recomendaciones` (completo e incremental) guarda lo mismo que
+    el cálculo directo por pares de libros, y las vistas lo sirven."""
+    VECINOS, MIN_LECTORES = 3, 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(2)
+        cls.azar = random.Random(4)
+        cls.copias = list(Copy.objects.order_by("id"))
+        cls.lectores = list(LibraryUser.objects.order_by("id")[1:9])
+        cls.prestar(cls.lectores, 6)
+
+    @classmethod
+    def prestar(cls, usuarios, n):
+        vence = timezone.now().date() + timedelta(days=14)
+        Loan.objects.bulk_create(
+            Loan(copy=copia, user=usuario, due_date=vence)
+            for usuario in usuarios for copia in cls.azar.sample(cls.copias, n))
+
+    def esperadas(self):
+        """Recomendaciones por fuerza bruta sobre los pares de libros."""
+        lectores = {}
+        for usuario, isbn in Loan.objects.values_list("user_id", "copy__book_id"):
+            lectores.setdefault(isbn, set()).add(usuario)
+        resultado = {}
+        for a, de_a in lectores.items():
+            vecinos = sorted(
+                (-len(de_a & de_b) / math.sqrt(len(de_a) * len(de_b)), b)
+                for b, de_b in lectores.items()
+                if b != a and len(de_a & de_b) >= self.MIN_LECTORES)
+            if vecinos:
+                resultado[a] = [(b, round(-p, 4)) for p, b in vecinos[:self.VECINOS]]
+        return resultado
+
+    def guardadas(self):
+        return {r.book_id: list(zip(r.related, r.scores)) for r in BookRecommendation.objects.all()}
+
+    def calcular(self, *args):
+        call_command("calcular_recomendaciones", *args, vecinos=self.VECINOS,
+                     min_lectores=self.MIN_LECTORES, bloque=7, stdout=io.StringIO())
+
+    def test_completo_e_incremental(self):
+        self.calcular()
+        self.assertEqual(self.guardadas(), self.esperadas())
+
+        antes = self.guardadas()
+        nuevos = self.lectores[:2]
+        self.prestar(nuevos, 3)
+        self.calcular("--incremental")
+        afectados = set(Loan.objects.filter(user__in=nuevos).values_list("copy__book_id", flat=True))
+        esperadas, guardadas = self.esperadas(), self.guardadas()
+        for isbn in afectados | set(antes):
+            with self.subTest(isbn=isbn):
+                if isbn in afectados:
+                    self.assertEqual(guardadas.get(isbn), esperadas.get(isbn))
+                else:
+                    self.assertEqual(guardadas.get(isbn), antes[isbn])
+
+    def test_vistas(self):
+        self.calcular()
+        isbn, vecinos = next(iter(self.esperadas().items()))
+        datos = self.client.get(reverse("catalogo-recomendaciones", args=[isbn])).json()
+        self.assertEqual([(r["isbn"], r["score"]) for r in datos["recomendaciones"]], vecinos)
+        respuesta = self.client.get(reverse("catalogo-detail", args=[isbn]))
+        self.assertEqual([l.isbn for l in respuesta.context["tambien_prestados"]],
+                         [b for b, _ in vecinos])
+
+
+def wilson(utiles, no_utiles, z=1.959964):
+    n = utiles + no_utiles
+    if not n:
+        return 0
+    p = utiles / n
+    return (p + z * z / (2 * n) - z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+
+
+@sin_cache
+class AgregadosResenasTests(TestCase):
+    """Los contadores de la migración 0018 (valoración por libro, votos y
+    utilidad por reseña) cuadran con las reseñas y votos tras altas, cambios y
+    bajas, y los endpoints los sirven en orden."""
+    VALORES = {"poor": 1, "average": 2, "good": 3, "excellent": 4}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(2)
+
+    def comprobar(self):
+        for libro in Book.objects.all():
+            valores = [self.VALORES[r] for r in libro.reviews.values_list("rating", flat=True)]
+            with self.subTest(isbn=libro.isbn):
+                self.assertEqual((libro.rating_count, libro.rating_sum), (len(valores), sum(valores)))
+                promedio = (Decimal(sum(valores)) / len(valores)).quantize(Decimal("0.01")) if valores else None
+                self.assertEqual(libro.rating_avg, promedio)
+                catalogo = CatalogoLibros.objects.get(isbn=libro.isbn)
+                self.assertEqual((catalogo.total_reviews, catalogo.rating_promedio), (len(valores), promedio))
+        for resenia in Review.objects.all():
+            votos = list(resenia.votes.values_list("is_upvote", flat=True))
+            utiles, no_utiles = votos.count(True), votos.count(False)
+            with self.subTest(resenia=resenia.id):
+                self.assertEqual((resenia.upvotes, resenia.downvotes), (utiles, no_utiles))
+                self.assertAlmostEqual(resenia.helpfulness, wilson(utiles, no_utiles))
+
+    def test_triggers(self):
+        libros = list(Book.objects.order_by("isbn")[:3])
+        usuarios = list(LibraryUser.objects.order_by("id"))
+        nueva = Review.objects.create(book=libros[0], user=usuarios[-1], rating="excellent")
+        Review.objects.filter(book=libros[1]).update(rating="poor")
+        Review.objects.filter(id=nueva.id).update(book=libros[2])  # cambia de libro
+        Review.objects.filter(book=libros[1]).first().delete()
+
+        resenias = list(Review.objects.order_by("id")[:4])
+        ReviewVote.objects.bulk_create(
+            ReviewVote(review=r, user=u, is_upvote=k % 3 == 0)
+            for r in resenias for k, u in enumerate(usuarios[1:8]))
+        ReviewVote.objects.filter(review=resenias[0], is_upvote=False).update(is_upvote=True)
+        ReviewVote.objects.filter(review=resenias[1], user=usuarios[0]).delete()
+        self.comprobar()
+
+    def test_formulario_no_pisa_contadores(self):
+        libro = Book.objects.get(isbn=self.datos["libro"].isbn)
+        resenia = Review.objects.filter(book=libro).first()
+        Review.objects.create(book=libro, user=LibraryUser.objects.last(), rating="poor")
+        ReviewVote.objects.create(review=resenia, user=LibraryUser.objects.last(), is_upvote=False)
+        # Instancias con los contadores de antes de los cambios
+        libro.title = "Otro título"
+        libro.save()
+        resenia.comment = "Editada."
+        resenia.save()
+        self.comprobar()
+
+    def test_endpoints(self):
+        libro = self.datos["libro"]
+        Review.objects.filter(book=libro).update(rating="excellent")
+        resenia = Review.objects.filter(book=libro).order_by("id").last()
+        ReviewVote.objects.bulk_create(
+            ReviewVote(review=resenia, user=u, is_upvote=True)
+            for u in LibraryUser.objects.exclude(id=self.datos["lector"].id)[:5])
+
+        datos = self.client.get(reverse("catalogo-mejor-valorados") + "?limit=5").json()
+        esperados = sorted(Book.objects.filter(rating_count__gt=0),
+                           key=lambda b: (-b.rating_avg, -b.rating_count, b.isbn))[:5]
+        self.assertEqual([l["isbn"] for l in datos["libros"]], [b.isbn for b in esperados])
+        self.assertEqual(datos["libros"][0]["isbn"], libro.isbn)
+
+        datos = self.client.get(reverse("catalogo-resenas", args=[libro.isbn])).json()
+        self.assertEqual(datos["resenas"][0]["id"], resenia.id)
+        self.assertEqual([r["helpfulness"] for r in datos["resenas"]],
+                         sorted((r["helpfulness"] for r in datos["resenas"]), reverse=True))
+
+
+class ContadoresSucursalTests(TestCase):
+    """Los contadores de copias y préstamos de cada sucursal (migración 0021)
+    cuadran con sus tablas y `actividad_sucursal` con su vista."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(2)
+
+    def comprobar(self):
+        for sucursal in Branch.objects.all():
+            with self.subTest(sucursal=sucursal.id):
+                self.assertEqual(
+                    (sucursal.total_copies, sucursal.total_loans),
+                    (Copy.objects.filter(shelf__branch=sucursal).count(),
+                     Loan.objects.filter(copy__shelf__branch=sucursal).count()),
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT * FROM actividad_sucursal(%s)", [sucursal.id])
+                    fila = cursor.fetchall()
+                    cursor.execute("SELECT * FROM vista_actividad_sucursales WHERE sucursal_id = %s",
+                                   [sucursal.id])
+                    self.assertEqual(fila, cursor.fetchall())
+
+    def test_triggers(self):
+        origen, destino = Branch.objects.order_by("id")[:2]
+        estante = Shelf.objects.filter(branch=destino).first()
+        prestada = Loan.objects.filter(returned_at__isnull=True).first().copy
+        # Una copia prestada cambia de sucursal con sus préstamos
+        Copy.objects.filter(id=prestada.id).update(shelf=estante)
+        # Un estante entero cambia de sucursal
+        movido = Shelf.objects.filter(branch=origen).order_by("id").last()
+        Shelf.objects.filter(id=movido.id).update(branch=destino, code="MOVIDO")
+        Copy.objects.create(book=self.datos["libro"], shelf=estante, inventory_code="NUEVA",
+                            price=Decimal("10.00"))
+        Copy.objects.filter(shelf__branch=destino, loan__isnull=True).order_by("id").first().delete()
+        Copy.objects.filter(id=self.datos["copia_libre"].id).update(shelf=None)
+        Loan.objects.create(copy=self.datos["copia_libre"], user=self.datos["lector"],
+                            due_date=timezone.now().date() + timedelta(days=7))
+        Loan.objects.filter(returned_at__isnull=True).update(returned_at=timezone.now())
+        self.datos["prestamo"].delete()
+        self.comprobar()
+
+    def test_formulario_no_pisa_contadores(self):
+        sucursal = Branch.objects.get(id=self.datos["sucursal"].id)
+        Copy.objects.create(book=self.datos["libro"], shelf=sucursal.shelves.first(),
+                            inventory_code="NUEVA", price=Decimal("10.00"))
+        sucursal.name = "Otro nombre"
+        sucursal.save()
+        self.comprobar()
+
+
+class CosteActividadSucursalTests(TransactionTestCase):
+    """`actividad_sucursal` no crece con el fondo ni con el historial de
+    préstamos devueltos de la sucursal; la vista filtrada por ella, sí. Fuera
+    de una transacción para medir tras `VACUUM`, como en producción: las
+    versiones muertas de copias y préstamos no cuentan."""
+
+    def bloques(self, sql, params):
+        """Bloques de página que lee `sql` (EXPLAIN BUFFERS)."""
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE")
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0][0]["Plan"]
+        return plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+
+    def medir(self, sucursal):
+        return (
+            self.bloques("SELECT * FROM actividad_sucursal(%s)", [sucursal.id]),
+            self.bloques("SELECT * FROM vista_actividad_sucursales WHERE sucursal_id = %s",
+                         [sucursal.id]),
+        )
+
+    def crecer(self, datos, n, prefijo):
+        """`n` copias más en la sucursal, cada una prestada y devuelta dos veces."""
+        copias = Copy.objects.bulk_create(
+            Copy(book=datos["libro"], shelf=datos["sucursal"].shelves.first(),
+                 inventory_code=f"{prefijo}{i:05d}", price=Decimal("10.00"))
+            for i in range(n))
+        for _ in range(2):
+            prestamos = Loan.objects.bulk_create(
+                Loan(copy=copia, user=datos["lector"],
+                     due_date=timezone.now().date() + timedelta(days=7))
+                for copia in copias)
+            Loan.objects.filter(id__in=[p.id for p in prestamos]).update(returned_at=timezone.now())
+
+    def test_coste_constante(self):
+        datos = poblar(2)
+        # Con tablas de una página todo son lecturas secuenciales: se parte
+        # de un tamaño en que ya se usan los índices
+        self.crecer(datos, 500, "A")
+        funcion, vista = self.medir(datos["sucursal"])
+        self.crecer(datos, 4000, "B")
+        funcion_despues, vista_despues = self.medir(datos["sucursal"])
+        # Con 9 veces más filas la vista lee ~8 veces más bloques; la función
+        # solo algún nivel más de índice
+        self.assertLessEqual(funcion_despues, 2 * funcion)
+        self.assertGreater(vista_despues, 5 * vista)
+
+@override_settings(REPORTES_CACHE="default", REPORTES_GENERACIONES_CACHE="default")
+@sin_cache
+class NotificacionesPrestamosTests(TransactionTestCase):
+    """Borrar un préstamo avisa a `escuchar_reportes` (migración 0019) y pasa
+    de generación los reportes de préstamos y sucursales."""
+
+    def avisos(self, escucha, espera=2):
+        pg = escucha.connection
+        familias = set()
+        while select.select([pg], [], [], espera) != ([], [], []):
+            pg.poll()
+            while pg.notifies:
+                familias.update(pg.notifies.pop(0).payload.split(","))
+            espera = 0.2
+        return familias
+
+    def test_borrar_prestamo(self):
+        datos = poblar(1)
+        escucha = connection.copy()
+        self.addCleanup(escucha.close)
+        with escucha.cursor() as c:
+            c.execute(f"LISTEN {CHANNEL}")
+        self.avisos(escucha, espera=0.2)
+
+        antes = {f: generation(f) for f in ("prestamos", "sucursales")}
+        respuesta = self.client.post(reverse("loan-delete", args=[datos["prestamo"].id]))
+        self.assertEqual(respuesta.status_code, 302)
+        familias = self.avisos(escucha)
+        self.assertLessEqual({"prestamos", "sucursales"}, familias)
+        invalidate(familias)
+        for familia, generacion in antes.items():
+            self.assertGreater(generation(familia), generacion, familia)
+
+
+@override_settings(REPORTES_CACHE_TIMEOUT=300, REPLICA_RETRASO_MAX=10)
+class CacheReplicaTests(TestCase):
+    """Una página generada con lecturas de la réplica puede ser anterior a la
+    invalidación: se guarda solo `REPLICA_RETRASO_MAX` segundos."""
+
+    def leer(self, estado, disponible):
+        token = routers.activar(estado)
+        self.addCleanup(routers.desactivar, token)
+        with mock.patch.object(routers, "replica_alias", return_value="default"), \
+             mock.patch.object(routers, "replica_disponible", return_value=disponible):
+            routers.ReplicaRouter().db_for_read(Book)
+
+    def test_pagina_de_la_replica(self):
+        estado = routers.EstadoPeticion(reporte=True)
+        self.leer(estado, disponible=True)
+        self.assertTrue(estado.replica)
+        self.assertEqual(cache_timeout(), 10)
+
+    def test_pagina_de_la_primaria(self):
+        estado = routers.EstadoPeticion(reporte=True)
+        self.leer(estado, disponible=False)
+        self.assertFalse(estado.replica)
+        self.assertEqual(cache_timeout(), 300)
+
+    def test_fuera_de_peticion(self):
+        self.assertEqual(cache_timeout(), 300)
+
+
+class BusquedaAdminTests(TestCase):
+    """El admin conserva la búsqueda por subcadena y le suma la indexada, sin
+    tope de resultados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        poblar(1)
+
+    def buscar(self, modelo, texto):
+        resultado, _ = admin.site._registry[modelo].get_search_results(
+            None, modelo.objects.all(), texto)
+        return set(resultado.values_list("isbn", flat=True))
+
+    def test_subcadena(self):
+        for modelo in (Book, CatalogoLibros):
+            with self.subTest(modelo.__name__):
+                self.assertEqual(len(self.buscar(modelo, "ibro")), 10)
+
+    def test_suma_la_indexada(self):
+        # Errata (trigramas), autor (texto completo) y prefijo de ISBN
+        self.assertIn("9780000000003", self.buscar(Book, "Lbro 3"))
+        # Autor principal de 1, 4, 7 y coautor de 0, 3, 6, 9
+        self.assertEqual(len(self.buscar(Book, "Apellido1")), 7)
+        self.assertEqual(len(self.buscar(CatalogoLibros, "978")), 10)
+
+
+class ReseniasAdminTests(TestCase):
+    """El inline de reseñas del libro muestra solo las últimas, pero se puede
+    editar y borrar en él."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = poblar(3)
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+
+    def formset(self, datos=None):
+        request = RequestFactory().post("/") if datos else RequestFactory().get("/")
+        request.user = self.admin
+        libro = self.datos["libro"]
+        inline = ReviewInline(Book, admin.site)
+        inline.formset.limite = 2
+        self.addCleanup(setattr, inline.formset, "limite", 20)
+        return inline.get_formset(request, libro)(datos, instance=libro, prefix="r")
+
+    def test_editar_y_borrar(self):
+        formset = self.formset()
+        ultimas = list(Review.objects.filter(book=self.datos["libro"]).order_by("-created_at", "-id")[:2])
+        self.assertEqual([f.instance for f in formset.forms], ultimas)
+        datos = {"r-TOTAL_FORMS": "2", "r-INITIAL_FORMS": "2"}
+        for i, resenia in enumerate(ultimas):
+            datos.update({f"r-{i}-id": resenia.id, f"r-{i}-book": resenia.book_id,
+                          f"r-{i}-rating": "poor", f"r-{i}-comment": "Moderada."})
+        datos["r-1-DELETE"] = "on"
+        formset = self.formset(datos)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        formset.save()
+        ultimas[0].refresh_from_db()
+        self.assertEqual(ultimas[0].comment, "Moderada.")
+        self.assertFalse(Review.objects.filter(id=ultimas[1].id).exists())
+        self.assertEqual(Review.objects.filter(book=self.datos["libro"]).count(), 2)
+
+
+@override_settings(
+    CACHES={
+        # Por encima de 2 entradas, cada `set` borra la mitad con claves menores
+        "reportes": {"BACKEND": "django.core.cache.backends.db.DatabaseCache",
+                     "LOCATION": "reportes_cache",
+                     "OPTIONS": {"MAX_ENTRIES": 2, "CULL_FREQUENCY": 2}},
+        "reportes_generaciones": {"BACKEND": "django.core.cache.backends.db.DatabaseCache",
+                                  "LOCATION": "reportes_generaciones"},
+    },
+    REPORTES_CACHE="reportes", REPORTES_GENERACIONES_CACHE="reportes_generaciones",
+)
+class GeneracionesCacheTests(TestCase):
+    """Llenar la caché de páginas no devuelve una familia a una generación
+    anterior."""
+
+    def test_no_se_borran_con_las_paginas(self):
+        invalidate(["catalogo", "prestamos"])
+        antes = {f: generation(f) for f in ("catalogo", "prestamos")}
+        paginas = get_cache()
+        # `reportes:gen:*` ordena antes que `reportes:prestamos:*`
+        for i in range(5):
+            paginas.set(f"reportes:prestamos:{i}:x", "pagina", None)
+        self.assertEqual({f: generation(f) for f in antes}, antes)
@@ -3,30 +3,237 @@ from django.views.generic import (
     ListView, DetailView,
     CreateView, UpdateView, DeleteView
 )
-from .models import CatalogoLibros, PrestamosUsuarios, ActividadSucursales             
-from biblioteca.models import Book, Loan, Branch
-from django.http import HttpResponse
-from django.db.models import Count, Avg, Q
-from django.db import connection
+from .models import (
+    CatalogoLibros, PrestamosUsuarios, ActividadSucursales,
+    PrestamosUsuariosHistorico, ActividadSucursalesHistorico, LoanArchive,
+    CirculationDaily,
+)
+from .pagination import KeysetPaginationMixin
+from .reports import SinglePassReportMixin
+from .report_cache import ReportCacheMixin
+from .search import buscar_catalogo
+from .recomendaciones import tambien_prestados
+from .checkout import CheckoutError, checkout, return_loans
+from .autocomplete import AutocompletarFormMixin
+from biblioteca.models import Book, Copy, Loan, Branch, Review
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.db.models import Avg, Q, Min, Sum, DateField
+from django.db.models.functions import Coalesce, Trunc, TruncDate
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import date, timedelta
+from functools import lru_cache
 import csv, json
 
+
+# Exportación CSV en streaming
+class Echo:
+    """Pseudo-buffer: `csv.writer` escribe en él y recibimos la línea."""
+    def write(self, value):
+        return value
+
+
+class StreamingCSVMixin:
+    """Atiende `?export=csv` con un `StreamingHttpResponse`.
+
+    Las filas salen de `values_list` a través de un cursor del lado del
+    servidor (`iterator(chunk_size=...)`), así que la memoria no depende del
+    número de filas y el primer byte sale de inmediato.
+    """
+    csv_filename = "export.csv"
+    csv_columns = []  # [(cabecera, campo o expresión), ...]
+    csv_chunk_size = 2000
+
+    def get_csv_queryset(self):
+        return self.get_queryset()
+
+    def render_csv(self):
+        headers = [h for h, _ in self.csv_columns]
+        fields = [f for _, f in self.csv_columns]
+        rows = (
+            self.get_csv_queryset()
+                .values_list(*fields)
+                .iterator(chunk_size=self.csv_chunk_size)
+        )
+        writer = csv.writer(Echo())
+
+        def lineas():
+            yield writer.writerow(headers)
+            for row in rows:
+                yield writer.writerow(row)
+
+        resp = StreamingHttpResponse(lineas(), content_type='text/csv')
+        resp['Content-Disposition'] = f'attachment; filename="{self.csv_filename}"'
+        return resp
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('export') == 'csv':
+            return self.render_csv()
+        return super().get(request, *args, **kwargs)
+
+# Detalle de una fila de vista por su función SQL (migración 0015)
+class DetallePorFuncionMixin:
+    """`get_object` con `SELECT * FROM funcion_sql(clave)`: la fila de la vista
+    calculada solo con las filas hijas de esa clave, en vez de filtrar la vista
+    completa (el filtro no siempre entra en sus GROUP BY)."""
+    funcion_sql = None
+
+    def get_funcion_sql(self):
+        return self.funcion_sql
+
+    def get_object(self, queryset=None):
+        funcion = self.get_funcion_sql()
+        if funcion is None:
+            return super().get_object(queryset)
+        clave = self.kwargs[self.pk_url_kwarg]
+        filas = list(self.model.objects.raw(f"SELECT * FROM {funcion}(%s)", [clave]))
+        if not filas:
+            raise Http404(f"No existe {self.model._meta.verbose_name} {clave}.")
+        return filas[0]
+
+
 # 1.1 Índice: lista los libros usando la vista SQL
-class CatalogoListView(ListView):
+class CatalogoListView(KeysetPaginationMixin, ListView):
     model = CatalogoLibros
     template_name = "biblioteca/catalogo_list.html"
     context_object_name = "libros"
+    paginate_by = 50
+    keyset_fields = ("title", "isbn")
+
+
+# 1.1b Búsqueda: `?q=` sobre título, autores, géneros e ISBN (ver search.py)
+class CatalogoBuscarView(View):
+    limite_maximo = 100
+
+    def get(self, request, *args, **kwargs):
+        texto = request.GET.get('q', '')
+        try:
+            limite = min(int(request.GET.get('limit', 20)), self.limite_maximo)
+        except ValueError:
+            limite = 20
+        libros = buscar_catalogo(texto, max(limite, 1))
+        return JsonResponse({
+            'q': texto,
+            'resultados': [
+                {
+                    'isbn': l.isbn,
+                    'title': l.title,
+                    'autor_principal': l.autor_principal,
+                    'generos': l.generos,
+                    'estado_disponibilidad': l.estado_disponibilidad,
+                    'rank': round(l.rank, 4),
+                    'origen': l.origen,
+                }
+                for l in libros
+            ],
+        })
+
+
+# 1.1c Mejor valorados: de `Book.rating_avg` por el índice book_mejor_valorado_idx
+class MejorValoradosView(View):
+    limite_maximo = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limite = min(int(request.GET.get('limit', 20)), self.limite_maximo)
+            min_resenas = int(request.GET.get('min_resenas', 1))
+        except ValueError:
+            limite, min_resenas = 20, 1
+        min_resenas = max(min_resenas, 1)
+        libros = (
+            Book.objects.filter(rating_count__gte=min_resenas)
+            .order_by('-rating_avg', '-rating_count', 'isbn')
+            .values('isbn', 'title', 'rating_avg', 'rating_count')[:max(limite, 1)]
+        )
+        return JsonResponse({
+            'min_resenas': min_resenas,
+            'libros': [
+                {
+                    'isbn': l['isbn'],
+                    'title': l['title'],
+                    'rating_promedio': float(l['rating_avg']),
+                    'total_reviews': l['rating_count'],
+                }
+                for l in libros
+            ],
+        })
 
 
 # 1.2 Detalle (opcional)
-class LibroDetailView(DetailView):
+class LibroDetailView(DetallePorFuncionMixin, DetailView):
     model = CatalogoLibros
     template_name = "biblioteca/libro_detail.html"
     pk_url_kwarg = "isbn"
     context_object_name = "libro"
+    funcion_sql = "catalogo_libro"
+
+    def get_funcion_sql(self):
+        # La tabla materializada ya tiene la fila (por clave primaria)
+        if getattr(settings, "CATALOGO_MATERIALIZADO", True):
+            return None
+        return super().get_funcion_sql()
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['tambien_prestados'] = tambien_prestados(self.object.isbn)
+        return ctx
+
+
+# 1.2b «Los lectores también pidieron» en JSON (ver recomendaciones.py)
+class RecomendacionesView(View):
+    limite_maximo = 50
+
+    def get(self, request, isbn, *args, **kwargs):
+        try:
+            limite = min(int(request.GET.get('limit', 10)), self.limite_maximo)
+        except ValueError:
+            limite = 10
+        return JsonResponse({
+            'isbn': isbn,
+            'recomendaciones': [
+                {'isbn': l.isbn, 'title': l.title, 'score': l.score}
+                for l in tambien_prestados(isbn, max(limite, 1))
+            ],
+        })
+
+
+# 1.2c Reseñas más útiles de un libro, por el índice review_util_idx
+class ResenasUtilesView(View):
+    limite_maximo = 50
+
+    def get(self, request, isbn, *args, **kwargs):
+        try:
+            limite = min(int(request.GET.get('limit', 10)), self.limite_maximo)
+        except ValueError:
+            limite = 10
+        resenas = (
+            Review.objects.filter(book_id=isbn)
+            .order_by('-helpfulness', 'id')
+            .values('id', 'user__username', 'rating', 'comment', 'created_at',
+                    'upvotes', 'downvotes', 'helpfulness')[:max(limite, 1)]
+        )
+        return JsonResponse({
+            'isbn': isbn,
+            'resenas': [
+                {
+                    'id': r['id'],
+                    'usuario': r['user__username'],
+                    'rating': r['rating'],
+                    'comment': r['comment'],
+                    'created_at': r['created_at'],
+                    'upvotes': r['upvotes'],
+                    'downvotes': r['downvotes'],
+                    'helpfulness': round(r['helpfulness'], 4),
+                }
+                for r in resenas
+            ],
+        })
 
 
 # 1.3 Crear nuevo libro (actúa sobre Book)
-class BookCreateView(CreateView):
+class BookCreateView(AutocompletarFormMixin, CreateView):
     model = Book
     fields = [
         "isbn", "title", "published_year",
@@ -38,7 +245,7 @@ class BookCreateView(CreateView):
 
 
 # 1.4 Editar libro existente
-class BookUpdateView(UpdateView):
+class BookUpdateView(AutocompletarFormMixin, UpdateView):
     model = Book
     fields = [
         "title", "published_year",
@@ -60,28 +267,36 @@ class BookDeleteView(DeleteView):
     slug_url_kwarg     = "isbn"
 
 # 1) Lista de usuarios con su estado de préstamos
-class PrestamosUsuariosListView(ListView):
+class PrestamosUsuariosListView(KeysetPaginationMixin, ListView):
     model = PrestamosUsuarios
     template_name = "biblioteca/prestamos_list.html"
     context_object_name = "usuarios"
+    paginate_by = 50
+    keyset_fields = ("username", "usuario_id")
 
 
 # 2) Detalle de un usuario concreto
-class PrestamosUsuarioDetailView(DetailView):
+class PrestamosUsuarioDetailView(DetallePorFuncionMixin, DetailView):
     model = PrestamosUsuarios
     template_name = "biblioteca/prestamos_detail.html"
     pk_url_kwarg = "usuario_id"
     context_object_name = "usuario"
+    funcion_sql = "prestamos_usuario"
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         # traemos los préstamos reales de Loan para ese usuario
-        ctx["loans"] = Loan.objects.filter(user_id=self.object.usuario_id)
+        ctx["loans"] = Loan.objects.filter(user_id=self.object.usuario_id).select_related("copy")
+        # y, si se piden, los archivados (sin enlaces de edición)
+        ctx["historial"] = self.request.GET.get("historial") == "1"
+        if ctx["historial"]:
+            ctx["archivados"] = LoanArchive.objects.filter(
+                user_id=self.object.usuario_id).select_related("copy")
         return ctx
 
 
 # 3) Crear un nuevo préstamo
-class LoanCreateView(CreateView):
+class LoanCreateView(AutocompletarFormMixin, CreateView):
     model = Loan
     fields = [
         "due_date", #"returned_at",
@@ -90,9 +305,90 @@ class LoanCreateView(CreateView):
     template_name = "biblioteca/loan_form.html"
     success_url = reverse_lazy("prestamos-list")
 
+    def form_valid(self, form):
+        # Bloquea la copia elegida: dos mostradores no pueden prestarla a la vez
+        with transaction.atomic():
+            copia = Copy.objects.select_for_update().get(pk=form.cleaned_data["copy"].pk)
+            if not copia.is_available:
+                form.add_error("copy", "La copia ya está prestada.")
+                return self.form_invalid(form)
+            return super().form_valid(form)
+
+
+# 3b) Préstamo de cualquier copia disponible de un título (API)
+class CheckoutView(View):
+    """POST `isbn`, `user` y opcionalmente `branch` y `due_date` (AAAA-MM-DD).
+
+    Responde 201 con el préstamo creado o 409 si no quedan copias.
+    """
+    def post(self, request, *args, **kwargs):
+        datos = request.POST
+        if request.content_type == "application/json":
+            try:
+                datos = json.loads(request.body or b"{}")
+            except ValueError:
+                return JsonResponse({"error": "JSON inválido."}, status=400)
+        try:
+            isbn = str(datos["isbn"])
+            user_id = int(datos["user"])
+            branch_id = int(datos["branch"]) if datos.get("branch") else None
+            due_date = (date.fromisoformat(datos["due_date"])
+                        if datos.get("due_date") else None)
+        except (KeyError, TypeError, ValueError):
+            return JsonResponse(
+                {"error": "Se requieren 'isbn' y 'user' (y 'branch', 'due_date' válidos)."},
+                status=400,
+            )
+        try:
+            loan = checkout(isbn, user_id, branch_id=branch_id, due_date=due_date)
+        except CheckoutError as exc:
+            return JsonResponse({"error": str(exc)}, status=exc.status)
+        return JsonResponse({
+            "loan": loan.pk,
+            "copy": loan.copy_id,
+            "inventory_code": loan.copy.inventory_code,
+            "user": loan.user_id,
+            "due_date": loan.due_date.isoformat(),
+        }, status=201)
+
+
+# 3c) Devolución masiva (buzón de devoluciones): un UPDATE para N préstamos
+class DevolucionMasivaView(View):
+    """POST `loans` (ids) y/o `inventory_codes`, como listas JSON o campos
+    repetidos del formulario."""
+    def post(self, request, *args, **kwargs):
+        if request.content_type == "application/json":
+            try:
+                datos = json.loads(request.body or b"{}")
+                loans = [int(x) for x in datos.get("loans", [])]
+                codigos = [str(x) for x in datos.get("inventory_codes", [])]
+            except (ValueError, TypeError, AttributeError):
+                return JsonResponse({"error": "JSON inválido."}, status=400)
+        else:
+            try:
+                loans = [int(x) for x in request.POST.getlist("loans")]
+            except ValueError:
+                return JsonResponse({"error": "Ids de préstamo inválidos."}, status=400)
+            codigos = request.POST.getlist("inventory_codes")
+        if not loans and not codigos:
+            return JsonResponse({"error": "Indica 'loans' o 'inventory_codes'."}, status=400)
+
+        devueltos, multas = return_loans(loans, codigos)
+        encontrados_ids = {loan_id for loan_id, _, _ in devueltos}
+        encontrados_cod = {codigo for _, _, codigo in devueltos}
+        return JsonResponse({
+            "devueltos": len(devueltos),
+            "multas": multas,
+            "loans": sorted(encontrados_ids),
+            "no_encontrados": {
+                "loans": [x for x in loans if x not in encontrados_ids],
+                "inventory_codes": [x for x in codigos if x not in encontrados_cod],
+            },
+        })
+
 
 # 4) Editar un préstamo existente
-class LoanUpdateView(UpdateView):
+class LoanUpdateView(AutocompletarFormMixin, UpdateView):
     model = Loan
     fields = [
         "due_date", "returned_at",
@@ -111,18 +407,21 @@ class LoanDeleteView(DeleteView):
     success_url = reverse_lazy("prestamos-list")
 
 # 1) Lista de todas las sucursales con su actividad
-class SucursalesListView(ListView):
+class SucursalesListView(KeysetPaginationMixin, ListView):
     model = ActividadSucursales
     template_name = "biblioteca/sucursales_list.html"
     context_object_name = "sucursales"
+    paginate_by = 50
+    keyset_fields = ("nombre_sucursal", "sucursal_id")
 
 
 # 2) Detalle de una sucursal concreta
-class SucursalDetailView(DetailView):
+class SucursalDetailView(DetallePorFuncionMixin, DetailView):
     model = ActividadSucursales
     template_name = "biblioteca/sucursal_detail.html"
     pk_url_kwarg = "sucursal_id"
     context_object_name = "sucursal"
+    funcion_sql = "actividad_sucursal"
 
 
 # 3) Crear una nueva sucursal (Branch)
@@ -149,11 +448,37 @@ class BranchDeleteView(DeleteView):
 
 # REPORTES
 
-class CatalogoReportView(ListView):
+@lru_cache(maxsize=None)
+def condiciones_libro():
+    """Valores del ENUM `book_condition`: solo cambian con una migración, así
+    que se leen una vez por proceso y no en cada carga del reporte."""
+    with connection.cursor() as c:
+        c.execute("SELECT unnest(enum_range(NULL::book_condition))")
+        return tuple(row[0] for row in c.fetchall())
+
+
+class CatalogoReportView(ReportCacheMixin, StreamingCSVMixin, SinglePassReportMixin, ListView):
     model = CatalogoLibros
     template_name = "biblioteca/catalogo_report.html"
     context_object_name = "libros"
+    cache_family = "catalogo"
+    usar_replica = True
     paginate_by = 50
+    keyset_fields = ("title", "isbn")
+    chart_series = {
+        'cond': 'condition',
+        'disp': 'estado_disponibilidad',
+    }
+    csv_filename = "catalogo_libros.csv"
+    csv_columns = [
+        ('ISBN', 'isbn'), ('Título', 'title'), ('Autor', 'autor_principal'),
+        ('Año', 'published_year'), ('Condición', 'condition'),
+        ('Páginas', 'page_count'), ('Géneros', 'generos'),
+        ('Otros Autores', 'otros_autores'),
+        ('Total Copias', 'total_copias'), ('Disponibles', 'copias_disponibles'),
+        ('Reviews', 'total_reviews'),
+        ('Rating', 'rating_promedio'), ('Estado', 'estado_disponibilidad'),
+    ]
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -172,61 +497,63 @@ class CatalogoReportView(ListView):
             qs = qs.filter(rating_promedio__gte=params['min_rating'])
         return qs
 
-    def get(self, request, *args, **kwargs):
-        if request.GET.get('export') == 'csv':
-            qs = self.get_queryset()
-            resp = HttpResponse(content_type='text/csv')
-            resp['Content-Disposition'] = 'attachment; filename="catalogo_libros.csv"'
-            writer = csv.writer(resp)
-            writer.writerow([
-                'ISBN','Título','Autor','Año','Condición',
-                'Páginas','Géneros','Otros Autores',
-                'Total Copias','Disponibles','Reviews',
-                'Rating','Estado'
-            ])
-            for b in qs:
-                writer.writerow([
-                    b.isbn, b.title, b.autor_principal, b.published_year,
-                    b.condition, b.page_count, b.generos, b.otros_autores,
-                    b.total_copias, b.copias_disponibles, b.total_reviews,
-                    b.rating_promedio, b.estado_disponibilidad
-                ])
-            return resp
-        return super().get(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         qs = self.request.GET.copy()
-        qs.pop('page', None)
+        for k in ('page', 'after', 'before'):
+            qs.pop(k, None)
         ctx['querystring'] = qs.urlencode()
-        qs = self.get_queryset()
 
-        cond_counts = list(
-            qs.values('condition')
-              .annotate(total=Count('isbn'))
-              .order_by('condition')
-        )
-        disp_counts = list(
-            qs.values('estado_disponibilidad')
-              .annotate(total=Count('isbn'))
-        )
+        # Series calculadas junto con la página (SinglePassReportMixin)
+        cond_counts = self.chart_data['cond']
+        disp_counts = self.chart_data['disp']
 
-        ctx['cond_labels'] = json.dumps([d['condition'] for d in cond_counts])
-        ctx['cond_values'] = json.dumps([d['total']     for d in cond_counts])
-        ctx['disp_labels'] = json.dumps([d['estado_disponibilidad'] for d in disp_counts])
-        ctx['disp_values'] = json.dumps([d['total']                 for d in disp_counts])
+        ctx['cond_labels'] = json.dumps([k for k, _ in cond_counts])
+        ctx['cond_values'] = json.dumps([n for _, n in cond_counts])
+        ctx['disp_labels'] = json.dumps([k for k, _ in disp_counts])
+        ctx['disp_values'] = json.dumps([n for _, n in disp_counts])
 
-        with connection.cursor() as c:
-            c.execute("SELECT unnest(enum_range(NULL::book_condition));")
-            enum_vals = [row[0] for row in c.fetchall()]
-        ctx['condition_choices'] = [(v, v.title()) for v in enum_vals]
+        ctx['condition_choices'] = [(v, v.title()) for v in condiciones_libro()]
         return ctx
 
-class PrestamosUsuariosReportView(ListView):
+class HistorialMixin:
+    """Con `?historial=1` el reporte se calcula sobre `history_model` (la
+    variante de la vista que incluye `biblioteca_loan_archivo`). La caché ya
+    distingue por querystring."""
+    history_model = None
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        if request.GET.get("historial") == "1":
+            self.model = self.history_model
+
+
+class PrestamosUsuariosReportView(HistorialMixin, ReportCacheMixin, StreamingCSVMixin, SinglePassReportMixin, ListView):
     model = PrestamosUsuarios
+    history_model = PrestamosUsuariosHistorico
     template_name = "biblioteca/prestamos_usuarios_report.html"
     context_object_name = "usuarios"
+    cache_family = "prestamos"
+    usar_replica = True
     paginate_by = 50
+    keyset_fields = ("username", "usuario_id")
+    chart_series = {
+        'estado': 'estado_prestamos',
+        'con_multas': 'multas_pendientes > 0',
+    }
+    csv_filename = "prestamos_usuarios.csv"
+    csv_columns = [
+        ('Usuario ID', 'usuario_id'), ('Username', 'username'),
+        ('Nombre', 'nombre_completo'), ('Email', 'email'),
+        ('Estado Usuario', 'estado_usuario'),
+        ('Total Préstamos', 'total_prestamos'), ('Activos', 'prestamos_activos'),
+        ('Devueltos', 'prestamos_devueltos'), ('Vencidos', 'prestamos_vencidos'),
+        ('Total Multas', 'total_multas'), ('Multas Pendientes', 'multas_pendientes'),
+        ('Monto Multas Pendientes', 'monto_multas_pendientes'),
+        ('Reservas Totales', 'total_reservas'), ('Reservas Activas', 'reservas_activas'),
+        ('Reviews', 'total_reviews'), ('Fecha Alta', TruncDate('date_joined')),
+        ('Estado Préstamos', 'estado_prestamos'),
+    ]
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -258,47 +585,22 @@ class PrestamosUsuariosReportView(ListView):
 
         return qs
 
-    def get(self, request, *args, **kwargs):
-        if request.GET.get('export') == 'csv':
-            qs = self.get_queryset()
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="prestamos_usuarios.csv"'
-            writer = csv.writer(response)
-            writer.writerow([
-                'Usuario ID','Username','Nombre','Email','Estado Usuario',
-                'Total Préstamos','Activos','Devueltos','Vencidos',
-                'Total Multas','Multas Pendientes','Monto Multas Pendientes',
-                'Reservas Totales','Reservas Activas','Reviews','Fecha Alta',
-                'Estado Préstamos'
-            ])
-            for u in qs:
-                writer.writerow([
-                    u.usuario_id, u.username, u.nombre_completo, u.email, u.estado_usuario,
-                    u.total_prestamos, u.prestamos_activos, u.prestamos_devueltos, u.prestamos_vencidos,
-                    u.total_multas, u.multas_pendientes, u.monto_multas_pendientes,
-                    u.total_reservas, u.reservas_activas, u.total_reviews,
-                    u.date_joined.date(), u.estado_prestamos
-                ])
-            return response
-        return super().get(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         qs = self.request.GET.copy()
-        qs.pop('page', None)
+        for k in ('page', 'after', 'before'):
+            qs.pop(k, None)
         ctx['querystring'] = qs.urlencode()
-        qs = self.get_queryset()
 
-        # Distribución por estado de préstamos
-        estado_data = list(
-            qs.values('estado_prestamos')
-              .annotate(count=Count('usuario_id'))
-              .order_by('estado_prestamos')
-        )
+        # Distribución por estado de préstamos (calculada junto con la página)
+        estado_data = [
+            {'estado_prestamos': k, 'count': n} for k, n in self.chart_data['estado']
+        ]
         # Distribución de usuarios con multas pendientes > 0 / = 0
+        con_multas = dict(self.chart_data['con_multas'])
         multas_data = [
-            {'label': 'Con Multas Pendientes',    'value': qs.filter(multas_pendientes__gt=0).count()},
-            {'label': 'Sin Multas Pendientes',    'value': qs.filter(multas_pendientes=0).count()},
+            {'label': 'Con Multas Pendientes',    'value': con_multas.get(True, 0)},
+            {'label': 'Sin Multas Pendientes',    'value': con_multas.get(False, 0)},
         ]
 
         # Serializar para JS
@@ -313,11 +615,33 @@ class PrestamosUsuariosReportView(ListView):
 
         return ctx
 
-class ActividadSucursalesReportView(ListView):
+class ActividadSucursalesReportView(HistorialMixin, ReportCacheMixin, StreamingCSVMixin, SinglePassReportMixin, ListView):
     model = ActividadSucursales
+    history_model = ActividadSucursalesHistorico
     template_name = "biblioteca/actividad_sucursales_report.html"
     context_object_name = "sucursales"
+    cache_family = "sucursales"
+    usar_replica = True
     paginate_by = 50
+    keyset_fields = ("nombre_sucursal", "sucursal_id")
+    chart_series = {
+        'nivel': 'nivel_actividad',
+        'con_futuros': 'eventos_futuros > 0',
+    }
+    csv_filename = "actividad_sucursales.csv"
+    csv_columns = [
+        ('ID', 'sucursal_id'), ('Sucursal', 'nombre_sucursal'),
+        ('Dirección', 'address'), ('Teléfono', 'phone'),
+        ('Estantes', 'total_estantes'), ('Total Copias', 'total_copias'),
+        ('Prestadas', 'copias_prestadas'),
+        ('Préstamos Activos', 'prestamos_activos'), ('Vencidos', 'prestamos_vencidos'),
+        ('Eventos Totales', 'total_eventos'), ('Eventos Futuros', 'eventos_futuros'),
+        ('Asistencias', 'total_asistencias_eventos'),
+        ('% Ocupación', 'porcentaje_ocupacion'),
+        ('Prom Asistencia', 'promedio_asistencia_eventos'),
+        ('Fecha Creación', TruncDate('created_at')),
+        ('Nivel de Actividad', 'nivel_actividad'),
+    ]
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -349,50 +673,22 @@ class ActividadSucursalesReportView(ListView):
 
         return qs
 
-    def get(self, request, *args, **kwargs):
-        if request.GET.get('export') == 'csv':
-            qs = self.get_queryset()
-            resp = HttpResponse(content_type='text/csv')
-            resp['Content-Disposition'] = 'attachment; filename="actividad_sucursales.csv"'
-            writer = csv.writer(resp)
-            # Cabecera
-            writer.writerow([
-                'ID','Sucursal','Dirección','Teléfono',
-                'Estantes','Total Copias','Prestadas',
-                'Préstamos Activos','Vencidos',
-                'Eventos Totales','Eventos Futuros','Asistencias',
-                '% Ocupación','Prom Asistencia','Fecha Creación',
-                'Nivel de Actividad'
-            ])
-            for s in qs:
-                writer.writerow([
-                    s.sucursal_id, s.nombre_sucursal, s.address, s.phone,
-                    s.total_estantes, s.total_copias, s.copias_prestadas,
-                    s.prestamos_activos, s.prestamos_vencidos,
-                    s.total_eventos, s.eventos_futuros, s.total_asistencias_eventos,
-                    s.porcentaje_ocupacion, s.promedio_asistencia_eventos,
-                    s.created_at.date(), s.nivel_actividad
-                ])
-            return resp
-        return super().get(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         qs = self.request.GET.copy()
-        qs.pop('page', None)
+        for k in ('page', 'after', 'before'):
+            qs.pop(k, None)
         ctx['querystring'] = qs.urlencode()
-        qs = self.get_queryset()
 
-        # Distribución por nivel de actividad
-        nivel_data = list(
-            qs.values('nivel_actividad')
-              .annotate(count=Count('sucursal_id'))
-              .order_by('nivel_actividad')
-        )
+        # Distribución por nivel de actividad (calculada junto con la página)
+        nivel_data = [
+            {'nivel_actividad': k, 'count': n} for k, n in self.chart_data['nivel']
+        ]
         # Distribución de sucursales con/sin eventos futuros
+        con_futuros = dict(self.chart_data['con_futuros'])
         futuros_data = [
-            {'label': 'Con eventos futuros',    'value': qs.filter(eventos_futuros__gt=0).count()},
-            {'label': 'Sin eventos futuros',    'value': qs.filter(eventos_futuros=0).count()},
+            {'label': 'Con eventos futuros',    'value': con_futuros.get(True, 0)},
+            {'label': 'Sin eventos futuros',    'value': con_futuros.get(False, 0)},
         ]
 
         # Serializar para Chart.js
@@ -404,4 +700,97 @@ class ActividadSucursalesReportView(ListView):
         # Choices para el dropdown de nivel_actividad
         ctx['nivel_choices'] = [(d['nivel_actividad'], d['nivel_actividad']) for d in nivel_data]
 
-        return ctx
\ No newline at end of file
+        return ctx
+
+class TendenciaCirculacionReportView(ReportCacheMixin, StreamingCSVMixin, KeysetPaginationMixin, ListView):
+    """Tendencia de circulación por periodo y sucursal, leída solo del resumen
+    `circulation_daily` (migración 0016), sin tocar préstamos ni multas.
+
+    Filtros: `desde`/`hasta` (por defecto, el último año; `hasta` nunca pasa
+    de hoy), `granularidad` (dia, semana o mes), `sucursal` (id) e `isbn`.
+
+    La página HTML va por cursor, sucursal a sucursal y en orden de periodo
+    (un año por días y 200 sucursales son 73.000 filas); el CSV lleva todo.
+    """
+    model = CirculationDaily
+    template_name = "biblioteca/circulacion_report.html"
+    context_object_name = "filas"
+    cache_family = "prestamos"
+    usar_replica = True
+    paginate_by = 50
+    # Las copias sin estante (branch_id NULL) van como sucursal 0, la primera
+    keyset_fields = ("sucursal_orden", "periodo")
+    dias_por_defecto = 365
+    granularidades = {"dia": "day", "semana": "week", "mes": "month"}
+    csv_filename = "tendencia_circulacion.csv"
+    csv_columns = [
+        ('Periodo', 'periodo'), ('Sucursal ID', 'branch_id'), ('Sucursal', 'sucursal'),
+        ('Préstamos', 'prestamos'), ('Devoluciones', 'devoluciones'),
+        ('Vencidos', 'vencidos'), ('Multas', 'multas'), ('Importe Multas', 'importe_multas'),
+    ]
+
+    def fecha(self, nombre):
+        try:
+            return date.fromisoformat(self.request.GET.get(nombre, ''))
+        except ValueError:
+            return None
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        # El día de vencimiento de un préstamo abierto se anota por adelantado
+        # (migración 0016) y no es un hecho hasta que llega: nada posterior a hoy
+        hoy = timezone.now().date()
+        self.hasta = min(self.fecha('hasta') or hoy, hoy)
+        self.desde = self.fecha('desde') or self.hasta - timedelta(days=self.dias_por_defecto - 1)
+        self.granularidad = request.GET.get('granularidad')
+        if self.granularidad not in self.granularidades:
+            self.granularidad = 'semana'
+
+    def get_queryset(self):
+        qs = super().get_queryset().filter(day__range=(self.desde, self.hasta))
+        p = self.request.GET
+        if p.get('sucursal', '').isdigit():
+            qs = qs.filter(branch_id=p['sucursal'])
+        if p.get('isbn'):
+            qs = qs.filter(book_id=p['isbn'])
+        periodo = Trunc('day', self.granularidades[self.granularidad], output_field=DateField())
+        return (
+            qs.annotate(periodo=periodo, sucursal_orden=Coalesce('branch_id', 0))
+              .values('periodo', 'sucursal_orden', 'branch_id')
+              .annotate(
+                  # Como agregado y no en el GROUP BY: con el nombre en la
+                  # clave el planificador sobrestima los grupos y ordena en disco
+                  sucursal=Min('branch__name'),
+                  prestamos=Sum('loans_opened'), devoluciones=Sum('loans_returned'),
+                  vencidos=Sum('overdue'), multas=Sum('fines_issued'),
+                  importe_multas=Sum('fine_amount'),
+              )
+              .order_by('periodo', 'sucursal')
+        )
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        filas = ctx['filas']
+
+        # Una serie de préstamos por sucursal sobre los periodos de la página
+        periodos = sorted({f['periodo'] for f in filas})
+        indice = {p: i for i, p in enumerate(periodos)}
+        series = {}
+        for f in filas:
+            nombre = f['sucursal'] or 'Sin sucursal'
+            serie = series.setdefault(nombre, [0] * len(periodos))
+            serie[indice[f['periodo']]] = f['prestamos']
+        # Los nombres de sucursal los escriben usuarios: a la plantilla con json_script
+        ctx['periodo_labels'] = [p.isoformat() for p in periodos]
+        ctx['series_prestamos'] = [{'label': nombre, 'data': datos} for nombre, datos in series.items()]
+
+        qs = self.request.GET.copy()
+        for k in ('after', 'before'):
+            qs.pop(k, None)
+        ctx['querystring'] = qs.urlencode()
+
+        ctx['desde'], ctx['hasta'] = self.desde, self.hasta
+        ctx['granularidad'] = self.granularidad
+        ctx['granularidad_choices'] = [('dia', 'Día'), ('semana', 'Semana'), ('mes', 'Mes')]
+        ctx['sucursales'] = Branch.objects.order_by('name').values_list('id', 'name')
+        return ctx
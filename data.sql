@@ -2087,4 +2087,48 @@ SELECT setval(
 SELECT setval(
   pg_get_serial_sequence('biblioteca_branch','id'),
   COALESCE(MAX(id),0)
-) FROM biblioteca_branch;
\ No newline at end of file
+) FROM biblioteca_branch;
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_shelf','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_shelf;
+
+SELECT setval(
+  pg_get_serial_sequence('library_users','id'),
+  COALESCE(MAX(id),0)
+) FROM library_users;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_author','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_author;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_genre','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_genre;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_copy','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_copy;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_paymentmethod','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_paymentmethod;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_payment','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_payment;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_event','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_event;
+
+SELECT setval(
+  pg_get_serial_sequence('biblioteca_review','id'),
+  COALESCE(MAX(id),0)
+) FROM biblioteca_review;
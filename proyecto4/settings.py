@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,9 +39,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    'biblioteca.middleware.InstrumentacionSQLMiddleware',
+    'biblioteca.middleware.ReplicaLecturaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,9 +85,91 @@ DATABASES = {
         'PASSWORD': 'password',
         'HOST': 'localhost',
         'PORT': '5432',
+        # Formato fijo de `money` en texto para biblioteca/adapters.py
+        'OPTIONS': {'options': '-c lc_monetary=C'},
     }
 }
 
+# Réplica de lectura para reportes (biblioteca/routers.py): se activa con
+# REPLICA_HOST; sin ella todo va a `default`.
+REPLICA_ALIAS = 'replica'
+if os.environ.get('REPLICA_HOST'):
+    DATABASES[REPLICA_ALIAS] = {
+        **DATABASES['default'],
+        'HOST': os.environ['REPLICA_HOST'],
+        'PORT': os.environ.get('REPLICA_PORT', '5432'),
+        'OPTIONS': {**DATABASES['default']['OPTIONS'], 'connect_timeout': 2},
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['biblioteca.routers.ReplicaRouter']
+# Retraso máximo (s) para leer de la réplica y cada cuánto se comprueba
+REPLICA_RETRASO_MAX = 10
+REPLICA_COMPROBAR_CADA = 5
+# Segundos que un navegador lee de la primaria tras escribir
+REPLICA_FIJAR_PRIMARIA = 15
+
+# Catálogo: leer de la tabla materializada `mv_catalogo_libros` (True)
+# o de la vista en vivo `vista_catalogo_libros` (False).
+CATALOGO_MATERIALIZADO = True
+
+# Caché de reportes: compartida entre procesos para que
+# `manage.py escuchar_reportes` pueda invalidarla (crear con createcachetable).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reportes': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'reportes_cache',
+    },
+    # Los contadores de generación, en su propia tabla: al pasar de
+    # MAX_ENTRIES, 'reportes' borra claves por orden y llegaría a
+    # `reportes:gen:*`, con lo que volverían páginas viejas de generaciones bajas
+    'reportes_generaciones': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'reportes_generaciones',
+    },
+}
+REPORTES_CACHE = 'reportes'
+REPORTES_GENERACIONES_CACHE = 'reportes_generaciones'
+REPORTES_CACHE_TIMEOUT = 300
+
+# Total mostrado en los reportes paginados: "exacto" (COUNT) o "estimado"
+# (filas previstas por el planificador, sin recorrer la vista).
+REPORTES_CONTEO = "exacto"
+
+# Reportes asíncronos (async_views.py): página y series en dos consultas a la
+# vez en lugar de una. Recorre la vista dos veces; con una sola CPU en la base
+# es más lento (mídelo con `manage.py bench_asgi --paralelo`).
+REPORTES_PARALELO = False
+
+# Auditoría: meses completos que conserva `manage.py particiones_auditlog`
+# (además del actual); None para no borrar nunca.
+AUDITLOG_RETENCION_MESES = 24
+
+# Préstamos: años (contando el actual) que `manage.py archivar_prestamos` deja
+# en biblioteca_loan; los anteriores pasan a biblioteca_loan_archivo.
+PRESTAMOS_ANIOS_ACTIVOS = 2
+
+# Instrumentación SQL por petición (biblioteca/middleware.py): fracción de
+# peticiones medidas, sentencias lentas que se registran, repeticiones de una
+# misma SQL a partir de las que se marca como N+1 y si se envía Server-Timing.
+SQL_MUESTREO = 1.0 if DEBUG else 0.01
+SQL_LENTAS = 5
+SQL_REPETIDAS_MIN = 3
+SQL_SERVER_TIMING = DEBUG
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'biblioteca.sql': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
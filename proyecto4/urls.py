@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 import biblioteca.views as views
+import biblioteca.async_views as async_views
+import biblioteca.autocomplete as autocomplete
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,18 +27,26 @@ urlpatterns = [
     path('reportes/catalogo/', views.CatalogoReportView.as_view(), name='catalogo-report'),
     path('reportes/prestamos/', views.PrestamosUsuariosReportView.as_view(), name='prestamos-report'),
     path('reportes/sucursales/', views.ActividadSucursalesReportView.as_view(), name='sucursales-report'),
+    path('reportes/circulacion/', views.TendenciaCirculacionReportView.as_view(), name='circulacion-report'),
 
     # CRUD de Catálogo
     path("catalogo/", views.CatalogoListView.as_view(), name="catalogo-list"),
     path("catalogo/add/", views.BookCreateView.as_view(), name="book-add"),
+    path("catalogo/buscar/", views.CatalogoBuscarView.as_view(), name="catalogo-buscar"),
+    path("catalogo/mejor-valorados/", views.MejorValoradosView.as_view(), name="catalogo-mejor-valorados"),
     path("catalogo/<str:pk>/edit/", views.BookUpdateView.as_view(), name="book-edit"),
     path("catalogo/<str:pk>/delete/", views.BookDeleteView.as_view(), name="book-delete"),
     path("catalogo/<str:isbn>/", views.LibroDetailView.as_view(), name="catalogo-detail"),
+    path("catalogo/<str:isbn>/recomendaciones/", views.RecomendacionesView.as_view(),
+         name="catalogo-recomendaciones"),
+    path("catalogo/<str:isbn>/resenas/", views.ResenasUtilesView.as_view(), name="catalogo-resenas"),
 
     # CRUD de Préstamos
     path("prestamos/", views.PrestamosUsuariosListView.as_view(), name="prestamos-list"),
     path("prestamos/<int:usuario_id>/", views.PrestamosUsuarioDetailView.as_view(), name="prestamos-detail"),
     path("prestamos/add/", views.LoanCreateView.as_view(), name="loan-add"),
+    path("prestamos/checkout/", views.CheckoutView.as_view(), name="loan-checkout"),
+    path("prestamos/devolver/", views.DevolucionMasivaView.as_view(), name="loan-bulk-return"),
     path("prestamos/<int:pk>/edit/", views.LoanUpdateView.as_view(), name="loan-edit"),
     path("prestamos/<int:pk>/delete/", views.LoanDeleteView.as_view(), name="loan-delete"),
 
@@ -46,4 +56,17 @@ urlpatterns = [
     path("sucursales/add/", views.BranchCreateView.as_view(), name="branch-add"),
     path("sucursales/<int:pk>/edit/", views.BranchUpdateView.as_view(), name="branch-edit"),
     path("sucursales/<int:pk>/delete/", views.BranchDeleteView.as_view(), name="branch-delete"),
+
+    # Listados y reportes asíncronos (para servir con ASGI, ver async_views.py)
+    path('a/reportes/catalogo/', async_views.CatalogoReportAsyncView.as_view(), name='catalogo-report-async'),
+    path('a/reportes/prestamos/', async_views.PrestamosUsuariosReportAsyncView.as_view(), name='prestamos-report-async'),
+    path('a/reportes/sucursales/', async_views.ActividadSucursalesReportAsyncView.as_view(), name='sucursales-report-async'),
+    path("a/catalogo/", async_views.CatalogoListAsyncView.as_view(), name="catalogo-list-async"),
+    path("a/prestamos/", async_views.PrestamosUsuariosListAsyncView.as_view(), name="prestamos-list-async"),
+    path("a/sucursales/", async_views.SucursalesListAsyncView.as_view(), name="sucursales-list-async"),
+
+    # Autocompletado de claves foráneas (ver autocomplete.py)
+    path("autocompletar/copias/", autocomplete.CopiasAutocompletarView.as_view(), name="autocompletar-copias"),
+    path("autocompletar/usuarios/", autocomplete.UsuariosAutocompletarView.as_view(), name="autocompletar-usuarios"),
+    path("autocompletar/autores/", autocomplete.AutoresAutocompletarView.as_view(), name="autocompletar-autores"),
 ]